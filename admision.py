@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Carriles de la cola de admisión: los prioritarios (operadores de la interfaz y
+# lecturas con síntomas visuales) se atienden antes que la telemetría masiva
+PRIORITARIO = 0
+MASIVO = 1
+NOMBRES_CARRILES = ("prioritario", "masivo")
+
+# Valores del encabezado X-Prioridad
+CARRIL_POR_PRIORIDAD = {b"interactiva": PRIORITARIO, b"masiva": MASIVO}
+
+# sintomas_visuales verdadero en cualquiera de las formas que acepta pydantic: true, 1, 1.0 o "true", "1", "yes", "on", "t", "y" sin distinguir mayúsculas
+PATRON_SINTOMAS = re.compile(rb'"sintomas_visuales"\s*:\s*(?:true|1(?:\.0*)?(?![\d.eE])|"(?i:true|1|yes|on|t|y)")')
+
+class Rechazo(Exception):
+    """Solicitud rechazada por cuota (429) o sobrecarga (503), con los segundos sugeridos para reintentar"""
+    
+    def __init__(self, estado: int, detalle: str, reintentar_en: float):
+        super().__init__(detalle)
+        self.estado = estado
+        self.detalle = detalle
+        self.reintentar_en = reintentar_en
+
+class CuotasClientes:
+    """
+    Cubo de fichas por cliente: se recarga a `tasa` fichas por segundo hasta
+    `rafaga` y cada solicitud consume una. Los cubos se recargan al consultarlos
+    (sin tareas de fondo) y se descartan los de los clientes menos activos al
+    superar `max_clientes`. Con `tasa` 0 las cuotas están deshabilitadas.
+    """
+    
+    def __init__(self, tasa: float, rafaga: float, max_clientes: int = 10000):
+        self.tasa = tasa
+        self.rafaga = max(rafaga, 1.0)
+        self.max_clientes = max_clientes
+        # cliente -> [fichas, momento de la última recarga]
+        self._cubos: OrderedDict[str, list] = OrderedDict()
+        self.aceptadas = 0
+        self.rechazadas = 0
+    
+    @property
+    def habilitadas(self) -> bool:
+        return self.tasa > 0
+    
+    def consumir(self, cliente: str, fichas: float = 1.0) -> float:
+        """Descuenta fichas del cubo del cliente; devuelve 0 si alcanzaron o los segundos hasta que alcancen"""
+        ahora = time.monotonic()
+        cubo = self._cubos.get(cliente)
+        if cubo is None:
+            cubo = self._cubos[cliente] = [self.rafaga, ahora]
+            while len(self._cubos) > self.max_clientes:
+                self._cubos.popitem(last=False)
+        else:
+            self._cubos.move_to_end(cliente)
+            cubo[0] = min(self.rafaga, cubo[0] + (ahora - cubo[1]) * self.tasa)
+            cubo[1] = ahora
+        
+        if cubo[0] >= fichas:
+            cubo[0] -= fichas
+            self.aceptadas += 1
+            return 0.0
+        self.rechazadas += 1
+        return (fichas - cubo[0]) / self.tasa
+    
+    def estadisticas(self) -> dict:
+        return {
+            "habilitadas": self.habilitadas,
+            "tasa_por_segundo": self.tasa,
+            "rafaga": self.rafaga,
+            "clientes": len(self._cubos),
+            "aceptadas": self.aceptadas,
+            "rechazadas": self.rechazadas
+        }
+
+class ControlAdmision:
+    """
+    Concurrencia acotada con cola por prioridad y presupuesto de espera. Hasta
+    `max_concurrencia` solicitudes se atienden a la vez; las demás esperan en un
+    heap ordenado por carril y llegada. Una solicitud se rechaza enseguida si la
+    espera estimada (solicitudes delante por la duración media, repartidas
+    entre los lugares) supera el presupuesto o la cola está llena, y también si
+    espera más que el presupuesto. La telemetría masiva se rechaza además cuando
+    el retraso del loop de eventos ya supera el presupuesto, de modo que la
+    latencia de los diagnósticos prioritarios se mantiene acotada.
+    """
+    
+    def __init__(
+        self,
+        max_concurrencia: int = 32,
+        presupuesto_cola_segundos: float = 0.25,
+        max_cola: int = 1000,
+        retraso_loop: Optional[Callable[[], float]] = None
+    ):
+        self.max_concurrencia = max_concurrencia
+        self.presupuesto = presupuesto_cola_segundos
+        self.max_cola = max_cola
+        self.retraso_loop = retraso_loop
+        self.en_curso = 0
+        # (carril, orden de llegada, futuro); los futuros cancelados o vencidos se descartan al liberar
+        self._cola: list = []
+        self._llegadas = itertools.count()
+        self._esperando = [0, 0]
+        # Media móvil exponencial del tiempo que cada solicitud ocupa su lugar
+        self.duracion_media = 0.0
+        self.admitidas = [0, 0]
+        self.rechazadas = [0, 0]
+        self.vencidas = [0, 0]
+        self.espera_maxima = [0.0, 0.0]
+    
+    def espera_estimada(self, carril: int) -> float:
+        delante = self._esperando[PRIORITARIO] if carril == PRIORITARIO else sum(self._esperando)
+        return (delante + 1) * self.duracion_media / self.max_concurrencia
+    
+    def _rechazar(self, carril: int, detalle: str, reintentar_en: float) -> Rechazo:
+        self.rechazadas[carril] += 1
+        return Rechazo(503, detalle, max(reintentar_en, self.espera_estimada(MASIVO)))
+    
+    async def entrar(self, carril: int) -> float:
+        """Espera un lugar libre y devuelve los segundos de espera; lanza Rechazo si no hay lugar a tiempo"""
+        if carril == MASIVO and self.retraso_loop is not None:
+            retraso = self.retraso_loop()
+            if retraso > self.presupuesto:
+                raise self._rechazar(carril, "Servicio sobrecargado: se atienden sólo diagnósticos prioritarios", retraso)
+        
+        delante = self._esperando[PRIORITARIO] if carril == PRIORITARIO else sum(self._esperando)
+        if self.en_curso < self.max_concurrencia and delante == 0:
+            self.en_curso += 1
+            self.admitidas[carril] += 1
+            return 0.0
+        
+        if sum(self._esperando) >= self.max_cola or self.espera_estimada(carril) > self.presupuesto:
+            raise self._rechazar(carril, "Servicio sobrecargado: la espera supera el presupuesto", self.presupuesto)
+        
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._cola, (carril, next(self._llegadas), futuro))
+        self._esperando[carril] += 1
+        inicio = time.monotonic()
+        try:
+            await asyncio.wait_for(futuro, self.presupuesto)
+        except asyncio.TimeoutError:
+            # El lugar pudo cederse justo al vencer la espera: se libera para el siguiente
+            if futuro.done() and not futuro.cancelled():
+                self.salir()
+            self.vencidas[carril] += 1
+            raise self._rechazar(carril, "Servicio sobrecargado: se agotó el tiempo de espera", self.presupuesto) from None
+        except asyncio.CancelledError:
+            # El cliente se fue justo cuando se le cedía el lugar: se libera para el siguiente
+            if futuro.done() and not futuro.cancelled():
+                self.salir()
+            raise
+        finally:
+            self._esperando[carril] -= 1
+        
+        espera = time.monotonic() - inicio
+        self.espera_maxima[carril] = max(self.espera_maxima[carril], espera)
+        self.admitidas[carril] += 1
+        return espera
+    
+    def salir(self, duracion: Optional[float] = None) -> None:
+        """Libera el lugar (cediéndolo al primero en espera) y actualiza la duración media"""
+        if duracion is not None:
+            self.duracion_media = duracion if self.duracion_media == 0 else 0.9 * self.duracion_media + 0.1 * duracion
+        while self._cola:
+            _, _, futuro = heapq.heappop(self._cola)
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.en_curso -= 1
+    
+    def estadisticas(self) -> dict:
+        estadisticas = {
+            "max_concurrencia": self.max_concurrencia,
+            "presupuesto_cola_segundos": self.presupuesto,
+            "en_curso": self.en_curso,
+            "duracion_media_segundos": round(self.duracion_media, 6)
+        }
+        for carril, nombre in enumerate(NOMBRES_CARRILES):
+            estadisticas[f"{nombre}_esperando"] = self._esperando[carril]
+            estadisticas[f"{nombre}_admitidas"] = self.admitidas[carril]
+            estadisticas[f"{nombre}_rechazadas"] = self.rechazadas[carril]
+            estadisticas[f"{nombre}_vencidas"] = self.vencidas[carril]
+            estadisticas[f"{nombre}_espera_maxima_segundos"] = round(self.espera_maxima[carril], 6)
+        return estadisticas
+
+class MiddlewareAdmision:
+    """
+    Middleware ASGI de control de admisión para las rutas de diagnóstico
+    (`rutas`: ruta -> carril fijo, o None para clasificar cada solicitud).
+    Aplica la cuota del cliente y luego espera lugar en el control de admisión.
+    El cliente es la dirección de la conexión; el encabezado X-Cliente sólo se
+    tiene en cuenta si la conexión viene de uno de los `proxies_confiables`,
+    porque cualquiera puede enviarlo para repartir sus solicitudes entre cuotas. En las rutas sin carril
+    fijo, el carril se toma del encabezado X-Prioridad (interactiva o masiva);
+    si no lo hay, las lecturas con síntomas visuales van al carril prioritario. Los rechazos responden
+    429 o 503 con Retry-After sin llegar a la aplicación.
+    """
+    
+    def __init__(
+        self,
+        app,
+        control: ControlAdmision,
+        cuotas: CuotasClientes,
+        rutas: dict,
+        max_bytes_clasificacion: int = 64 * 1024,
+        proxies_confiables: frozenset = frozenset()
+    ):
+        self.app = app
+        self.control = control
+        self.cuotas = cuotas
+        self.rutas = rutas
+        self.proxies_confiables = proxies_confiables
+        self.max_bytes_clasificacion = max_bytes_clasificacion
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.rutas:
+            await self.app(scope, receive, send)
+            return
+        
+        encabezados = dict(scope["headers"])
+        try:
+            if self.cuotas.habilitadas:
+                cliente = (scope.get("client") or ("",))[0]
+                if cliente in self.proxies_confiables:
+                    cliente = encabezados.get(b"x-cliente", b"").decode("latin-1") or cliente
+                faltan = self.cuotas.consumir(cliente)
+                if faltan > 0:
+                    raise Rechazo(429, "Se superó la cuota de solicitudes del cliente", faltan)
+            
+            # El encabezado sólo elige carril en las rutas sin carril fijo: los lotes y barridos siguen siendo masivos
+            carril = self.rutas[scope["path"]]
+            if carril is None:
+                carril = CARRIL_POR_PRIORIDAD.get(encabezados.get(b"x-prioridad", b"").strip().lower())
+            if carril is None:
+                carril, receive = await self._clasificar(receive)
+            
+            await self.control.entrar(carril)
+        except Rechazo as rechazo:
+            await self._responder_rechazo(send, rechazo)
+            return
+        
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.control.salir(time.perf_counter() - inicio)
+    
+    async def _clasificar(self, receive) -> tuple:
+        """
+        Lee el comienzo del cuerpo para ver si la lectura tiene síntomas visuales;
+        devuelve el carril y un receive que vuelve a entregar lo leído a la aplicación
+        """
+        leidos = []
+        tamano = 0
+        mas = True
+        while mas and tamano <= self.max_bytes_clasificacion:
+            mensaje = await receive()
+            leidos.append(mensaje)
+            if mensaje["type"] != "http.request":
+                break
+            tamano += len(mensaje.get("body", b""))
+            mas = mensaje.get("more_body", False)
+        
+        cuerpo = b"".join(mensaje.get("body", b"") for mensaje in leidos)
+        carril = PRIORITARIO if PATRON_SINTOMAS.search(cuerpo) else MASIVO
+        
+        async def recibir():
+            if leidos:
+                return leidos.pop(0)
+            return await receive()
+        
+        return carril, recibir
+    
+    async def _responder_rechazo(self, send, rechazo: Rechazo) -> None:
+        cuerpo = json.dumps({"detail": rechazo.detalle}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": rechazo.estado,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(cuerpo)).encode()),
+                (b"retry-after", str(max(1, math.ceil(rechazo.reintentar_en))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": cuerpo})
@@ -1,355 +1,1325 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from typing import Optional, Literal
-from enum import Enum
+from fastapi import FastAPI, HTTPException, Body, Request, Query, Path, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Any, Literal
+from collections import OrderedDict
+from bisect import bisect_left
+from operator import attrgetter, truediv
+from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import json
+import os
+import time
 import uvicorn
 
+from cache_diagnostico import CacheLRU, VueloUnico
+from notificaciones import CanalDiagnosticos
+from series_temporales import AlmacenSeries, COLUMNAS_SERIE
+from metricas import RegistroMetricas, MiddlewareMetricas, MonitorLoop
+from admision import ControlAdmision, CuotasClientes, MiddlewareAdmision, MASIVO
+from flota import EstadoFlota
+from tendencias import AnalizadorTendencias, accion_predictiva
+from trabajos import GestorTrabajos
+from historial import HistorialDiagnosticos, ORDEN_PRIORIDAD
+from seguimientos import ProgramadorSeguimientos, WebhookRecordatorios
+from barridos import MAX_EJES, MAX_CELDAS, cantidad_pasos, valores_eje, barrer
+from reglas_diagnostico import (
+    CultivoEnum,
+    EtapaEnum,
+    SintomaEnum,
+    ParametrosAmbientales,
+    DiagnosticoInput,
+    Accion,
+    DiagnosticoOutput,
+    PATRON_INVERNADERO_ID,
+    CampoRegla,
+    CatalogoReglas,
+    DiagnosticoHidroponico,
+    VigilanteReglas,
+    reglas_activas,
+    serializar_diagnostico,
+    describir_error_validacion,
+    precalentar_reglas
+)
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    """Inicio y cierre ordenado de los servicios internos"""
+    # Se completa antes de que el servidor empiece a aceptar conexiones
+    precalentar_reglas()
+    MONITOR_LOOP.iniciar()
+    VIGILANTE_REGLAS.iniciar()
+    if HISTORIAL is not None:
+        HISTORIAL.iniciar()
+    if SEGUIMIENTOS is not None:
+        SEGUIMIENTOS.iniciar()
+    if ALMACEN_SERIES is not None:
+        ALMACEN_SERIES.iniciar()
+    yield
+    await VIGILANTE_REGLAS.detener()
+    if HISTORIAL is not None:
+        await HISTORIAL.detener()
+    if SEGUIMIENTOS is not None:
+        await SEGUIMIENTOS.detener()
+    if WEBHOOK_RECORDATORIOS is not None:
+        await WEBHOOK_RECORDATORIOS.cerrar()
+    await GESTOR_TRABAJOS.cerrar()
+    await MONITOR_LOOP.detener()
+    if ALMACEN_SERIES is not None:
+        await ALMACEN_SERIES.detener()
+
 # Configuración de la aplicación
 app = FastAPI(
     title="Sistema de Diagnóstico Hidropónico - Tierra del Fuego",
     description="API para diagnóstico automatizado de sistemas hidropónicos adaptado al clima de Tierra del Fuego",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_de_vida
+)
+
+# Métricas del servicio (expuestas en /metrics en formato Prometheus)
+METRICAS = RegistroMetricas("hidroponia")
+LATENCIA_SOLICITUDES = METRICAS.histograma(
+    "solicitudes_duracion_segundos", "Duración de las solicitudes HTTP por ruta", ("metodo", "ruta")
+)
+SOLICITUDES_EN_CURSO = METRICAS.medidor("solicitudes_en_curso", "Solicitudes HTTP en curso", ("metodo",))
+RESPUESTAS = METRICAS.contador("respuestas_total", "Respuestas HTTP por ruta y código", ("metodo", "ruta", "estado"))
+VALIDACIONES_FALLIDAS = METRICAS.contador(
+    "validaciones_fallidas_total", "Entradas rechazadas por validación", ("ruta",)
+)
+ACCIONES_EMITIDAS = METRICAS.contador("acciones_total", "Acciones recomendadas por tipo y prioridad", ("tipo", "prioridad"))
+REGLAS_DISPARADAS = METRICAS.contador("reglas_disparadas_total", "Reglas del árbol de decisión disparadas", ("regla",))
+PARAMETROS_CRITICOS = METRICAS.contador(
+    "parametros_criticos_total", "Parámetros detectados fuera de rango", ("parametro",)
+)
+RETRASO_LOOP = METRICAS.medidor("loop_retraso_segundos", "Retraso del loop de eventos", ("estadistico",))
+TIEMPO_ACTIVO = METRICAS.medidor("tiempo_activo_segundos", "Segundos desde el inicio del servicio")
+ESTADO_COMPONENTES = METRICAS.medidor(
+    "componentes", "Contadores internos de cache, notificaciones y series", ("componente", "contador")
+)
+
+MONITOR_LOOP = MonitorLoop()
+
+# Control de admisión de las rutas de diagnóstico: concurrencia acotada con
+# carril prioritario, presupuesto de espera en cola y cuotas por cliente
+CONTROL_ADMISION = ControlAdmision(
+    max_concurrencia=int(os.getenv("ADMISION_MAX_CONCURRENCIA", "32")),
+    presupuesto_cola_segundos=float(os.getenv("ADMISION_PRESUPUESTO_COLA_SEGUNDOS", "0.25")),
+    max_cola=int(os.getenv("ADMISION_MAX_COLA", "1000")),
+    retraso_loop=lambda: MONITOR_LOOP.retraso_promedio
+)
+CUOTAS_CLIENTES = CuotasClientes(
+    tasa=float(os.getenv("CUOTA_CLIENTE_POR_SEGUNDO", "0")),
+    rafaga=float(os.getenv("CUOTA_CLIENTE_RAFAGA", "100"))
+)
+
+# Rutas con control de admisión -> carril fijo (None: según X-Prioridad o los síntomas de la lectura).
+# La ingesta NDJSON queda afuera: es una conexión larga que ocuparía un lugar todo el flujo.
+RUTAS_ADMISION = {
+    "/diagnostico": None,
+    "/diagnostico/incremental": None,
+    "/diagnostico/lote": MASIVO,
+    "/diagnostico/barrido": MASIVO
+}
+
+# Se agrega antes que el de métricas para que los rechazos también se midan
+app.add_middleware(
+    MiddlewareAdmision,
+    control=CONTROL_ADMISION,
+    cuotas=CUOTAS_CLIENTES,
+    rutas=RUTAS_ADMISION,
+    # Direcciones de los proxies cuyo encabezado X-Cliente identifica al cliente
+    proxies_confiables=frozenset(
+        direccion.strip() for direccion in os.getenv("ADMISION_PROXIES_CONFIABLES", "").split(",") if direccion.strip()
+    )
+)
+
+app.add_middleware(
+    MiddlewareMetricas,
+    latencia=LATENCIA_SOLICITUDES,
+    en_curso=SOLICITUDES_EN_CURSO,
+    respuestas=RESPUESTAS
 )
 
-# Enums para validación
-class CultivoEnum(str, Enum):
-    lechuga = "lechuga"
-    rucula = "rucula"
-    microgreens = "microgreens"
-    aromaticas = "aromaticas"
-
-class EtapaEnum(str, Enum):
-    germinacion = "germinacion"
-    crecimiento = "crecimiento"
-    pre_cosecha = "pre_cosecha"
-    cualquier_etapa = "cualquier_etapa"
-
-class SintomaEnum(str, Enum):
-    manchas_marrones_bordes_blandos = "manchas_marrones_bordes_blandos"
-    hojas_amarillas_desde_abajo = "hojas_amarillas_desde_abajo"
-    crecimiento_lento_raices_marrones = "crecimiento_lento_raices_marrones"
-
-# Modelos Pydantic
-class ParametrosAmbientales(BaseModel):
-    ph: float = Field(..., ge=0, le=14, description="pH de la solución nutritiva")
-    conductividad_electrica: float = Field(..., ge=0, description="CE en mS/cm")
-    temperatura_solucion: float = Field(..., description="Temperatura de la solución en °C")
-    humedad_relativa: float = Field(..., ge=0, le=100, description="Humedad relativa en %")
-    temperatura_ambiente: float = Field(..., description="Temperatura ambiente en °C")
-    horas_luz_diarias: float = Field(..., ge=0, le=24, description="Horas de luz diarias")
-    dias_desde_renovacion: int = Field(..., ge=0, description="Días desde la última renovación de solución")
-    bomba_oxigenacion_funcionando: bool = Field(True, description="Estado de la bomba de oxigenación")
-
-class DiagnosticoInput(BaseModel):
+# Modelos propios de la API
+class DiagnosticoPredictivoOutput(DiagnosticoOutput):
+    acciones_predictivas: Optional[list[Accion]] = Field(
+        None,
+        description="Acciones preventivas por tendencia (sólo si la lectura indica invernadero_id)"
+    )
+
+class DiagnosticoDelta(BaseModel):
+    invernadero_id: str
+    cambio: bool
+    diagnostico: str
+    acciones_agregadas: list[Accion]
+    acciones_resueltas: list[Accion]
+    parametros_criticos_agregados: list[str]
+    parametros_criticos_resueltos: list[str]
+    parametros_reevaluados: list[str]
+    version_reglas: Optional[str] = None
+
+class ResultadoLote(BaseModel):
+    indice: int
+    resultado: Optional[DiagnosticoOutput] = None
+    error: Optional[str] = None
+
+class DiagnosticoLoteOutput(BaseModel):
+    total: int
+    errores: int
+    resultados: list[ResultadoLote]
+
+class EjeBarrido(BaseModel):
+    parametro: CampoRegla
+    desde: float
+    hasta: float
+    paso: float = Field(..., gt=0)
+
+class BarridoInput(BaseModel):
     cultivo: CultivoEnum
     etapa: EtapaEnum
-    sintomas_visuales: bool = Field(False, description="¿Hay síntomas visuales alarmantes?")
-    tipo_sintoma: Optional[SintomaEnum] = None
-    parametros: ParametrosAmbientales
+    tipo_sintoma: Optional[SintomaEnum] = Field(None, description="Síntoma visual observado (ninguno por defecto)")
+    parametros: ParametrosAmbientales = Field(..., description="Valores de los parámetros que no se barren")
+    ejes: list[EjeBarrido] = Field(..., min_length=1, max_length=MAX_EJES)
 
-class Accion(BaseModel):
-    tipo: str
-    descripcion: str
-    prioridad: Literal["baja", "media", "alta", "critica"]
-    tiempo_revision: str
+# Cantidad máxima de lecturas aceptadas en un único lote
+MAX_LECTURAS_LOTE = 10000
 
-class DiagnosticoOutput(BaseModel):
-    diagnostico: str
-    acciones: list[Accion]
-    parametros_criticos: list[str]
-    observaciones_clima_fueguino: list[str]
-
-# Clase principal para el diagnóstico
-class DiagnosticoHidroponico:
-    
-    @staticmethod
-    def obtener_rangos_optimos(cultivo: str, etapa: str) -> dict:
-        """Obtiene los rangos óptimos según cultivo y etapa"""
-        rangos_base = {
-            "ph": (5.8, 6.2),
-            "ce": (1.4, 1.8),
-            "temp_solucion": (18, 22),
-            "humedad": (60, 75),
-            "horas_luz": (12, 16)
-        }
-        
-        # Ajustes específicos por cultivo
-        if cultivo == "microgreens":
-            rangos_base["ce"] = (1.2, 1.6)
-        elif cultivo == "aromaticas":
-            rangos_base["ce"] = (1.6, 2.0)
-            
-        return rangos_base
-    
-    @staticmethod
-    def diagnosticar_sintomas(tipo_sintoma: str, parametros: ParametrosAmbientales) -> DiagnosticoOutput:
-        """Diagnóstica basado en síntomas visuales"""
-        acciones = []
-        parametros_criticos = []
-        observaciones = []
-        
-        if tipo_sintoma == "manchas_marrones_bordes_blandos":
-            if parametros.humedad_relativa > 75:
-                diagnostico = "🍄 BOTRYTIS DETECTADO"
-                acciones = [
-                    Accion(
-                        tipo="fungicida",
-                        descripcion="Aplicar fungicida biológico",
-                        prioridad="critica",
-                        tiempo_revision="24 horas"
-                    ),
-                    Accion(
-                        tipo="ventilacion",
-                        descripcion="Reducir HR < 70% y aumentar ventilación",
-                        prioridad="critica",
-                        tiempo_revision="inmediato"
-                    )
-                ]
-                parametros_criticos = ["humedad_relativa"]
-                observaciones = ["Cuidado con vientos fueguinos al ventilar"]
-            else:
-                diagnostico = "Evaluar otras causas de manchas"
-                acciones = [
-                    Accion(
-                        tipo="monitoreo",
-                        descripcion="Verificar estabilidad de temperatura",
-                        prioridad="media",
-                        tiempo_revision="24 horas"
-                    )
-                ]
-                
-        elif tipo_sintoma == "hojas_amarillas_desde_abajo":
-            diagnostico = "Posible deficiencia nutricional"
-            if parametros.temperatura_ambiente < 10:
-                acciones = [
-                    Accion(
-                        tipo="calefaccion",
-                        descripcion="❄️ Ajustar calefacción invernadero y revisar aislamiento",
-                        prioridad="alta",
-                        tiempo_revision="inmediato"
-                    ),
-                    Accion(
-                        tipo="nutricion",
-                        descripcion="Aumentar nutrientes 10% por estrés por frío",
-                        prioridad="media",
-                        tiempo_revision="24 horas"
-                    )
-                ]
-                parametros_criticos = ["temperatura_ambiente"]
-                observaciones = ["Crítico en invierno fueguino"]
-            else:
-                acciones = [
-                    Accion(
-                        tipo="nutricion",
-                        descripcion="🌱 Revisar formulación NPK según etapa de cultivo",
-                        prioridad="media",
-                        tiempo_revision="48 horas"
-                    )
-                ]
-                
-        elif tipo_sintoma == "crecimiento_lento_raices_marrones":
-            diagnostico = "Posible pudrición radicular"
-            if parametros.temperatura_solucion > 24:
-                acciones = [
-                    Accion(
-                        tipo="enfriamiento",
-                        descripcion="🌡️ Enfriar agua + oxigenación + renovación parcial",
-                        prioridad="alta",
-                        tiempo_revision="12 horas"
-                    )
-                ]
-                parametros_criticos = ["temperatura_solucion"]
-            else:
-                acciones = [
-                    Accion(
-                        tipo="oxigenacion",
-                        descripcion="Verificar y mejorar oxigenación",
-                        prioridad="alta",
-                        tiempo_revision="inmediato"
-                    )
-                ]
-        
-        return DiagnosticoOutput(
-            diagnostico=diagnostico,
-            acciones=acciones,
-            parametros_criticos=parametros_criticos,
-            observaciones_clima_fueguino=observaciones
-        )
+# Longitud máxima de una línea en la ingesta NDJSON
+MAX_BYTES_LINEA_NDJSON = 64 * 1024
+
+class EstadoIncremental:
+    """Última evaluación conocida de un invernadero"""
     
-    @staticmethod
-    def diagnosticar_parametros(cultivo: str, etapa: str, parametros: ParametrosAmbientales) -> DiagnosticoOutput:
-        """Diagnóstica basado en parámetros sin síntomas visuales"""
-        rangos = DiagnosticoHidroponico.obtener_rangos_optimos(cultivo, etapa)
-        acciones = []
-        parametros_criticos = []
-        observaciones = []
+    __slots__ = ("catalogo", "modo", "valores", "condiciones", "resultado")
+    
+    def __init__(self, catalogo: CatalogoReglas, modo: tuple, valores: tuple, condiciones: tuple, resultado: DiagnosticoOutput):
+        self.catalogo = catalogo
+        self.modo = modo
+        self.valores = valores
+        self.condiciones = condiciones
+        self.resultado = resultado
+
+class DiagnosticoIncremental:
+    """
+    Diagnóstico con estado por invernadero. Conserva la última evaluación y,
+    ante una lectura nueva, sólo vuelve a evaluar las condiciones de los parámetros
+    cuyo valor cambió. Si ninguna condición cambia se reutiliza el diagnóstico
+    anterior; si no, se informa la diferencia de acciones y parámetros críticos.
+    Tras un cambio de reglas la primera lectura de cada invernadero se evalúa completa.
+    """
+    
+    def __init__(self, max_invernaderos: int = 100000):
+        self.max_invernaderos = max_invernaderos
+        self._estados: OrderedDict[str, EstadoIncremental] = OrderedDict()
+        self.evaluaciones_completas = 0
+        self.reglas_reevaluadas = 0
+        self.lecturas_sin_cambios = 0
+    
+    def diagnosticar(self, entrada: DiagnosticoInput) -> tuple[DiagnosticoOutput, DiagnosticoDelta]:
+        """Devuelve el diagnóstico completo actual y su diferencia con el anterior"""
+        catalogo = reglas_activas()
+        parametros = entrada.parametros
+        sintoma = entrada.tipo_sintoma.value if entrada.sintomas_visuales and entrada.tipo_sintoma else None
+        modo = (entrada.cultivo.value, entrada.etapa.value, sintoma)
+        valores = tuple(getattr(parametros, campo) for campo in catalogo.campos)
+        k = catalogo.indice_combinacion[modo[:2]]
         
-        # Verificar pH
-        if not (rangos["ph"][0] <= parametros.ph <= rangos["ph"][1]):
-            parametros_criticos.append("ph")
-            if parametros.ph < rangos["ph"][0]:
-                acciones.append(Accion(
-                    tipo="ajuste_ph",
-                    descripcion="📈 SUBIR pH - Agregar buffer alcalino hasta rango 5.8-6.2",
-                    prioridad="alta",
-                    tiempo_revision="2 horas"
-                ))
-            else:
-                acciones.append(Accion(
-                    tipo="ajuste_ph",
-                    descripcion="📉 BAJAR pH - Agregar buffer ácido hasta rango 5.8-6.2",
-                    prioridad="alta",
-                    tiempo_revision="2 horas"
-                ))
+        anterior = self._estados.get(entrada.invernadero_id)
+        if anterior is not None:
+            self._estados.move_to_end(entrada.invernadero_id)
         
-        # Verificar CE
-        if not (rangos["ce"][0] <= parametros.conductividad_electrica <= rangos["ce"][1]):
-            parametros_criticos.append("conductividad_electrica")
-            if parametros.conductividad_electrica < rangos["ce"][0]:
-                acciones.append(Accion(
-                    tipo="ajuste_nutrientes",
-                    descripcion=f"🔋 AUMENTAR NUTRIENTES - Incrementar concentración hasta {rangos['ce'][0]}-{rangos['ce'][1]} mS/cm",
-                    prioridad="media",
-                    tiempo_revision="12 horas"
-                ))
-            else:
-                acciones.append(Accion(
-                    tipo="dilucion",
-                    descripcion=f"💧 DILUIR SOLUCIÓN - Agregar agua hasta {rangos['ce'][0]}-{rangos['ce'][1]} mS/cm",
-                    prioridad="media",
-                    tiempo_revision="6 horas"
-                ))
+        if sintoma is not None:
+            # El diagnóstico por síntomas depende de una sola condición: se evalúa siempre
+            reevaluados = []
+            condiciones = ()
+            resultado = catalogo.tabla[catalogo.codigo_sintoma(sintoma, parametros)]
+        elif anterior is None or anterior.modo != modo or anterior.catalogo is not catalogo:
+            reevaluados = list(catalogo.campos)
+            condiciones = tuple(
+                catalogo.evaluar_campo(k, campo, valor)
+                for campo, valor in zip(catalogo.campos, valores)
+            )
+            self.evaluaciones_completas += 1
+        else:
+            reevaluados = []
+            condiciones = list(anterior.condiciones)
+            for posicion, (campo, valor, valor_anterior) in enumerate(zip(catalogo.campos, valores, anterior.valores)):
+                if valor != valor_anterior:
+                    condiciones[posicion] = catalogo.evaluar_campo(k, campo, valor)
+                    reevaluados.append(campo)
+            condiciones = tuple(condiciones)
+            self.reglas_reevaluadas += len(reevaluados)
         
-        # Verificar temperatura de solución
-        if not (rangos["temp_solucion"][0] <= parametros.temperatura_solucion <= rangos["temp_solucion"][1]):
-            parametros_criticos.append("temperatura_solucion")
-            if parametros.temperatura_solucion < rangos["temp_solucion"][0]:
-                acciones.append(Accion(
-                    tipo="calefaccion",
-                    descripcion="🔥 CALENTAR SOLUCIÓN - Activar calefacción depósito Target: 18-22°C",
-                    prioridad="alta",
-                    tiempo_revision="4 horas"
-                ))
-                observaciones.append("❄️ Crítico en invierno fueguino")
-            else:
-                acciones.append(Accion(
-                    tipo="enfriamiento",
-                    descripcion="🧊 ENFRIAR SOLUCIÓN - Mejorar aislamiento/ventilación Target: 18-22°C",
-                    prioridad="media",
-                    tiempo_revision="6 horas"
-                ))
+        if sintoma is None:
+            # Las mismas condiciones dan la misma fila de la tabla, es decir, el mismo diagnóstico
+            mascara = 0
+            for condicion in condiciones:
+                mascara |= condicion
+            resultado = catalogo.tabla[catalogo.codigo_parametros(k, mascara)]
         
-        # Verificar humedad relativa
-        if not (rangos["humedad"][0] <= parametros.humedad_relativa <= rangos["humedad"][1]):
-            parametros_criticos.append("humedad_relativa")
-            if parametros.humedad_relativa > rangos["humedad"][1]:
-                acciones.append(Accion(
-                    tipo="ventilacion",
-                    descripcion="💨 MEJORAR VENTILACIÓN - Reducir HR < 75%",
-                    prioridad="alta",
-                    tiempo_revision="inmediato"
-                ))
-                observaciones.append("🌪️ Cuidado con vientos fueguinos")
-            else:
-                acciones.append(Accion(
-                    tipo="humidificacion",
-                    descripcion="💦 AUMENTAR HUMEDAD - Nebulización o riego Target: 60-75%",
-                    prioridad="media",
-                    tiempo_revision="6 horas"
-                ))
+        self._guardar(entrada.invernadero_id, EstadoIncremental(catalogo, modo, valores, condiciones, resultado))
+        delta = self._delta(entrada.invernadero_id, anterior.resultado if anterior else None, resultado, reevaluados)
+        return resultado, delta
+    
+    def _guardar(self, invernadero_id: str, estado: EstadoIncremental) -> None:
+        self._estados[invernadero_id] = estado
+        while len(self._estados) > self.max_invernaderos:
+            self._estados.popitem(last=False)
+    
+    def _delta(
+        self,
+        invernadero_id: str,
+        anterior: Optional[DiagnosticoOutput],
+        actual: DiagnosticoOutput,
+        reevaluados: list[str]
+    ) -> DiagnosticoDelta:
+        if anterior is actual:
+            self.lecturas_sin_cambios += 1
+            return DiagnosticoDelta.model_construct(
+                invernadero_id=invernadero_id,
+                cambio=False,
+                diagnostico=actual.diagnostico,
+                acciones_agregadas=[],
+                acciones_resueltas=[],
+                parametros_criticos_agregados=[],
+                parametros_criticos_resueltos=[],
+                parametros_reevaluados=reevaluados,
+                version_reglas=actual.version_reglas
+            )
         
-        # Verificar iluminación
-        if parametros.horas_luz_diarias < rangos["horas_luz"][0]:
-            parametros_criticos.append("horas_luz_diarias")
-            acciones.append(Accion(
-                tipo="iluminacion",
-                descripcion="💡 AJUSTAR ILUMINACIÓN - Extender fotoperiodo LED",
-                prioridad="media",
-                tiempo_revision="24 horas"
-            ))
-            observaciones.append("🌞 Compensar baja radiación solar")
+        acciones_anteriores = anterior.acciones if anterior else []
+        criticos_anteriores = anterior.parametros_criticos if anterior else []
+        return DiagnosticoDelta.model_construct(
+            invernadero_id=invernadero_id,
+            cambio=True,
+            diagnostico=actual.diagnostico,
+            acciones_agregadas=[a for a in actual.acciones if a not in acciones_anteriores],
+            acciones_resueltas=[a for a in acciones_anteriores if a not in actual.acciones],
+            parametros_criticos_agregados=[p for p in actual.parametros_criticos if p not in criticos_anteriores],
+            parametros_criticos_resueltos=[p for p in criticos_anteriores if p not in actual.parametros_criticos],
+            parametros_reevaluados=reevaluados,
+            version_reglas=actual.version_reglas
+        )
+    
+    def olvidar(self, invernadero_id: str) -> bool:
+        return self._estados.pop(invernadero_id, None) is not None
+    
+    def estadisticas(self) -> dict:
+        return {
+            "invernaderos": len(self._estados),
+            "evaluaciones_completas": self.evaluaciones_completas,
+            "reglas_reevaluadas": self.reglas_reevaluadas,
+            "lecturas_sin_cambios": self.lecturas_sin_cambios
+        }
+
+DIAGNOSTICO_INCREMENTAL = DiagnosticoIncremental()
+
+# Cache de diagnósticos (configurable por variables de entorno)
+CACHE_DIAGNOSTICO = CacheLRU(
+    tamano_maximo=int(os.getenv("CACHE_DIAGNOSTICO_TAMANO", "4096")),
+    ttl_segundos=float(os.getenv("CACHE_DIAGNOSTICO_TTL", "300")),
+    habilitado=os.getenv("CACHE_DIAGNOSTICO", "1") == "1"
+)
+
+# Lecturas idénticas en curso (p. ej. la misma lectura reenviada por varios caminos
+# de reintento de un gateway) comparten una sola evaluación y una sola respuesta
+VUELOS_DIAGNOSTICO = VueloUnico(habilitado=os.getenv("COALESCER_DIAGNOSTICOS", "1") == "1")
+
+class RespuestaCompartida(Response):
+    """
+    Respuesta del líder de un vuelo. El diagnóstico no cede el loop de eventos,
+    así que el vuelo se cierra recién en la vuelta siguiente del loop a la del
+    envío: las copias que ya estaban listas para ejecutarse (llegadas en la
+    misma ráfaga) se unen a él en lugar de volver a evaluar y registrar la lectura.
+    """
+    media_type = "application/json"
+    
+    def __init__(self, content: bytes, clave: tuple, futuro: asyncio.Future):
+        super().__init__(content=content)
+        self.clave = clave
+        self.futuro = futuro
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            asyncio.get_running_loop().call_soon(VUELOS_DIAGNOSTICO.terminar, self.clave, self.futuro)
+
+# Resolución de los sensores: la clave del cache agrupa las lecturas en celdas de este ancho
+RESOLUCION_SENSORES = {
+    "ph": 0.05,
+    "conductividad_electrica": 0.05,
+    "temperatura_solucion": 0.1,
+    "humedad_relativa": 0.5,
+    "temperatura_ambiente": 0.1,
+    "horas_luz_diarias": 0.25
+}
+
+LEER_SENSORES = attrgetter(*RESOLUCION_SENSORES)
+PASOS_SENSORES = tuple(RESOLUCION_SENSORES.values())
+
+def cuantizar_entrada(entrada: DiagnosticoInput, huella: str) -> tuple:
+    """
+    Clave del cache: la lectura con cada parámetro reemplazado por el número de
+    su celda de resolución. Cuesta lo mismo con cualquier cantidad de reglas.
+    """
+    parametros = entrada.parametros
+    return (
+        huella,
+        entrada.cultivo,
+        entrada.etapa,
+        entrada.tipo_sintoma if entrada.sintomas_visuales else None,
+        *map(round, map(truediv, LEER_SENSORES(parametros), PASOS_SENSORES)),
+        parametros.dias_desde_renovacion,
+        parametros.bomba_oxigenacion_funcionando
+    )
+
+def celda_sin_limites(catalogo: CatalogoReglas, entrada: DiagnosticoInput) -> bool:
+    """
+    True si ningún límite de las reglas cae dentro de las celdas de la lectura:
+    entonces todas las lecturas con su misma clave tienen el mismo diagnóstico
+    """
+    parametros = entrada.parametros
+    limites = catalogo.limites_lectura(
+        (entrada.cultivo.value, entrada.etapa.value),
+        entrada.tipo_sintoma.value if entrada.sintomas_visuales and entrada.tipo_sintoma else None
+    )
+    for campo, paso in RESOLUCION_SENSORES.items():
+        limites_campo = limites.get(campo)
+        if not limites_campo:
+            continue
+        celda = round(getattr(parametros, campo) / paso)
+        # Bordes cerrados y con margen: el redondeo de valor / paso no puede sacar una lectura de su celda
+        desde = (celda - 0.5) * paso - 1e-9
+        hasta = (celda + 0.5) * paso + 1e-9
+        i = bisect_left(limites_campo, desde)
+        if i < len(limites_campo) and limites_campo[i] <= hasta:
+            return False
+    return True
+
+def diagnosticar_con_cache(entrada: DiagnosticoInput) -> tuple[DiagnosticoOutput, bytes]:
+    """
+    Devuelve el diagnóstico y su JSON serializado, reutilizando el cache si está
+    habilitado. Un acierto evita evaluar las reglas. La clave es la lectura
+    cuantizada a la resolución de los sensores, pero la lectura se evalúa
+    siempre sin redondear y sólo se guarda si su celda no contiene ningún límite
+    de las reglas, así que las lecturas cercanas a un límite nunca comparten entrada.
+    """
+    catalogo = reglas_activas()
+    if not CACHE_DIAGNOSTICO.habilitado:
+        resultado = catalogo.diagnosticar(entrada)
+        return resultado, serializar_diagnostico(resultado)
+    
+    # La huella de las reglas en la clave evita servir diagnósticos de reglas ya reemplazadas
+    clave = cuantizar_entrada(entrada, catalogo.huella)
+    guardado = CACHE_DIAGNOSTICO.obtener(clave)
+    if guardado is None:
+        resultado = catalogo.diagnosticar(entrada)
+        guardado = (resultado, serializar_diagnostico(resultado))
+        if celda_sin_limites(catalogo, entrada):
+            CACHE_DIAGNOSTICO.guardar(clave, guardado)
+        else:
+            CACHE_DIAGNOSTICO.omitidos += 1
+    return guardado
+
+class RespuestaNDJSON(StreamingResponse):
+    """
+    Respuesta NDJSON que se genera mientras se lee el cuerpo de la petición.
+    No escucha la desconexión del cliente en paralelo porque eso consumiría
+    los mensajes del cuerpo: la desconexión se detecta al leer la petición.
+    """
+    media_type = "application/x-ndjson"
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def diagnosticar_linea_ndjson(numero: int, linea: bytes) -> bytes:
+    """Diagnostica una línea NDJSON y devuelve la línea de resultado correspondiente"""
+    try:
+        entrada = DiagnosticoInput.model_validate_json(linea)
+    except ValidationError as e:
+        VALIDACIONES_FALLIDAS.incrementar(("/diagnostico/flujo",))
+        return ResultadoLote(indice=numero, error=describir_error_validacion(e)).model_dump_json().encode() + b"\n"
+    
+    try:
+        resultado, cuerpo = diagnosticar_con_cache(entrada)
+        registrar_diagnostico(entrada, resultado, cuerpo)
+    except Exception as e:
+        return ResultadoLote(indice=numero, error=f"Error en el diagnóstico: {str(e)}").model_dump_json().encode() + b"\n"
+    
+    return b'{"indice":%d,"resultado":%s,"error":null}\n' % (numero, cuerpo)
+
+def error_linea_demasiado_larga(numero: int) -> bytes:
+    error = f"La línea supera el máximo de {MAX_BYTES_LINEA_NDJSON} bytes"
+    return ResultadoLote(indice=numero, error=error).model_dump_json().encode() + b"\n"
+
+async def diagnosticar_flujo_ndjson(request: Request):
+    """
+    Lee el cuerpo por fragmentos y emite los resultados de las líneas completas
+    de cada fragmento, de modo que la memoria no depende del tamaño total
+    """
+    pendiente = b""
+    descartando = False
+    numero = 0
+    
+    async for fragmento in request.stream():
+        lineas = (pendiente + fragmento).split(b"\n")
+        pendiente = lineas.pop()
+        salida = []
         
-        # Verificar renovación de solución
-        if parametros.dias_desde_renovacion > 15:
-            acciones.append(Accion(
-                tipo="renovacion",
-                descripcion="🔄 RENOVAR SOLUCIÓN - Cambio completo en 24h",
-                prioridad="media",
-                tiempo_revision="24 horas"
-            ))
+        for linea in lineas:
+            if descartando:
+                # Fin de una línea demasiado larga que ya fue informada
+                descartando = False
+                continue
+            if len(linea) > MAX_BYTES_LINEA_NDJSON:
+                salida.append(error_linea_demasiado_larga(numero))
+            elif linea.strip():
+                salida.append(diagnosticar_linea_ndjson(numero, linea))
+            numero += 1
         
-        # Si no hay problemas
-        if not acciones:
-            diagnostico = "✅ SISTEMA ÓPTIMO"
-            acciones.append(Accion(
-                tipo="monitoreo",
-                descripcion="Continuar monitoreo diario y registrar parámetros",
-                prioridad="baja",
-                tiempo_revision="24 horas"
-            ))
-        else:
-            diagnostico = f"Se detectaron {len(parametros_criticos)} parámetros fuera de rango"
+        # Una línea incompleta que ya supera el máximo se informa y se descarta hasta su fin
+        if len(pendiente) > MAX_BYTES_LINEA_NDJSON:
+            if not descartando:
+                salida.append(error_linea_demasiado_larga(numero))
+                numero += 1
+                descartando = True
+            pendiente = b""
         
-        return DiagnosticoOutput(
-            diagnostico=diagnostico,
-            acciones=acciones,
-            parametros_criticos=parametros_criticos,
-            observaciones_clima_fueguino=observaciones
+        if salida:
+            yield b"".join(salida)
+    
+    if pendiente.strip() and not descartando:
+        yield diagnosticar_linea_ndjson(numero, pendiente)
+
+# Canal de notificaciones en vivo por invernadero
+CANAL_DIAGNOSTICOS = CanalDiagnosticos(
+    tamano_cola=int(os.getenv("NOTIFICACIONES_TAMANO_COLA", "64")),
+    max_invernaderos=int(os.getenv("NOTIFICACIONES_MAX_INVERNADEROS", "100000"))
+)
+
+# Almacén de series temporales de las lecturas por invernadero
+ALMACEN_SERIES = (
+    AlmacenSeries(
+        os.getenv("SERIES_DIRECTORIO", "datos/series"),
+        max_series_abiertas=int(os.getenv("SERIES_MAX_ABIERTAS", "0")) or None
+    )
+    if os.getenv("SERIES_HABILITADAS", "1") == "1"
+    else None
+)
+
+# Historial de diagnósticos en SQLite, escrito en lotes por una tarea de fondo
+HISTORIAL = (
+    HistorialDiagnosticos(
+        os.getenv("HISTORIAL_ARCHIVO", "datos/historial.sqlite3"),
+        tamano_lote=int(os.getenv("HISTORIAL_TAMANO_LOTE", "1000")),
+        max_pendientes=int(os.getenv("HISTORIAL_MAX_PENDIENTES", "100000"))
+    )
+    if os.getenv("HISTORIAL_HABILITADO", "0") == "1"
+    else None
+)
+
+# Webhook opcional que recibe los recordatorios de seguimiento vencidos
+WEBHOOK_RECORDATORIOS = (
+    WebhookRecordatorios(os.getenv("SEGUIMIENTOS_WEBHOOK_URL"))
+    if os.getenv("SEGUIMIENTOS_WEBHOOK_URL")
+    else None
+)
+
+async def avisar_seguimientos(revisiones: list) -> None:
+    """Envía los recordatorios de las revisiones vencidas al canal en vivo y al webhook"""
+    recordatorios = [revision.a_dict() for revision in revisiones]
+    for revision, recordatorio in zip(revisiones, recordatorios):
+        # Los reintentos de un webhook caído no repiten el recordatorio a los suscriptores
+        if revision.intentos == 0:
+            CANAL_DIAGNOSTICOS.publicar_recordatorio(recordatorio["invernadero_id"], recordatorio)
+    if WEBHOOK_RECORDATORIOS is not None:
+        await WEBHOOK_RECORDATORIOS.enviar(recordatorios)
+
+# Revisiones pendientes de las acciones recomendadas a cada invernadero
+SEGUIMIENTOS = (
+    ProgramadorSeguimientos(
+        avisar_seguimientos,
+        os.getenv("SEGUIMIENTOS_ARCHIVO", "datos/seguimientos.sqlite3") or None,
+        plazo_inmediato=float(os.getenv("SEGUIMIENTOS_PLAZO_INMEDIATO_SEGUNDOS", "900")),
+        intervalo_guardado=float(os.getenv("SEGUIMIENTOS_INTERVALO_GUARDADO_SEGUNDOS", "1")),
+        max_reintentos_aviso=int(os.getenv("SEGUIMIENTOS_REINTENTOS_AVISO", "5")),
+        reintento_aviso=float(os.getenv("SEGUIMIENTOS_REINTENTO_AVISO_SEGUNDOS", "5"))
+    )
+    if os.getenv("SEGUIMIENTOS_HABILITADOS", "0") == "1"
+    else None
+)
+
+# Última lectura y último diagnóstico de cada invernadero, para el resumen de la flota
+ESTADO_FLOTA = EstadoFlota(
+    COLUMNAS_SERIE,
+    tuple(cultivo.value for cultivo in CultivoEnum),
+    tuple(etapa.value for etapa in EtapaEnum)
+)
+
+# Parámetros resumidos con percentiles (la bomba es un valor lógico y se cuenta aparte)
+PARAMETROS_FLOTA = tuple(columna for columna in COLUMNAS_SERIE if columna != "bomba_oxigenacion_funcionando")
+
+# Condiciones contadas en el resumen de la flota, además de los riesgos definidos
+# en las reglas activas: nombre -> (parámetro, operador, umbral)
+UMBRALES_FLOTA = {
+    "bomba_detenida": ("bomba_oxigenacion_funcionando", "<", 0.5)
+}
+
+# Parámetros con tendencia por invernadero (se comparan con su rango óptimo en las reglas activas)
+PARAMETROS_TENDENCIA = (
+    "ph",
+    "conductividad_electrica",
+    "temperatura_solucion",
+    "humedad_relativa"
+)
+
+ANALIZADOR_TENDENCIAS = AnalizadorTendencias(
+    PARAMETROS_TENDENCIA,
+    ventana_horas=float(os.getenv("TENDENCIAS_VENTANA_HORAS", "24")),
+    intervalo_minutos=float(os.getenv("TENDENCIAS_INTERVALO_MINUTOS", "15")),
+    horizonte_horas=float(os.getenv("TENDENCIAS_HORIZONTE_HORAS", "24")),
+    max_invernaderos=int(os.getenv("TENDENCIAS_MAX_INVERNADEROS", "10000"))
+)
+
+# Recarga en caliente del archivo de reglas (REGLAS_ARCHIVO), revisado cada pocos segundos
+VIGILANTE_REGLAS = VigilanteReglas(intervalo=float(os.getenv("REGLAS_INTERVALO_SEGUNDOS", "5")))
+
+# Cola de trabajos para lotes demasiado grandes para /diagnostico/lote (pool de procesos propio).
+# Cada trabajador del servidor tiene su pool: por omisión se reparten entre ellos
+# (WEB_CONCURRENCY, que fija servidor.py) la mitad de las CPU
+TRABAJADORES_SERVIDOR = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+GESTOR_TRABAJOS = GestorTrabajos(
+    procesos=int(os.getenv("TRABAJOS_PROCESOS", "0")) or max(1, (os.cpu_count() or 2) // 2 // TRABAJADORES_SERVIDOR),
+    max_activos=int(os.getenv("TRABAJOS_MAX_ACTIVOS", "2")),
+    max_trabajos=int(os.getenv("TRABAJOS_MAX", "100")),
+    lecturas_por_bloque=int(os.getenv("TRABAJOS_LECTURAS_POR_BLOQUE", "5000")),
+    ttl_segundos=float(os.getenv("TRABAJOS_TTL_SEGUNDOS", "3600"))
+)
+
+# Tamaño máximo del cuerpo de un trabajo
+MAX_BYTES_TRABAJO = int(os.getenv("TRABAJOS_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Tipos de contenido aceptados al enviar un trabajo
+FORMATOS_TRABAJO = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson"
+}
+
+# Resultados por página al consultar un trabajo
+MAX_RESULTADOS_PAGINA = 10000
+
+# Cantidad máxima de invernaderos por suscripción
+MAX_INVERNADEROS_SUSCRIPCION = 100
+
+# Intervalo de los mensajes de keep-alive en los canales de eventos
+INTERVALO_KEEPALIVE_SEGUNDOS = 15.0
+
+def registrar_diagnostico(entrada: DiagnosticoInput, resultado: DiagnosticoOutput, cuerpo: Optional[bytes] = None) -> list[Accion]:
+    """
+    Procesa un diagnóstico ya realizado: contabiliza las reglas disparadas,
+    actualiza el seguimiento del invernadero si la lectura lo identifica y
+    encola la entrada y el diagnóstico en el historial. Devuelve las acciones
+    predictivas por tendencia.
+    """
+    catalogo = reglas_activas()
+    for accion in resultado.acciones:
+        ACCIONES_EMITIDAS.incrementar((accion.tipo, accion.prioridad))
+        REGLAS_DISPARADAS.incrementar((catalogo.nombres_acciones.get(id(accion), accion.tipo),))
+    for parametro in resultado.parametros_criticos:
+        PARAMETROS_CRITICOS.incrementar((parametro,))
+    
+    marca_tiempo = entrada.marca_tiempo.timestamp() if entrada.marca_tiempo else time.time()
+    acciones_predictivas = []
+    if entrada.invernadero_id is not None:
+        acciones_predictivas = seguir_invernadero(catalogo, entrada, resultado, cuerpo, marca_tiempo)
+    
+    if HISTORIAL is not None:
+        HISTORIAL.registrar(entrada, resultado, marca_tiempo, cuerpo, acciones_predictivas)
+    return acciones_predictivas
+
+def seguir_invernadero(
+    catalogo: CatalogoReglas,
+    entrada: DiagnosticoInput,
+    resultado: DiagnosticoOutput,
+    cuerpo: Optional[bytes],
+    marca_tiempo: float
+) -> list[Accion]:
+    """
+    Guarda la lectura en la serie temporal del invernadero, actualiza el estado
+    de la flota y las tendencias, publica el diagnóstico a los suscriptores y
+    reprograma las revisiones de seguimiento del invernadero. Devuelve las
+    acciones predictivas por tendencia.
+    """
+    parametros = entrada.parametros
+    valores = {columna: getattr(parametros, columna) for columna in COLUMNAS_SERIE}
+    
+    if ALMACEN_SERIES is not None:
+        ALMACEN_SERIES.agregar(entrada.invernadero_id, marca_tiempo, valores)
+    
+    vigente = ESTADO_FLOTA.actualizar(
+        entrada.invernadero_id,
+        entrada.cultivo.value,
+        entrada.etapa.value,
+        valores,
+        marca_tiempo,
+        resultado
+    )
+    
+    if cuerpo is None:
+        cuerpo = serializar_diagnostico(resultado)
+    CANAL_DIAGNOSTICOS.publicar(entrada.invernadero_id, cuerpo)
+    
+    acciones_predictivas = []
+    if ANALIZADOR_TENDENCIAS.actualizar(entrada.invernadero_id, marca_tiempo, valores):
+        rangos = catalogo.rangos[(entrada.cultivo.value, entrada.etapa.value)]
+        predicciones = ANALIZADOR_TENDENCIAS.predecir(
+            entrada.invernadero_id,
+            {
+                parametro: rangos[catalogo.rango_por_campo[parametro]]
+                for parametro in PARAMETROS_TENDENCIA
+                if parametro in catalogo.rango_por_campo
+            }
+        )
+        acciones_predictivas = [accion_predictiva(*prediccion) for prediccion in predicciones]
+    
+    # Una lectura atrasada no reconoce las revisiones programadas por una más reciente
+    if vigente and SEGUIMIENTOS is not None:
+        SEGUIMIENTOS.revisar(entrada.invernadero_id, resultado.acciones + acciones_predictivas)
+    return acciones_predictivas
+
+def validar_invernaderos(invernaderos: list[str]) -> list[str]:
+    if not invernaderos or len(invernaderos) > MAX_INVERNADEROS_SUSCRIPCION:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Se deben indicar entre 1 y {MAX_INVERNADEROS_SUSCRIPCION} invernaderos"
         )
+    return invernaderos
+
+@app.exception_handler(RequestValidationError)
+async def registrar_validacion_fallida(request: Request, exc: RequestValidationError):
+    """Contabiliza las entradas rechazadas y responde con el error estándar de FastAPI"""
+    ruta = request.scope.get("route")
+    VALIDACIONES_FALLIDAS.incrementar((getattr(ruta, "path", "sin_ruta"),))
+    return await request_validation_exception_handler(request, exc)
+
+# Los datos de referencia sólo cambian con las reglas: los clientes pueden reutilizarlos
+# durante unos minutos y luego revalidarlos con If-None-Match
+CACHE_CONTROL_REFERENCIA = os.getenv("CACHE_CONTROL_REFERENCIA", "public, max-age=300")
+
+class RecursoEstatico:
+    """Respuesta JSON serializada una sola vez, con su ETag fuerte y la versión de las reglas"""
+    
+    __slots__ = ("cuerpo", "etag", "encabezados")
+    
+    def __init__(self, datos: Any, version_reglas: str):
+        self.cuerpo = json.dumps(datos, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = '"%s"' % hashlib.blake2b(self.cuerpo, digest_size=16).hexdigest()
+        self.encabezados = {
+            "ETag": self.etag,
+            "Cache-Control": CACHE_CONTROL_REFERENCIA,
+            "X-Version-Reglas": version_reglas
+        }
+    
+    def coincide(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Comparación débil, como exige If-None-Match: se ignora el prefijo W/
+        return any(
+            etiqueta.strip().removeprefix("W/") == self.etag
+            for etiqueta in if_none_match.split(",")
+        )
+    
+    def responder(self, request: Request) -> Response:
+        if self.coincide(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=self.encabezados)
+        return Response(content=self.cuerpo, media_type="application/json", headers=self.encabezados)
+
+def serializar_referencias(catalogo: CatalogoReglas) -> dict:
+    """Serializa las respuestas de los endpoints de referencia a partir de un conjunto de reglas"""
+    return {
+        "huella": catalogo.huella,
+        "raiz": RecursoEstatico({
+            "mensaje": "🌱 Sistema de Diagnóstico Hidropónico - Tierra del Fuego",
+            "version": "1.0.0",
+            "documentacion": "/docs"
+        }, catalogo.version),
+        "cultivos": RecursoEstatico({
+            "cultivos": [cultivo.value for cultivo in CultivoEnum],
+            "etapas": [etapa.value for etapa in EtapaEnum],
+            "sintomas": [sintoma.value for sintoma in SintomaEnum]
+        }, catalogo.version),
+        "rangos": {
+            (cultivo.value, etapa.value): RecursoEstatico({
+                "cultivo": cultivo.value,
+                "etapa": etapa.value,
+                "rangos_optimos": catalogo.rangos[(cultivo.value, etapa.value)]
+            }, catalogo.version)
+            for cultivo in CultivoEnum
+            for etapa in EtapaEnum
+        }
+    }
+
+REFERENCIAS = serializar_referencias(reglas_activas())
+
+def referencias_vigentes() -> dict:
+    """Respuestas de referencia de las reglas activas; se vuelven a serializar tras un cambio de reglas"""
+    global REFERENCIAS
+    catalogo = reglas_activas()
+    if REFERENCIAS["huella"] != catalogo.huella:
+        REFERENCIAS = serializar_referencias(catalogo)
+    return REFERENCIAS
 
 # Endpoints de la API
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Endpoint de bienvenida"""
-    return {
-        "mensaje": "🌱 Sistema de Diagnóstico Hidropónico - Tierra del Fuego",
-        "version": "1.0.0",
-        "documentacion": "/docs"
-    }
+    return referencias_vigentes()["raiz"].responder(request)
 
-@app.post("/diagnostico", response_model=DiagnosticoOutput)
+@app.post("/diagnostico", response_model=DiagnosticoPredictivoOutput)
 async def realizar_diagnostico(entrada: DiagnosticoInput):
     """
     Realiza un diagnóstico completo del sistema hidropónico
-    basado en el árbol de decisión específico para Tierra del Fuego
+    basado en el árbol de decisión específico para Tierra del Fuego.
+    Si la lectura indica invernadero_id se agregan las acciones predictivas
+    de los parámetros que saldrán de rango si siguen su tendencia.
     """
+    futuro = None
+    if VUELOS_DIAGNOSTICO.habilitado:
+        # Clave canónica: la entrada validada serializada (orden de campos y valores por defecto fijos)
+        clave = (reglas_activas().huella, entrada.model_dump_json())
+        en_vuelo = VUELOS_DIAGNOSTICO.unirse(clave)
+        if en_vuelo is not None:
+            # La lectura ya se está diagnosticando y registrando: se comparte su respuesta
+            try:
+                cuerpo = await asyncio.shield(en_vuelo)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error en el diagnóstico: {str(e)}")
+            return Response(content=cuerpo, media_type="application/json")
+        futuro = VUELOS_DIAGNOSTICO.iniciar(clave)
+    
     try:
-        # Si hay síntomas visuales, priorizarlos
-        if entrada.sintomas_visuales and entrada.tipo_sintoma:
-            resultado = DiagnosticoHidroponico.diagnosticar_sintomas(
-                entrada.tipo_sintoma.value, 
-                entrada.parametros
-            )
-        else:
-            # Diagnóstico basado en parámetros
-            resultado = DiagnosticoHidroponico.diagnosticar_parametros(
-                entrada.cultivo.value,
-                entrada.etapa.value,
-                entrada.parametros
-            )
-        
-        return resultado
-        
+        resultado, cuerpo = diagnosticar_con_cache(entrada)
+        acciones_predictivas = registrar_diagnostico(entrada, resultado, cuerpo)
+        if entrada.invernadero_id is not None:
+            # Se agregan al JSON ya serializado del diagnóstico compartido
+            predictivas = b",".join(accion.model_dump_json().encode() for accion in acciones_predictivas)
+            cuerpo = cuerpo[:-1] + b',"acciones_predictivas":[' + predictivas + b"]}"
+    
     except Exception as e:
+        if futuro is not None:
+            futuro.set_exception(e)
+            VUELOS_DIAGNOSTICO.terminar(clave, futuro)
         raise HTTPException(status_code=500, detail=f"Error en el diagnóstico: {str(e)}")
+    
+    if futuro is None:
+        return Response(content=cuerpo, media_type="application/json")
+    futuro.set_result(cuerpo)
+    return RespuestaCompartida(cuerpo, clave, futuro)
 
-@app.get("/cultivos")
-async def obtener_cultivos():
-    """Obtiene la lista de cultivos disponibles"""
+@app.post("/diagnostico/lote", response_model=DiagnosticoLoteOutput)
+async def realizar_diagnostico_lote(lecturas: list[Any] = Body(...)):
+    """
+    Diagnostica un lote de lecturas en una sola llamada.
+    Cada elemento se valida por separado: los inválidos se informan
+    con su error sin afectar al resto, y los resultados respetan el orden de entrada.
+    """
+    if len(lecturas) > MAX_LECTURAS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote supera el máximo de {MAX_LECTURAS_LOTE} lecturas"
+        )
+    
+    resultados = [None] * len(lecturas)
+    entradas_validas = []
+    indices_validos = []
+    
+    for indice, lectura in enumerate(lecturas):
+        try:
+            entradas_validas.append(DiagnosticoInput.model_validate(lectura))
+            indices_validos.append(indice)
+        except ValidationError as e:
+            VALIDACIONES_FALLIDAS.incrementar(("/diagnostico/lote",))
+            resultados[indice] = ResultadoLote(indice=indice, error=describir_error_validacion(e)).model_dump_json().encode()
+    
+    try:
+        diagnosticos = DiagnosticoHidroponico.diagnosticar_lote(entradas_validas)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en el diagnóstico: {str(e)}")
+    
+    for indice, entrada, diagnostico in zip(indices_validos, entradas_validas, diagnosticos):
+        cuerpo = serializar_diagnostico(diagnostico)
+        registrar_diagnostico(entrada, diagnostico, cuerpo)
+        resultados[indice] = b'{"indice":%d,"resultado":%s,"error":null}' % (indice, cuerpo)
+    
+    # Se arma el JSON a partir de los diagnósticos ya serializados (mismo formato que DiagnosticoLoteOutput)
+    contenido = b'{"total":%d,"errores":%d,"resultados":[%s]}' % (
+        len(lecturas),
+        len(lecturas) - len(entradas_validas),
+        b",".join(resultados)
+    )
+    return Response(content=contenido, media_type="application/json")
+
+@app.post("/diagnostico/incremental", response_model=DiagnosticoDelta)
+async def realizar_diagnostico_incremental(entrada: DiagnosticoInput):
+    """
+    Diagnóstico con estado por invernadero: devuelve sólo los cambios respecto
+    de la lectura anterior del mismo invernadero (acciones agregadas y resueltas,
+    parámetros críticos que aparecieron o se normalizaron)
+    """
+    if entrada.invernadero_id is None:
+        raise HTTPException(status_code=422, detail="El diagnóstico incremental requiere invernadero_id")
+    
+    try:
+        resultado, delta = DIAGNOSTICO_INCREMENTAL.diagnosticar(entrada)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en el diagnóstico: {str(e)}")
+    
+    registrar_diagnostico(entrada, resultado)
+    return Response(content=delta.model_dump_json(), media_type="application/json")
+
+@app.delete("/diagnostico/incremental/{invernadero_id}")
+async def reiniciar_diagnostico_incremental(invernadero_id: str):
+    """Descarta el estado guardado de un invernadero"""
+    if not DIAGNOSTICO_INCREMENTAL.olvidar(invernadero_id):
+        raise HTTPException(status_code=404, detail=f"No hay estado para el invernadero {invernadero_id}")
+    return {"invernadero_id": invernadero_id, "reiniciado": True}
+
+@app.get("/diagnostico/incremental/estadisticas")
+async def obtener_estadisticas_incremental():
+    """Obtiene los contadores del diagnóstico incremental"""
+    return DIAGNOSTICO_INCREMENTAL.estadisticas()
+
+@app.post("/diagnostico/flujo")
+async def realizar_diagnostico_flujo(request: Request):
+    """
+    Ingesta de lecturas en formato NDJSON (una entrada de diagnóstico por línea).
+    Las líneas se diagnostican a medida que llegan y se responde con una línea
+    NDJSON por cada línea recibida, con el mismo índice (base 0). Las líneas
+    inválidas se informan con su error sin interrumpir el flujo.
+    
+    Para cargas grandes el cliente debe leer la respuesta mientras envía
+    el cuerpo (por ejemplo `curl -T lecturas.ndjson`).
+    """
+    return RespuestaNDJSON(diagnosticar_flujo_ndjson(request))
+
+def calcular_barrido(barrido: BarridoInput) -> tuple[dict, str]:
+    """Mapa de decisión de un barrido y versión de las reglas con que se calculó; lanza HTTPException si la grilla es inválida"""
+    campos = [eje.parametro for eje in barrido.ejes]
+    if len(set(campos)) != len(campos):
+        raise HTTPException(status_code=422, detail="Cada parámetro puede barrerse una sola vez")
+    celdas = 1
+    for eje in barrido.ejes:
+        if eje.hasta < eje.desde:
+            raise HTTPException(status_code=422, detail=f"Eje {eje.parametro}: 'hasta' es menor que 'desde'")
+        if eje.parametro == "dias_desde_renovacion" and not (eje.desde.is_integer() and eje.paso.is_integer()):
+            raise HTTPException(status_code=422, detail="Eje dias_desde_renovacion: 'desde' y 'paso' deben ser enteros")
+        celdas *= cantidad_pasos(eje.desde, eje.hasta, eje.paso)
+    if celdas > MAX_CELDAS:
+        raise HTTPException(status_code=413, detail=f"La grilla tiene {celdas} celdas; el máximo es {MAX_CELDAS}")
+    
+    catalogo = reglas_activas()
+    resultado = barrer(
+        catalogo,
+        barrido.cultivo.value,
+        barrido.etapa.value,
+        barrido.tipo_sintoma.value if barrido.tipo_sintoma else None,
+        barrido.parametros.model_dump(),
+        [(eje.parametro, valores_eje(eje.desde, eje.hasta, eje.paso)) for eje in barrido.ejes]
+    )
     return {
-        "cultivos": [cultivo.value for cultivo in CultivoEnum],
-        "etapas": [etapa.value for etapa in EtapaEnum],
-        "sintomas": [sintoma.value for sintoma in SintomaEnum]
+        "version_reglas": catalogo.version,
+        "ejes": [{"parametro": campo, "valores": valores.tolist()} for campo, valores in resultado.ejes],
+        "forma": list(resultado.mapa.shape),
+        "invalidas": resultado.invalidas,
+        "diagnosticos": resultado.leyenda(),
+        "mapa": resultado.mapa.ravel().tolist()
+    }, catalogo.version
+
+@app.post("/diagnostico/barrido")
+async def realizar_barrido(barrido: BarridoInput):
+    """
+    Mapa de decisión: diagnostica la grilla completa de uno a tres parámetros
+    (de `desde` a `hasta` inclusive, cada `paso`) con el resto fijo en
+    `parametros`. `mapa` tiene una celda por combinación, con el primer eje
+    como el de variación más lenta, y guarda el índice del diagnóstico en
+    `diagnosticos` (-1 si la lectura no pasaría la validación).
+    """
+    contenido, version_reglas = calcular_barrido(barrido)
+    return Response(
+        content=json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode(),
+        media_type="application/json",
+        headers={"X-Version-Reglas": version_reglas}
+    )
+
+async def leer_cuerpo_trabajo(request: Request) -> bytes:
+    """Lee el cuerpo completo cortando apenas supera MAX_BYTES_TRABAJO"""
+    cuerpo = bytearray()
+    async for fragmento in request.stream():
+        cuerpo += fragmento
+        if len(cuerpo) > MAX_BYTES_TRABAJO:
+            raise HTTPException(status_code=413, detail=f"El trabajo supera el máximo de {MAX_BYTES_TRABAJO} bytes")
+    return bytes(cuerpo)
+
+def obtener_trabajo(trabajo_id: str):
+    trabajo = GESTOR_TRABAJOS.obtener(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"No existe el trabajo {trabajo_id} o sus resultados expiraron")
+    return trabajo
+
+@app.post("/trabajos", status_code=202)
+async def enviar_trabajo(request: Request):
+    """
+    Encola un lote de lecturas de cualquier tamaño y responde enseguida con el
+    identificador del trabajo. El cuerpo puede ser una lista JSON de entradas de
+    diagnóstico (`application/json`) o un archivo NDJSON con una entrada por línea
+    (`application/x-ndjson`). El progreso se consulta en /trabajos/{id} y los
+    resultados, en el mismo formato que /diagnostico/lote, en /trabajos/{id}/resultados.
+    Las lecturas no se registran en las series, la flota ni las tendencias.
+    """
+    tipo = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    formato = FORMATOS_TRABAJO.get(tipo)
+    if formato is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Tipo de contenido no admitido; use uno de: {', '.join(FORMATOS_TRABAJO)}"
+        )
+    
+    cuerpo = await leer_cuerpo_trabajo(request)
+    trabajo = GESTOR_TRABAJOS.enviar(cuerpo, formato)
+    if trabajo is None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Hay {GESTOR_TRABAJOS.max_trabajos} trabajos sin terminar; reintente más tarde",
+            headers={"Retry-After": "30"}
+        )
+    return Response(
+        content=json.dumps(trabajo.resumen(GESTOR_TRABAJOS.ttl_segundos)).encode(),
+        status_code=202,
+        media_type="application/json",
+        headers={"Location": f"/trabajos/{trabajo.id}"}
+    )
+
+@app.get("/trabajos")
+async def listar_trabajos():
+    """Estado de los trabajos guardados (pendientes, en curso y terminados sin expirar)"""
+    return {"trabajos": GESTOR_TRABAJOS.listar()}
+
+@app.get("/trabajos/{trabajo_id}")
+async def obtener_estado_trabajo(trabajo_id: str):
+    """Estado y progreso de un trabajo"""
+    return obtener_trabajo(trabajo_id).resumen(GESTOR_TRABAJOS.ttl_segundos)
+
+@app.get("/trabajos/{trabajo_id}/resultados")
+async def obtener_resultados_trabajo(
+    trabajo_id: str,
+    desde: int = Query(0, ge=0, description="Índice de la primera lectura"),
+    limite: int = Query(1000, ge=1, le=MAX_RESULTADOS_PAGINA, description="Resultados por página")
+):
+    """
+    Página de resultados de un trabajo, en el orden de entrada. Se pueden pedir
+    mientras el trabajo está en curso: `siguiente` indica desde dónde seguir y es
+    null cuando el trabajo terminó y no quedan resultados.
+    """
+    trabajo = obtener_trabajo(trabajo_id)
+    resultados, hasta = trabajo.resultados(desde, desde + limite)
+    siguiente = None if trabajo.terminado and hasta >= trabajo.lecturas else hasta
+    contenido = b'{"id":"%s","estado":"%s","total":%d,"desde":%d,"siguiente":%s,"resultados":[%s]}' % (
+        trabajo.id.encode(),
+        trabajo.estado.encode(),
+        trabajo.lecturas,
+        desde,
+        b"null" if siguiente is None else str(siguiente).encode(),
+        b",".join(resultados)
+    )
+    return Response(content=contenido, media_type="application/json")
+
+@app.get("/trabajos/{trabajo_id}/resultados/flujo")
+async def transmitir_resultados_trabajo(trabajo_id: str, desde: int = Query(0, ge=0)):
+    """
+    Resultados de un trabajo en NDJSON, una línea por lectura. Si el trabajo
+    sigue en curso, la respuesta continúa a medida que se completan los bloques
+    y termina cuando el trabajo finaliza.
+    """
+    trabajo = obtener_trabajo(trabajo_id)
+    
+    async def lineas():
+        posicion = desde
+        while True:
+            novedad = trabajo.novedad
+            while posicion < trabajo.lecturas:
+                resultados, posicion = trabajo.resultados(posicion, posicion + MAX_RESULTADOS_PAGINA)
+                if resultados:
+                    yield b"\n".join(resultados) + b"\n"
+            if trabajo.terminado or GESTOR_TRABAJOS.obtener(trabajo.id) is None:
+                return
+            await novedad.wait()
+    
+    return StreamingResponse(lineas(), media_type="application/x-ndjson")
+
+@app.delete("/trabajos/{trabajo_id}")
+async def cancelar_trabajo(trabajo_id: str):
+    """Cancela el trabajo si no terminó y descarta sus resultados"""
+    trabajo = GESTOR_TRABAJOS.eliminar(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"No existe el trabajo {trabajo_id} o sus resultados expiraron")
+    return trabajo.resumen(GESTOR_TRABAJOS.ttl_segundos)
+
+@app.get("/suscripciones/eventos")
+async def suscribir_eventos(invernaderos: list[str] = Query(..., description="Invernaderos a seguir")):
+    """
+    Canal Server-Sent Events con los diagnósticos en vivo de los invernaderos indicados.
+    Sólo se envía un evento cuando una lectura nueva cambia el diagnóstico.
+    """
+    suscripcion = CANAL_DIAGNOSTICOS.suscribir(validar_invernaderos(invernaderos))
+    
+    async def eventos():
+        try:
+            while True:
+                try:
+                    evento = await suscripcion.siguiente(INTERVALO_KEEPALIVE_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if evento is None:
+                    break
+                yield b"data: " + evento + b"\n\n"
+        finally:
+            CANAL_DIAGNOSTICOS.desuscribir(suscripcion)
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/diagnosticos")
+async def websocket_diagnosticos(websocket: WebSocket, invernaderos: list[str] = Query(...)):
+    """Canal WebSocket con los diagnósticos en vivo de los invernaderos indicados"""
+    if not invernaderos or len(invernaderos) > MAX_INVERNADEROS_SUSCRIPCION:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    suscripcion = CANAL_DIAGNOSTICOS.suscribir(invernaderos)
+    
+    async def esperar_cierre():
+        # Los mensajes del cliente se ignoran; sólo interesa detectar la desconexión
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            suscripcion.cerrar()
+    
+    receptor = asyncio.create_task(esperar_cierre())
+    consumidor_lento = False
+    try:
+        while True:
+            evento = await suscripcion.siguiente()
+            if evento is None:
+                # Si el cliente sigue conectado, la suscripción se cerró por consumidor lento
+                consumidor_lento = not receptor.done()
+                break
+            await websocket.send_text(evento.decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        CANAL_DIAGNOSTICOS.desuscribir(suscripcion)
+        receptor.cancel()
+    
+    if consumidor_lento:
+        await websocket.close(code=1013)
+
+@app.get("/suscripciones/estadisticas")
+async def obtener_estadisticas_suscripciones():
+    """Obtiene el estado del canal de notificaciones en vivo"""
+    return CANAL_DIAGNOSTICOS.estadisticas()
+
+@app.get("/series/{invernadero_id}")
+async def obtener_serie(
+    invernadero_id: str = Path(..., max_length=64, pattern=PATRON_INVERNADERO_ID),
+    parametros: Optional[list[str]] = Query(None, description="Parámetros a devolver (por defecto, todos)"),
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    puntos: int = Query(1000, ge=1, le=100000, description="Máximo de puntos antes de agregar por intervalos")
+):
+    """
+    Obtiene el historial de lecturas de un invernadero en un intervalo de tiempo.
+    Las marcas de tiempo se expresan en segundos desde la época Unix. Si hay más
+    lecturas que `puntos`, se devuelven mínimo, máximo y media por intervalo.
+    """
+    if ALMACEN_SERIES is None:
+        raise HTTPException(status_code=404, detail="El almacén de series temporales está deshabilitado")
+    
+    columnas = parametros or list(COLUMNAS_SERIE)
+    desconocidas = [columna for columna in columnas if columna not in COLUMNAS_SERIE]
+    if desconocidas:
+        raise HTTPException(status_code=422, detail=f"Parámetros desconocidos: {', '.join(desconocidas)}")
+    
+    resultado = await ALMACEN_SERIES.consultar(
+        invernadero_id,
+        columnas,
+        desde.timestamp() if desde else None,
+        hasta.timestamp() if hasta else None,
+        puntos
+    )
+    if resultado is None:
+        raise HTTPException(status_code=404, detail=f"No hay lecturas del invernadero {invernadero_id}")
+    return resultado
+
+@app.get("/historial")
+async def obtener_historial(
+    invernadero_id: Optional[str] = Query(None, max_length=64, pattern=PATRON_INVERNADERO_ID),
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    prioridad: Optional[list[Literal[ORDEN_PRIORIDAD]]] = Query(None, description="Prioridad máxima de las acciones del diagnóstico"),
+    cursor: Optional[str] = Query(None, max_length=64, description="Valor de `siguiente` de la página anterior"),
+    limite: int = Query(100, ge=1, le=MAX_RESULTADOS_PAGINA)
+):
+    """
+    Diagnósticos guardados, del más reciente al más antiguo, con la entrada,
+    el resultado y las acciones predictivas de cada uno. Se filtran por
+    invernadero, intervalo de tiempo de la lectura y prioridad máxima de sus
+    acciones, y se paginan con `cursor`.
+    """
+    if HISTORIAL is None:
+        raise HTTPException(status_code=404, detail="El historial de diagnósticos está deshabilitado")
+    try:
+        contenido = await HISTORIAL.consultar(
+            invernadero_id,
+            desde.timestamp() if desde else None,
+            hasta.timestamp() if hasta else None,
+            prioridad,
+            cursor,
+            limite
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return Response(content=contenido, media_type="application/json")
+
+@app.get("/historial/estadisticas")
+async def obtener_estadisticas_historial():
+    """Obtiene los contadores de la escritura del historial"""
+    if HISTORIAL is None:
+        raise HTTPException(status_code=404, detail="El historial de diagnósticos está deshabilitado")
+    return HISTORIAL.estadisticas()
+
+@app.get("/seguimientos/estadisticas")
+async def obtener_estadisticas_seguimientos():
+    """Obtiene los contadores del programador de revisiones de seguimiento"""
+    if SEGUIMIENTOS is None:
+        raise HTTPException(status_code=404, detail="Los seguimientos están deshabilitados")
+    estadisticas = SEGUIMIENTOS.estadisticas()
+    if WEBHOOK_RECORDATORIOS is not None:
+        estadisticas.update({f"webhook_{contador}": valor for contador, valor in WEBHOOK_RECORDATORIOS.estadisticas().items()})
+    return estadisticas
+
+@app.get("/seguimientos/{invernadero_id}")
+async def obtener_seguimientos(invernadero_id: str = Path(..., max_length=64, pattern=PATRON_INVERNADERO_ID)):
+    """
+    Revisiones pendientes de un invernadero, de la más próxima a la más lejana.
+    Se reprograman con cada lectura nueva; si una vence sin lecturas, se envía
+    un recordatorio a los suscriptores del invernadero y al webhook configurado.
+    """
+    if SEGUIMIENTOS is None:
+        raise HTTPException(status_code=404, detail="Los seguimientos están deshabilitados")
+    return {
+        "invernadero_id": invernadero_id,
+        "revisiones": [revision.a_dict() for revision in SEGUIMIENTOS.pendientes_de(invernadero_id)]
     }
 
+@app.get("/tendencias/{invernadero_id}")
+async def obtener_tendencias(invernadero_id: str):
+    """
+    Estadísticos en línea de un invernadero: EWMA de cada parámetro y, sobre
+    la ventana de lecturas promediadas por intervalo, media, desvío, pendiente
+    por hora y ajuste (R²)
+    """
+    estado = ANALIZADOR_TENDENCIAS.estado(invernadero_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail=f"No hay lecturas del invernadero {invernadero_id}")
+    return {"invernadero_id": invernadero_id, **estado}
+
+@app.get("/flota/resumen")
+async def obtener_resumen_flota(
+    cultivo: Optional[CultivoEnum] = None,
+    etapa: Optional[EtapaEnum] = None,
+    max_antiguedad_segundos: Optional[float] = Query(None, gt=0, description="Ignora invernaderos sin lecturas recientes")
+):
+    """
+    Resumen de la flota a partir de la última lectura de cada invernadero:
+    cantidades por parámetro crítico, por prioridad máxima de las acciones,
+    por diagnóstico y por cultivo/etapa, invernaderos en condiciones de riesgo
+    y percentiles de cada parámetro
+    """
+    resumen = ESTADO_FLOTA.resumir(
+        PARAMETROS_FLOTA,
+        {**reglas_activas().umbrales_riesgo, **UMBRALES_FLOTA},
+        cultivo=cultivo.value if cultivo else None,
+        etapa=etapa.value if etapa else None,
+        desde=time.time() - max_antiguedad_segundos if max_antiguedad_segundos else None
+    )
+    return Response(content=json.dumps(resumen, ensure_ascii=False).encode(), media_type="application/json")
+
+@app.get("/cultivos")
+async def obtener_cultivos(request: Request):
+    """Obtiene la lista de cultivos disponibles"""
+    return referencias_vigentes()["cultivos"].responder(request)
+
 @app.get("/rangos-optimos/{cultivo}/{etapa}")
-async def obtener_rangos_optimos(cultivo: CultivoEnum, etapa: EtapaEnum):
+async def obtener_rangos_optimos(request: Request, cultivo: CultivoEnum, etapa: EtapaEnum):
     """Obtiene los rangos óptimos para un cultivo y etapa específicos"""
-    rangos = DiagnosticoHidroponico.obtener_rangos_optimos(cultivo.value, etapa.value)
+    return referencias_vigentes()["rangos"][(cultivo.value, etapa.value)].responder(request)
+
+@app.get("/cache/estadisticas")
+async def obtener_estadisticas_cache():
+    """Obtiene los contadores de aciertos, fallos y desalojos del cache de diagnósticos"""
+    return CACHE_DIAGNOSTICO.estadisticas()
+
+@app.post("/cache/vaciar")
+async def vaciar_cache():
+    """Elimina todas las entradas del cache de diagnósticos"""
+    CACHE_DIAGNOSTICO.vaciar()
+    return CACHE_DIAGNOSTICO.estadisticas()
+
+@app.get("/reglas")
+async def obtener_reglas():
+    """Conjunto de reglas activo: versión, origen y tamaño de la tabla de decisión compilada"""
+    return {**reglas_activas().resumen(), "recarga": VIGILANTE_REGLAS.estadisticas()}
+
+@app.post("/reglas/recargar")
+async def recargar_reglas():
+    """
+    Vuelve a leer y compilar el archivo de reglas y lo activa de inmediato en
+    este proceso. Las solicitudes en curso terminan con las reglas anteriores;
+    si el archivo es inválido se conservan las reglas activas.
+    """
+    try:
+        catalogo = await VIGILANTE_REGLAS.recargar()
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"No se pudo leer el archivo de reglas: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return catalogo.resumen()
+
+@app.get("/admision/estadisticas")
+async def obtener_estadisticas_admision():
+    """Obtiene los contadores del control de admisión y de las cuotas por cliente"""
     return {
-        "cultivo": cultivo.value,
-        "etapa": etapa.value,
-        "rangos_optimos": rangos
+        "admision": CONTROL_ADMISION.estadisticas(),
+        "cuotas": CUOTAS_CLIENTES.estadisticas()
     }
 
 @app.get("/health")
@@ -357,10 +1327,50 @@ async def health_check():
     """Endpoint de verificación de salud del servicio"""
     return {
         "status": "healthy",
-        "timestamp": "2025-06-03",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "tiempo_activo_segundos": round(MONITOR_LOOP.tiempo_activo, 1),
+        "retraso_loop_ms": {
+            "ultimo": round(MONITOR_LOOP.ultimo_retraso * 1000, 2),
+            "promedio": round(MONITOR_LOOP.retraso_promedio * 1000, 2),
+            "maximo": round(MONITOR_LOOP.retraso_maximo * 1000, 2)
+        },
+        "version_reglas": reglas_activas().version,
         "location": "Tierra del Fuego, Argentina"
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def obtener_metricas():
+    """Métricas del servicio en formato de texto de Prometheus"""
+    TIEMPO_ACTIVO.establecer(round(MONITOR_LOOP.tiempo_activo, 3))
+    RETRASO_LOOP.establecer(MONITOR_LOOP.ultimo_retraso, ("ultimo",))
+    RETRASO_LOOP.establecer(MONITOR_LOOP.retraso_promedio, ("promedio",))
+    RETRASO_LOOP.establecer(MONITOR_LOOP.retraso_maximo, ("maximo",))
+    
+    componentes = {
+        "cache": CACHE_DIAGNOSTICO.estadisticas(),
+        "notificaciones": CANAL_DIAGNOSTICOS.estadisticas(),
+        "incremental": DIAGNOSTICO_INCREMENTAL.estadisticas(),
+        "flota": ESTADO_FLOTA.estadisticas(),
+        "tendencias": ANALIZADOR_TENDENCIAS.estadisticas(),
+        "trabajos": GESTOR_TRABAJOS.estadisticas(),
+        "reglas": VIGILANTE_REGLAS.estadisticas(),
+        "admision": CONTROL_ADMISION.estadisticas(),
+        "cuotas": CUOTAS_CLIENTES.estadisticas(),
+        "coalescencia": VUELOS_DIAGNOSTICO.estadisticas()
+    }
+    if ALMACEN_SERIES is not None:
+        componentes["series"] = ALMACEN_SERIES.estadisticas()
+    if HISTORIAL is not None:
+        componentes["historial"] = HISTORIAL.estadisticas()
+    if SEGUIMIENTOS is not None:
+        componentes["seguimientos"] = SEGUIMIENTOS.estadisticas()
+    for componente, estadisticas in componentes.items():
+        for contador, valor in estadisticas.items():
+            if isinstance(valor, (int, float)):
+                ESTADO_COMPONENTES.establecer(valor, (componente, contador))
+    
+    return PlainTextResponse(METRICAS.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Configuración para ejecutar la aplicación
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,109 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from reglas_diagnostico import (
+    CatalogoReglas,
+    DTYPE_LECTURA,
+    INDICE_CULTIVO,
+    INDICE_ETAPA,
+    INDICE_SINTOMA,
+    SIN_SINTOMA,
+    CODIGO_INVALIDO
+)
+
+# Ejes admitidos en un barrido y celdas máximas de la grilla completa
+MAX_EJES = 3
+MAX_CELDAS = 250000
+
+ORDEN_PRIORIDAD = ("critica", "alta", "media", "baja")
+
+def cantidad_pasos(desde: float, hasta: float, paso: float) -> int:
+    """Valores de un eje de `desde` a `hasta` inclusive (tolerando el error de redondeo del último paso)"""
+    return math.floor((hasta - desde) / paso + 1e-9) + 1
+
+def valores_eje(desde: float, hasta: float, paso: float) -> np.ndarray:
+    # Se redondea para que, por ejemplo, 5.8 + 3 * 0.1 sea 6.1 y no 6.1000000000000005 al comparar con los límites
+    return np.round(desde + paso * np.arange(cantidad_pasos(desde, hasta, paso)), 9)
+
+class ResultadoBarrido:
+    """
+    Mapa de diagnósticos de una grilla de parámetros: `mapa` tiene la forma de
+    la grilla (un eje por parámetro barrido) y en cada celda el índice del
+    diagnóstico en `diagnosticos`, o -1 si la lectura no pasaría la validación
+    """
+    
+    __slots__ = ("ejes", "mapa", "codigos", "diagnosticos", "celdas")
+    
+    def __init__(self, ejes: list, mapa: np.ndarray, codigos: list, diagnosticos: list, celdas: list):
+        self.ejes = ejes
+        self.mapa = mapa
+        # Código en la tabla de decisión de cada diagnóstico y celdas en las que aparece
+        self.codigos = codigos
+        self.diagnosticos = diagnosticos
+        self.celdas = celdas
+    
+    @property
+    def invalidas(self) -> int:
+        return self.mapa.size - sum(self.celdas)
+    
+    def leyenda(self) -> list[dict]:
+        """Resumen de cada diagnóstico del mapa: acciones, prioridad máxima y celdas"""
+        leyenda = []
+        for indice, (codigo, diagnostico, celdas) in enumerate(zip(self.codigos, self.diagnosticos, self.celdas)):
+            prioridades = {accion.prioridad for accion in diagnostico.acciones}
+            leyenda.append({
+                "indice": indice,
+                "codigo": codigo,
+                "diagnostico": diagnostico.diagnostico,
+                "acciones": [accion.model_dump() for accion in diagnostico.acciones],
+                "prioridad": next((prioridad for prioridad in ORDEN_PRIORIDAD if prioridad in prioridades), None),
+                "parametros_criticos": diagnostico.parametros_criticos,
+                "celdas": celdas
+            })
+        return leyenda
+
+def barrer(
+    catalogo: CatalogoReglas,
+    cultivo: str,
+    etapa: str,
+    tipo_sintoma: Optional[str],
+    parametros: dict,
+    ejes: list[tuple[str, np.ndarray]]
+) -> ResultadoBarrido:
+    """
+    Diagnostica todas las combinaciones de los valores de `ejes` (parámetro,
+    valores) dejando el resto de los parámetros en `parametros`. La grilla se
+    arma como un arreglo de lecturas (DTYPE_LECTURA) y se evalúa de una vez con
+    la tabla de decisión, con una comparación por condición para toda la grilla.
+    """
+    forma = tuple(len(valores) for _, valores in ejes)
+    registros = np.zeros(math.prod(forma), dtype=DTYPE_LECTURA)
+    for campo, valor in parametros.items():
+        registros[campo] = valor
+    registros["marca_tiempo"] = np.nan
+    registros["cultivo"] = INDICE_CULTIVO[cultivo]
+    registros["etapa"] = INDICE_ETAPA[etapa]
+    registros["tipo_sintoma"] = INDICE_SINTOMA[tipo_sintoma] if tipo_sintoma else SIN_SINTOMA
+    for (campo, _), malla in zip(ejes, np.meshgrid(*(valores for _, valores in ejes), indexing="ij")):
+        registros[campo] = malla.ravel()
+    
+    codigos = catalogo.codificar_registros(registros)
+    
+    # Índices densos: los códigos de la tabla se reemplazan por su posición entre los distintos de la grilla
+    distintos, mapa = np.unique(codigos, return_inverse=True)
+    celdas = np.bincount(mapa, minlength=len(distintos))
+    if len(distintos) and distintos[0] == CODIGO_INVALIDO:
+        distintos = distintos[1:]
+        celdas = celdas[1:]
+        mapa -= 1
+    
+    tabla = catalogo.tabla
+    return ResultadoBarrido(
+        [(campo, valores) for campo, valores in ejes],
+        mapa.astype(np.int32).reshape(forma),
+        distintos.tolist(),
+        [tabla[codigo] for codigo in distintos.tolist()],
+        celdas.tolist()
+    )
@@ -0,0 +1,243 @@
+"""
+Benchmark reproducible de la API y del formateo de la interfaz.
+
+Ejecuta la aplicación ASGI en el mismo proceso (sin red ni servidor) y mide
+cada rama del árbol de decisión, los endpoints de referencia y
+DiagnosticoHidroponicoUI.formatear_resultado. Los resultados se guardan en JSON
+y pueden compararse contra una línea base para detectar regresiones.
+
+Uso:
+    python benchmark.py --salida resultados.json
+    python benchmark.py --baseline benchmarks/baseline.json --tolerancia 0.15
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+import app as api
+
+PARAMETROS_OPTIMOS = {
+    "ph": 6.0,
+    "conductividad_electrica": 1.6,
+    "temperatura_solucion": 20,
+    "humedad_relativa": 65,
+    "temperatura_ambiente": 15,
+    "horas_luz_diarias": 14,
+    "dias_desde_renovacion": 7,
+    "bomba_oxigenacion_funcionando": True
+}
+
+def entrada(parametros: dict = None, tipo_sintoma: str = None) -> dict:
+    return {
+        "cultivo": "lechuga",
+        "etapa": "crecimiento",
+        "sintomas_visuales": tipo_sintoma is not None,
+        "tipo_sintoma": tipo_sintoma,
+        "parametros": {**PARAMETROS_OPTIMOS, **(parametros or {})}
+    }
+
+# Una entrada por cada rama del árbol de decisión
+CASOS_DIAGNOSTICO = {
+    "optimo": entrada(),
+    "ph_bajo": entrada({"ph": 5.2}),
+    "ph_alto": entrada({"ph": 6.8}),
+    "ce_baja": entrada({"conductividad_electrica": 1.0}),
+    "ce_alta": entrada({"conductividad_electrica": 2.2}),
+    "temp_solucion_baja": entrada({"temperatura_solucion": 15}),
+    "temp_solucion_alta": entrada({"temperatura_solucion": 25}),
+    "humedad_alta": entrada({"humedad_relativa": 82}),
+    "humedad_baja": entrada({"humedad_relativa": 50}),
+    "luz_baja": entrada({"horas_luz_diarias": 9}),
+    "renovacion_vencida": entrada({"dias_desde_renovacion": 20}),
+    "todos_fuera_de_rango": entrada({
+        "ph": 5.2,
+        "conductividad_electrica": 2.2,
+        "temperatura_solucion": 15,
+        "humedad_relativa": 82,
+        "horas_luz_diarias": 9,
+        "dias_desde_renovacion": 20
+    }),
+    "sintoma_botrytis": entrada({"humedad_relativa": 82}, "manchas_marrones_bordes_blandos"),
+    "sintoma_manchas_otras_causas": entrada({}, "manchas_marrones_bordes_blandos"),
+    "sintoma_estres_frio": entrada({"temperatura_ambiente": 5}, "hojas_amarillas_desde_abajo"),
+    "sintoma_deficiencia_nutricional": entrada({}, "hojas_amarillas_desde_abajo"),
+    "sintoma_agua_caliente": entrada({"temperatura_solucion": 26}, "crecimiento_lento_raices_marrones"),
+    "sintoma_oxigenacion": entrada({}, "crecimiento_lento_raices_marrones")
+}
+
+# Métricas de latencia comparadas contra la línea base (p99 se informa pero es muy ruidoso)
+METRICAS_LATENCIA = ("p50_us", "p95_us")
+
+def percentiles(duraciones_ns: list[int]) -> dict:
+    microsegundos = np.asarray(duraciones_ns, dtype=np.float64) / 1000
+    p50, p95, p99 = np.percentile(microsegundos, [50, 95, 99])
+    total_segundos = microsegundos.sum() / 1e6
+    return {
+        "iteraciones": len(duraciones_ns),
+        "llamadas_por_segundo": round(len(duraciones_ns) / total_segundos, 1),
+        "p50_us": round(float(p50), 2),
+        "p95_us": round(float(p95), 2),
+        "p99_us": round(float(p99), 2)
+    }
+
+async def medir_async(funcion, iteraciones: int, calentamiento: int) -> dict:
+    for _ in range(calentamiento):
+        await funcion()
+    
+    duraciones = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter_ns()
+        await funcion()
+        duraciones.append(time.perf_counter_ns() - inicio)
+    resultado = percentiles(duraciones)
+    
+    # Las asignaciones se miden en una pasada aparte para no afectar los tiempos
+    muestras = max(1, iteraciones // 10)
+    tracemalloc.start()
+    asignado = 0
+    for _ in range(muestras):
+        tracemalloc.reset_peak()
+        actual, _ = tracemalloc.get_traced_memory()
+        await funcion()
+        _, pico = tracemalloc.get_traced_memory()
+        asignado += pico - actual
+    tracemalloc.stop()
+    resultado["bytes_asignados_por_llamada"] = asignado // muestras
+    return resultado
+
+def medir_sync(funcion, iteraciones: int, calentamiento: int) -> dict:
+    async def envoltorio():
+        funcion()
+    return asyncio.run(medir_async(envoltorio, iteraciones, calentamiento))
+
+async def medir_api(iteraciones: int, calentamiento: int) -> dict:
+    resultados = {}
+    transporte = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+        
+        async def verificar(respuesta: httpx.Response) -> httpx.Response:
+            if respuesta.status_code != 200:
+                raise RuntimeError(f"{respuesta.request.url} respondió {respuesta.status_code}: {respuesta.text}")
+            return respuesta
+        
+        for nombre, cuerpo in CASOS_DIAGNOSTICO.items():
+            async def diagnosticar(cuerpo=cuerpo):
+                await verificar(await cliente.post("/diagnostico", json=cuerpo))
+            resultados[f"diagnostico/{nombre}"] = await medir_async(diagnosticar, iteraciones, calentamiento)
+        
+        async def rangos():
+            await verificar(await cliente.get("/rangos-optimos/lechuga/crecimiento"))
+        resultados["rangos_optimos"] = await medir_async(rangos, iteraciones, calentamiento)
+        
+        async def cultivos():
+            await verificar(await cliente.get("/cultivos"))
+        resultados["cultivos"] = await medir_async(cultivos, iteraciones, calentamiento)
+    
+    return resultados
+
+def medir_formateo(iteraciones: int, calentamiento: int) -> dict:
+    try:
+        from interface import DiagnosticoHidroponicoUI
+    except ImportError as e:
+        print(f"⚠️ Se omite el formateo de la interfaz: {e}", file=sys.stderr)
+        return {}
+    
+    interfaz = DiagnosticoHidroponicoUI()
+    resultados = {}
+    for nombre in ("optimo", "todos_fuera_de_rango", "sintoma_botrytis"):
+        entrada_modelo = api.DiagnosticoInput.model_validate(CASOS_DIAGNOSTICO[nombre])
+        resultado = json.loads(api.DiagnosticoHidroponico.diagnosticar(entrada_modelo).model_dump_json())
+        resultados[f"formatear_resultado/{nombre}"] = medir_sync(
+            lambda resultado=resultado: interfaz.formatear_resultado(resultado),
+            iteraciones,
+            calentamiento
+        )
+    return resultados
+
+def comparar(actual: dict, baseline: dict, tolerancia: float) -> list[str]:
+    """Devuelve la lista de regresiones que superan la tolerancia relativa"""
+    regresiones = []
+    for caso, metricas in actual["casos"].items():
+        referencia = baseline.get("casos", {}).get(caso)
+        if referencia is None:
+            continue
+        for metrica in METRICAS_LATENCIA:
+            if referencia[metrica] > 0 and metricas[metrica] > referencia[metrica] * (1 + tolerancia):
+                regresiones.append(
+                    f"{caso}: {metrica} {referencia[metrica]} -> {metricas[metrica]} "
+                    f"(+{(metricas[metrica] / referencia[metrica] - 1) * 100:.1f}%)"
+                )
+        if metricas["llamadas_por_segundo"] < referencia["llamadas_por_segundo"] * (1 - tolerancia):
+            regresiones.append(
+                f"{caso}: llamadas_por_segundo {referencia['llamadas_por_segundo']} -> {metricas['llamadas_por_segundo']}"
+            )
+    return regresiones
+
+def commit_actual() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la API de diagnóstico hidropónico")
+    parser.add_argument("--iteraciones", type=int, default=2000, help="Llamadas medidas por caso")
+    parser.add_argument("--calentamiento", type=int, default=200, help="Llamadas previas no medidas por caso")
+    parser.add_argument("--salida", default="benchmark_resultados.json", help="Archivo JSON de resultados")
+    parser.add_argument("--baseline", help="Resultados previos contra los que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Empeoramiento relativo admitido (0.15 = 15%%)")
+    parser.add_argument("--sin-cache", action="store_true", help="Deshabilita el cache de diagnósticos")
+    args = parser.parse_args()
+    
+    if args.sin_cache:
+        api.CACHE_DIAGNOSTICO.habilitado = False
+    
+    casos = asyncio.run(medir_api(args.iteraciones, args.calentamiento))
+    casos.update(medir_formateo(args.iteraciones, args.calentamiento))
+    
+    resultados = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cache_habilitado": api.CACHE_DIAGNOSTICO.habilitado,
+        "iteraciones": args.iteraciones,
+        "casos": casos
+    }
+    
+    print(f"{'caso':45} {'llamadas/s':>11} {'p50 µs':>9} {'p95 µs':>9} {'p99 µs':>9} {'bytes':>9}")
+    for nombre, metricas in casos.items():
+        print(
+            f"{nombre:45} {metricas['llamadas_por_segundo']:>11} {metricas['p50_us']:>9} "
+            f"{metricas['p95_us']:>9} {metricas['p99_us']:>9} {metricas['bytes_asignados_por_llamada']:>9}"
+        )
+    
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {args.salida}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as archivo:
+            baseline = json.load(archivo)
+        regresiones = comparar(resultados, baseline, args.tolerancia)
+        if regresiones:
+            print(f"\n❌ Regresiones respecto de {args.baseline} (commit {baseline.get('commit')}):")
+            for regresion in regresiones:
+                print(f"  • {regresion}")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto de {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class CacheLRU:
+    """
+    Cache de tamaño acotado con desalojo LRU y expiración por tiempo (TTL).
+    Pensado para usarse desde el loop de eventos del servidor (sin bloqueos).
+    """
+    
+    def __init__(self, tamano_maximo: int = 4096, ttl_segundos: float = 300.0, habilitado: bool = True):
+        self.tamano_maximo = tamano_maximo
+        self.ttl_segundos = ttl_segundos
+        self.habilitado = habilitado
+        self._entradas: OrderedDict = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.expirados = 0
+        # Valores que el llamador decidió no guardar (por ejemplo, lecturas junto a un límite de las reglas)
+        self.omitidos = 0
+    
+    def obtener(self, clave: Hashable) -> Optional[Any]:
+        """Devuelve el valor guardado o None si no existe o expiró"""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+        
+        valor, vencimiento = entrada
+        if vencimiento <= time.monotonic():
+            del self._entradas[clave]
+            self.expirados += 1
+            self.fallos += 1
+            return None
+        
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return valor
+    
+    def guardar(self, clave: Hashable, valor: Any) -> None:
+        """Guarda un valor, desalojando los menos usados si se supera el tamaño máximo"""
+        self._entradas[clave] = (valor, time.monotonic() + self.ttl_segundos)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.tamano_maximo:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+    
+    def vaciar(self) -> None:
+        self._entradas.clear()
+    
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "habilitado": self.habilitado,
+            "entradas": len(self._entradas),
+            "tamano_maximo": self.tamano_maximo,
+            "ttl_segundos": self.ttl_segundos,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "expirados": self.expirados,
+            "omitidos": self.omitidos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0
+        }
+
+class VueloUnico:
+    """
+    Coalescencia de solicitudes idénticas en curso (single-flight): la primera
+    (líder) hace el trabajo y las que llegan con la misma clave mientras sigue
+    en curso esperan y comparten su resultado. La entrada se borra cuando el
+    líder termina, así que no guarda nada más allá de la solicitud original.
+    """
+    
+    def __init__(self, habilitado: bool = True):
+        self.habilitado = habilitado
+        self._en_vuelo: dict[Hashable, asyncio.Future] = {}
+        self.lideres = 0
+        self.coalescidas = 0
+    
+    def unirse(self, clave: Hashable) -> Optional[asyncio.Future]:
+        """Futuro del resultado de una solicitud idéntica en curso, o None si no la hay"""
+        futuro = self._en_vuelo.get(clave)
+        if futuro is not None:
+            self.coalescidas += 1
+        return futuro
+    
+    def iniciar(self, clave: Hashable) -> asyncio.Future:
+        """Registra al líder de `clave`; debe completar el futuro y llamar a terminar"""
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        self.lideres += 1
+        return futuro
+    
+    def terminar(self, clave: Hashable, futuro: asyncio.Future) -> None:
+        if self._en_vuelo.get(clave) is futuro:
+            del self._en_vuelo[clave]
+        if not futuro.done():
+            futuro.cancel()
+        elif not futuro.cancelled():
+            # Marca la excepción como consultada aunque ninguna solicitud se haya unido
+            futuro.exception()
+    
+    def estadisticas(self) -> dict:
+        return {
+            "habilitado": self.habilitado,
+            "en_vuelo": len(self._en_vuelo),
+            "lideres": self.lideres,
+            "coalescidas": self.coalescidas
+        }
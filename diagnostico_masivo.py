@@ -0,0 +1,221 @@
+"""
+Diagnóstico masivo de registros de sensores exportados (CSV o Parquet).
+
+Aplica el árbol de decisión a archivos con millones de lecturas sin pasar por
+la API: sólo importa las reglas (reglas_diagnostico), lee la entrada por bloques,
+reparte los bloques entre procesos y escribe los diagnósticos en Parquet o CSV
+a medida que se completan, en el mismo orden de la entrada.
+
+Columnas de entrada (con los nombres de la API): cultivo, etapa, ph,
+conductividad_electrica, temperatura_solucion, humedad_relativa,
+temperatura_ambiente, horas_luz_diarias, dias_desde_renovacion y, opcionalmente,
+sintomas_visuales y tipo_sintoma. Las demás columnas se copian a la salida.
+
+Uso:
+    python diagnostico_masivo.py lecturas.csv --salida diagnosticos.parquet
+    python diagnostico_masivo.py lecturas.parquet --salida diagnosticos.parquet --procesos 8
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    sys.exit("❌ Esta herramienta requiere pyarrow: pip install pyarrow")
+
+from reglas_diagnostico import CODIGO_INVALIDO, RUTA_REGLAS, CatalogoReglas, cargar_reglas
+
+COLUMNAS_NUMERICAS = (
+    "ph",
+    "conductividad_electrica",
+    "temperatura_solucion",
+    "humedad_relativa",
+    "temperatura_ambiente",
+    "horas_luz_diarias",
+    "dias_desde_renovacion"
+)
+
+COLUMNAS_OBLIGATORIAS = ("cultivo", "etapa", *COLUMNAS_NUMERICAS)
+
+ORDEN_PRIORIDAD = {"critica": 0, "alta": 1, "media": 2, "baja": 3}
+
+# Bytes aproximados por fila de CSV, para convertir filas por bloque en tamaño de lectura
+BYTES_POR_FILA_CSV = 96
+
+def leer_bloques(ruta: Path, filas_por_bloque: int):
+    """Lee la entrada por bloques de registros sin cargar el archivo completo"""
+    if ruta.suffix.lower() == ".parquet":
+        yield from pq.ParquetFile(ruta).iter_batches(batch_size=filas_por_bloque)
+        return
+    
+    lector = pa_csv.open_csv(
+        ruta,
+        read_options=pa_csv.ReadOptions(block_size=filas_por_bloque * BYTES_POR_FILA_CSV),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={columna: pa.float64() for columna in COLUMNAS_NUMERICAS},
+            strings_can_be_null=True
+        )
+    )
+    yield from lector
+
+def columna_texto(bloque: pa.RecordBatch, nombre: str) -> np.ndarray:
+    """Columna de texto como arreglo NumPy, convirtiendo cada valor distinto una sola vez"""
+    codificada = pc.fill_null(pc.cast(bloque.column(nombre), pa.string()), "").dictionary_encode()
+    valores = np.array(codificada.dictionary.to_pylist() or [""])
+    return valores[codificada.indices.to_numpy(zero_copy_only=False)]
+
+def preparar_columnas(bloque: pa.RecordBatch) -> dict:
+    """Extrae del bloque las columnas que necesita el árbol de decisión"""
+    columnas = {
+        nombre: pc.fill_null(pc.cast(bloque.column(nombre), pa.float64()), float("nan")).to_numpy(zero_copy_only=False)
+        for nombre in COLUMNAS_NUMERICAS
+    }
+    columnas["cultivo"] = columna_texto(bloque, "cultivo")
+    columnas["etapa"] = columna_texto(bloque, "etapa")
+    
+    # Igual que en la API: el tipo de síntoma sólo cuenta si hay síntomas visuales
+    if "tipo_sintoma" in bloque.schema.names:
+        tipo_sintoma = columna_texto(bloque, "tipo_sintoma")
+        if "sintomas_visuales" in bloque.schema.names:
+            visibles = pc.fill_null(pc.cast(bloque.column("sintomas_visuales"), pa.bool_()), False)
+            tipo_sintoma = np.where(visibles.to_numpy(zero_copy_only=False), tipo_sintoma, "")
+        columnas["tipo_sintoma"] = tipo_sintoma
+    else:
+        columnas["tipo_sintoma"] = np.full(bloque.num_rows, "")
+    return columnas
+
+def diagnosticar_bloque(columnas: dict, catalogo: CatalogoReglas) -> np.ndarray:
+    """Se ejecuta en los procesos del pool: devuelve el código de diagnóstico de cada fila"""
+    return catalogo.codificar_columnas(**columnas)
+
+def resumir_diagnostico(codigo: int, catalogo: CatalogoReglas) -> tuple[str, str, str, str]:
+    """Textos de salida de un código: diagnóstico, parámetros críticos, acciones y prioridad máxima"""
+    resultado = catalogo.decodificar(codigo)
+    acciones = ";".join(catalogo.nombres_acciones.get(id(accion), accion.tipo) for accion in resultado.acciones)
+    prioridad = min((accion.prioridad for accion in resultado.acciones), key=ORDEN_PRIORIDAD.get)
+    return resultado.diagnostico, ";".join(resultado.parametros_criticos), acciones, prioridad
+
+def columnas_diagnostico(codigos: np.ndarray, catalogo: CatalogoReglas) -> dict:
+    """
+    Columnas de salida codificadas por diccionario: cada diagnóstico distinto
+    se arma una sola vez y las filas guardan sólo su índice
+    """
+    unicos, inversa = np.unique(codigos, return_inverse=True)
+    textos = [
+        resumir_diagnostico(codigo, catalogo) if codigo != CODIGO_INVALIDO else ("", "", "", "")
+        for codigo in unicos.tolist()
+    ]
+    indices = inversa.astype(np.int32)
+    invalidas = codigos == CODIGO_INVALIDO
+    
+    columnas = {"lectura_valida": pa.array(~invalidas)}
+    for posicion, nombre in enumerate(("diagnostico", "parametros_criticos", "acciones", "prioridad_maxima")):
+        columnas[nombre] = pa.DictionaryArray.from_arrays(
+            indices, pa.array([texto[posicion] for texto in textos], pa.string()), mask=invalidas
+        )
+    return columnas
+
+class Escritor:
+    """Escribe los bloques diagnosticados en Parquet o CSV según la extensión de la salida"""
+    
+    def __init__(self, ruta: Path):
+        self.ruta = ruta
+        self.parquet = ruta.suffix.lower() == ".parquet"
+        self._escritor = None
+    
+    def escribir(self, tabla: pa.Table) -> None:
+        if not self.parquet:
+            # CSV no admite columnas codificadas por diccionario
+            tabla = pa.table({
+                nombre: columna.cast(columna.type.value_type) if pa.types.is_dictionary(columna.type) else columna
+                for nombre, columna in zip(tabla.column_names, tabla.columns)
+            })
+        if self._escritor is None:
+            if self.parquet:
+                self._escritor = pq.ParquetWriter(self.ruta, tabla.schema, compression="zstd")
+            else:
+                self._escritor = pa_csv.CSVWriter(self.ruta, tabla.schema)
+        self._escritor.write_table(tabla)
+    
+    def cerrar(self) -> None:
+        if self._escritor is not None:
+            self._escritor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnóstico masivo de lecturas exportadas (CSV o Parquet)")
+    parser.add_argument("entrada", type=Path, help="Archivo de lecturas (.csv o .parquet)")
+    parser.add_argument("--salida", type=Path, required=True, help="Archivo de diagnósticos (.parquet o .csv)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos del pool")
+    parser.add_argument("--filas-por-bloque", type=int, default=250_000, help="Lecturas por bloque enviado a cada proceso")
+    parser.add_argument("--solo-diagnostico", action="store_true", help="No copia las columnas de entrada a la salida")
+    parser.add_argument("--reglas", type=Path, default=RUTA_REGLAS, help="Archivo de reglas (por defecto, el de la API)")
+    args = parser.parse_args()
+    
+    if not args.entrada.exists():
+        sys.exit(f"❌ No existe el archivo {args.entrada}")
+    try:
+        catalogo = cargar_reglas(args.reglas)
+    except (OSError, ValueError) as e:
+        sys.exit(f"❌ No se pudieron cargar las reglas: {e}")
+    
+    inicio = time.perf_counter()
+    filas = 0
+    invalidas = 0
+    escritor = Escritor(args.salida)
+    
+    # Se limita la cantidad de bloques en vuelo para que la memoria no dependa del tamaño de la entrada
+    pendientes = deque()
+    en_vuelo = max(2, args.procesos * 2)
+    
+    def completar_siguiente():
+        nonlocal filas, invalidas
+        bloque, futuro = pendientes.popleft()
+        codigos = futuro.result()
+        diagnosticos = columnas_diagnostico(codigos, catalogo)
+        if args.solo_diagnostico:
+            tabla = pa.table(diagnosticos)
+        else:
+            tabla = pa.Table.from_batches([bloque])
+            for nombre, columna in diagnosticos.items():
+                tabla = tabla.append_column(nombre, columna)
+        escritor.escribir(tabla)
+        filas += len(codigos)
+        invalidas += int(np.count_nonzero(codigos == CODIGO_INVALIDO))
+    
+    try:
+        with ProcessPoolExecutor(max_workers=args.procesos) as pool:
+            for bloque in leer_bloques(args.entrada, args.filas_por_bloque):
+                faltantes = [c for c in COLUMNAS_OBLIGATORIAS if c not in bloque.schema.names]
+                if faltantes:
+                    sys.exit(f"❌ Faltan columnas en la entrada: {', '.join(faltantes)}")
+                
+                pendientes.append((bloque, pool.submit(diagnosticar_bloque, preparar_columnas(bloque), catalogo)))
+                if len(pendientes) >= en_vuelo:
+                    completar_siguiente()
+            
+            while pendientes:
+                completar_siguiente()
+    except (pa.ArrowInvalid, OSError) as e:
+        sys.exit(f"❌ Error leyendo {args.entrada}: {e}")
+    finally:
+        escritor.cerrar()
+    
+    duracion = time.perf_counter() - inicio
+    print(
+        f"✅ {filas} lecturas diagnosticadas ({invalidas} inválidas) en {duracion:.1f} s "
+        f"({filas / duracion * 60 / 1e6:.1f} millones/min, reglas {catalogo.version}) -> {args.salida}",
+        file=sys.stderr
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from typing import Optional
+
+import numpy as np
+
+# Percentiles informados por parámetro en el resumen de la flota
+PERCENTILES = (5, 25, 50, 75, 95)
+
+ORDEN_PRIORIDAD = ("critica", "alta", "media", "baja")
+
+OPERADORES = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+class EstadoFlota:
+    """
+    Última lectura y último diagnóstico de cada invernadero, guardados por
+    columnas en arreglos NumPy (una fila por invernadero) para resumir toda la
+    flota con operaciones vectorizadas. Los diagnósticos se guardan como un
+    índice a la lista de diagnósticos distintos, que son objetos compartidos.
+    """
+    
+    def __init__(self, columnas: tuple, cultivos: tuple, etapas: tuple, capacidad_inicial: int = 1024):
+        self.columnas = columnas
+        self.cultivos = cultivos
+        self.etapas = etapas
+        self._indice_cultivo = {cultivo: i for i, cultivo in enumerate(cultivos)}
+        self._indice_etapa = {etapa: i for i, etapa in enumerate(etapas)}
+        
+        self._filas: dict[str, int] = {}
+        self.invernaderos: list[str] = []
+        self.valores = np.full((capacidad_inicial, len(columnas)), np.nan)
+        self.cultivo = np.zeros(capacidad_inicial, dtype=np.int16)
+        self.etapa = np.zeros(capacidad_inicial, dtype=np.int16)
+        self.marca_tiempo = np.zeros(capacidad_inicial)
+        self.diagnostico = np.zeros(capacidad_inicial, dtype=np.int32)
+        
+        # Diagnósticos distintos vistos: id(diagnóstico) -> índice en la lista
+        self._diagnosticos: list = []
+        self._indice_diagnosticos: dict[int, int] = {}
+        self.lecturas_descartadas = 0
+    
+    def _crecer(self) -> None:
+        capacidad = len(self.marca_tiempo) * 2
+        self.valores = np.concatenate([self.valores, np.full_like(self.valores, np.nan)])
+        self.cultivo = np.resize(self.cultivo, capacidad)
+        self.etapa = np.resize(self.etapa, capacidad)
+        self.marca_tiempo = np.resize(self.marca_tiempo, capacidad)
+        self.diagnostico = np.resize(self.diagnostico, capacidad)
+    
+    def _indice_diagnostico(self, diagnostico) -> int:
+        indice = self._indice_diagnosticos.get(id(diagnostico))
+        if indice is None:
+            # Se conserva la referencia para que el id no pueda reutilizarse
+            indice = len(self._diagnosticos)
+            self._diagnosticos.append(diagnostico)
+            self._indice_diagnosticos[id(diagnostico)] = indice
+        return indice
+    
+    def actualizar(self, invernadero_id: str, cultivo: str, etapa: str, valores: dict, marca_tiempo: float, diagnostico) -> bool:
+        """Reemplaza el estado del invernadero; descarta lecturas más viejas que la guardada"""
+        fila = self._filas.get(invernadero_id)
+        if fila is None:
+            fila = len(self.invernaderos)
+            if fila == len(self.marca_tiempo):
+                self._crecer()
+            self._filas[invernadero_id] = fila
+            self.invernaderos.append(invernadero_id)
+        elif marca_tiempo < self.marca_tiempo[fila]:
+            self.lecturas_descartadas += 1
+            return False
+        
+        self.valores[fila] = [valores[columna] for columna in self.columnas]
+        self.cultivo[fila] = self._indice_cultivo[cultivo]
+        self.etapa[fila] = self._indice_etapa[etapa]
+        self.marca_tiempo[fila] = marca_tiempo
+        self.diagnostico[fila] = self._indice_diagnostico(diagnostico)
+        return True
+    
+    def resumir(
+        self,
+        columnas_estadisticas: tuple,
+        umbrales: dict,
+        cultivo: Optional[str] = None,
+        etapa: Optional[str] = None,
+        desde: Optional[float] = None
+    ) -> dict:
+        """
+        Resume el estado de los invernaderos seleccionados: cantidades por parámetro
+        crítico, por prioridad máxima de sus acciones y por cultivo/etapa, percentiles
+        de `columnas_estadisticas` y, para cada entrada de `umbrales`
+        (nombre -> (columna, operador, valor)), cuántos invernaderos la cumplen.
+        """
+        n = len(self.invernaderos)
+        seleccion = np.ones(n, dtype=bool)
+        if cultivo is not None:
+            seleccion &= self.cultivo[:n] == self._indice_cultivo[cultivo]
+        if etapa is not None:
+            seleccion &= self.etapa[:n] == self._indice_etapa[etapa]
+        if desde is not None:
+            seleccion &= self.marca_tiempo[:n] >= desde
+        
+        total = int(seleccion.sum())
+        valores = self.valores[:n][seleccion]
+        
+        # Una pasada por diagnóstico distinto, ponderada por la cantidad de invernaderos que lo tienen
+        conteos = np.bincount(self.diagnostico[:n][seleccion], minlength=len(self._diagnosticos))
+        por_parametro = {}
+        por_prioridad = dict.fromkeys(ORDEN_PRIORIDAD, 0)
+        por_diagnostico = {}
+        for indice in np.flatnonzero(conteos).tolist():
+            diagnostico = self._diagnosticos[indice]
+            cantidad = int(conteos[indice])
+            for parametro in diagnostico.parametros_criticos:
+                por_parametro[parametro] = por_parametro.get(parametro, 0) + cantidad
+            prioridades = {accion.prioridad for accion in diagnostico.acciones}
+            maxima = next((p for p in ORDEN_PRIORIDAD if p in prioridades), None)
+            if maxima is not None:
+                por_prioridad[maxima] += cantidad
+            por_diagnostico[diagnostico.diagnostico] = por_diagnostico.get(diagnostico.diagnostico, 0) + cantidad
+        
+        combinaciones = np.bincount(
+            self.cultivo[:n][seleccion] * len(self.etapas) + self.etapa[:n][seleccion],
+            minlength=len(self.cultivos) * len(self.etapas)
+        ).reshape(len(self.cultivos), len(self.etapas))
+        por_cultivo_etapa = {
+            self.cultivos[i]: {self.etapas[j]: int(combinaciones[i, j]) for j in np.flatnonzero(combinaciones[i]).tolist()}
+            for i in np.flatnonzero(combinaciones.sum(axis=1)).tolist()
+        }
+        
+        estadisticas = {}
+        if total:
+            posiciones = [self.columnas.index(columna) for columna in columnas_estadisticas]
+            # Un único ordenamiento por parámetro da mínimo, máximo y todos los percentiles
+            ordenados = np.sort(np.ascontiguousarray(valores[:, posiciones].T), axis=1)
+            rango = np.array(PERCENTILES) / 100 * (total - 1)
+            abajo = np.floor(rango).astype(np.intp)
+            arriba = np.minimum(abajo + 1, total - 1)
+            fraccion = rango - abajo
+            cuantiles = ordenados[:, abajo] * (1 - fraccion) + ordenados[:, arriba] * fraccion
+            medias = ordenados.mean(axis=1)
+            for k, columna in enumerate(columnas_estadisticas):
+                estadisticas[columna] = {
+                    "minimo": round(float(ordenados[k, 0]), 3),
+                    **{f"p{p}": round(float(cuantiles[k, i]), 3) for i, p in enumerate(PERCENTILES)},
+                    "maximo": round(float(ordenados[k, -1]), 3),
+                    "media": round(float(medias[k]), 3)
+                }
+        
+        cumplen = {}
+        for nombre, (columna, operador, umbral) in umbrales.items():
+            columna_valores = valores[:, self.columnas.index(columna)]
+            cumplen[nombre] = int(OPERADORES[operador](columna_valores, umbral).sum())
+        
+        return {
+            "invernaderos": total,
+            "por_parametro_critico": dict(sorted(por_parametro.items(), key=lambda item: -item[1])),
+            "por_prioridad_maxima": por_prioridad,
+            "por_diagnostico": dict(sorted(por_diagnostico.items(), key=lambda item: -item[1])),
+            "por_cultivo_etapa": por_cultivo_etapa,
+            "umbrales": cumplen,
+            "parametros": estadisticas
+        }
+    
+    def estadisticas(self) -> dict:
+        return {
+            "invernaderos": len(self.invernaderos),
+            "diagnosticos_distintos": len(self._diagnosticos),
+            "lecturas_descartadas": self.lecturas_descartadas
+        }
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger("historial")
+
+# Prioridades de las acciones, de mayor a menor: cada diagnóstico se indexa por la más alta
+ORDEN_PRIORIDAD = ("critica", "alta", "media", "baja")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS diagnosticos (
+    id INTEGER PRIMARY KEY,
+    marca_tiempo REAL NOT NULL,
+    recibido REAL NOT NULL,
+    invernadero_id TEXT,
+    cultivo TEXT NOT NULL,
+    etapa TEXT NOT NULL,
+    prioridad TEXT,
+    diagnostico TEXT NOT NULL,
+    version_reglas TEXT,
+    entrada TEXT NOT NULL,
+    resultado TEXT NOT NULL,
+    acciones_predictivas TEXT
+);
+CREATE INDEX IF NOT EXISTS diagnosticos_invernadero ON diagnosticos (invernadero_id, marca_tiempo);
+CREATE INDEX IF NOT EXISTS diagnosticos_tiempo ON diagnosticos (marca_tiempo);
+CREATE INDEX IF NOT EXISTS diagnosticos_prioridad ON diagnosticos (prioridad, marca_tiempo);
+"""
+
+INSERCION = """
+INSERT INTO diagnosticos (
+    marca_tiempo, recibido, invernadero_id, cultivo, etapa, prioridad,
+    diagnostico, version_reglas, entrada, resultado, acciones_predictivas
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def prioridad_maxima(acciones) -> Optional[str]:
+    prioridades = {accion.prioridad for accion in acciones}
+    return next((prioridad for prioridad in ORDEN_PRIORIDAD if prioridad in prioridades), None)
+
+class HistorialDiagnosticos:
+    """
+    Historial de los pares entrada/diagnóstico en SQLite (modo WAL). Registrar
+    sólo encola la entrada y el diagnóstico, que son objetos inmutables: la
+    serialización y la escritura las hace una tarea de fondo en un hilo propio,
+    que guarda en una sola transacción todo lo que se acumuló mientras
+    escribía el lote anterior (hasta `tamano_lote` registros). Si la cola se
+    llena (`max_pendientes`), los registros nuevos se descartan y se cuentan en
+    lugar de frenar a las solicitudes. Las consultas usan conexiones propias de
+    sólo lectura, que en modo WAL no esperan a la escritura.
+    """
+    
+    def __init__(self, ruta: str, tamano_lote: int = 1000, max_pendientes: int = 100000):
+        self.ruta = Path(ruta)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.tamano_lote = tamano_lote
+        self._cola: asyncio.Queue = asyncio.Queue(maxsize=max_pendientes)
+        self._tarea: Optional[asyncio.Task] = None
+        # Un solo hilo escritor, dueño de la conexión de escritura
+        self._escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="historial")
+        self._conexion: Optional[sqlite3.Connection] = None
+        
+        conexion = self._conectar()
+        try:
+            conexion.executescript(ESQUEMA)
+        finally:
+            conexion.close()
+        
+        self.encolados = 0
+        self.descartados = 0
+        self.guardados = 0
+        self.lotes = 0
+        self.lote_maximo = 0
+        self.errores = 0
+        self.ultimo_error: Optional[str] = None
+    
+    def _conectar(self) -> sqlite3.Connection:
+        conexion = sqlite3.connect(self.ruta, timeout=5.0)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        # En modo WAL, NORMAL sólo sincroniza en los puntos de control: un corte de energía puede perder los últimos lotes pero no corrompe la base
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+    
+    def registrar(self, entrada, resultado, marca_tiempo: float, cuerpo: Optional[bytes] = None, acciones_predictivas: Optional[list] = None) -> bool:
+        """Encola un diagnóstico para guardarlo; devuelve False si la cola está llena y se descartó"""
+        try:
+            self._cola.put_nowait((marca_tiempo, time.time(), entrada, resultado, cuerpo, acciones_predictivas))
+        except asyncio.QueueFull:
+            self.descartados += 1
+            return False
+        self.encolados += 1
+        return True
+    
+    @staticmethod
+    def _fila(registro: tuple) -> tuple:
+        marca_tiempo, recibido, entrada, resultado, cuerpo, acciones_predictivas = registro
+        return (
+            marca_tiempo,
+            recibido,
+            entrada.invernadero_id,
+            entrada.cultivo.value,
+            entrada.etapa.value,
+            prioridad_maxima(resultado.acciones),
+            resultado.diagnostico,
+            resultado.version_reglas,
+            entrada.model_dump_json(),
+            cuerpo.decode() if cuerpo is not None else resultado.model_dump_json(),
+            "[" + ",".join(accion.model_dump_json() for accion in acciones_predictivas) + "]" if acciones_predictivas else None
+        )
+    
+    def _guardar(self, lote: list) -> None:
+        """Serializa y guarda un lote en una transacción (en el hilo escritor)"""
+        if self._conexion is None:
+            self._conexion = self._conectar()
+        filas = [self._fila(registro) for registro in lote]
+        with self._conexion:
+            self._conexion.executemany(INSERCION, filas)
+    
+    async def _escribir(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            registro = await self._cola.get()
+            if registro is None:
+                return
+            lote = [registro]
+            while len(lote) < self.tamano_lote and not self._cola.empty():
+                registro = self._cola.get_nowait()
+                if registro is None:
+                    # Se vuelve a dejar la marca de cierre para terminar después de guardar este lote
+                    self._cola.put_nowait(None)
+                    break
+                lote.append(registro)
+            
+            try:
+                await loop.run_in_executor(self._escritor, self._guardar, lote)
+            except Exception as e:
+                # Cualquier error descarta sólo este lote: si la tarea terminara, la cola se llenaría sin aviso
+                self.errores += 1
+                self.ultimo_error = repr(e)
+                logger.exception("No se pudo guardar un lote de %d diagnósticos", len(lote))
+                continue
+            self.guardados += len(lote)
+            self.lotes += 1
+            self.lote_maximo = max(self.lote_maximo, len(lote))
+    
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._escribir())
+    
+    async def detener(self) -> None:
+        """Guarda lo que quedaba en la cola y cierra la conexión de escritura"""
+        if self._tarea is not None:
+            await self._cola.put(None)
+            await self._tarea
+            self._tarea = None
+        if self._conexion is not None:
+            await asyncio.get_running_loop().run_in_executor(self._escritor, self._conexion.close)
+            self._conexion = None
+    
+    def _consultar(
+        self,
+        invernadero_id: Optional[str],
+        desde: Optional[float],
+        hasta: Optional[float],
+        prioridades: Optional[list],
+        cursor: Optional[tuple],
+        limite: int
+    ) -> bytes:
+        condiciones = []
+        argumentos = []
+        if invernadero_id is not None:
+            condiciones.append("invernadero_id = ?")
+            argumentos.append(invernadero_id)
+        if desde is not None:
+            condiciones.append("marca_tiempo >= ?")
+            argumentos.append(desde)
+        if hasta is not None:
+            condiciones.append("marca_tiempo <= ?")
+            argumentos.append(hasta)
+        if prioridades:
+            condiciones.append(f"prioridad IN ({', '.join('?' * len(prioridades))})")
+            argumentos.extend(prioridades)
+        if cursor is not None:
+            condiciones.append("(marca_tiempo, id) < (?, ?)")
+            argumentos.extend(cursor)
+        consulta = (
+            "SELECT id, marca_tiempo, recibido, version_reglas, entrada, resultado, acciones_predictivas FROM diagnosticos"
+            + (" WHERE " + " AND ".join(condiciones) if condiciones else "")
+            + " ORDER BY marca_tiempo DESC, id DESC LIMIT ?"
+        )
+        
+        conexion = sqlite3.connect(f"{self.ruta.resolve().as_uri()}?mode=ro", uri=True, timeout=5.0)
+        try:
+            filas = conexion.execute(consulta, (*argumentos, limite + 1)).fetchall()
+        finally:
+            conexion.close()
+        
+        # Las entradas y los diagnósticos ya están guardados como JSON: se arma la respuesta sin volver a decodificarlos
+        siguiente = f"{filas[limite - 1][1]!r}_{filas[limite - 1][0]}" if len(filas) > limite else None
+        registros = ",".join(
+            f'{{"id":{fila_id},"marca_tiempo":{marca!r},"recibido":{recibido!r},'
+            f'"version_reglas":{json.dumps(version)},"entrada":{entrada},"resultado":{resultado},'
+            f'"acciones_predictivas":{predictivas or "null"}}}'
+            for fila_id, marca, recibido, version, entrada, resultado, predictivas in filas[:limite]
+        )
+        return f'{{"cantidad":{min(len(filas), limite)},"siguiente":{json.dumps(siguiente)},"registros":[{registros}]}}'.encode()
+    
+    async def consultar(
+        self,
+        invernadero_id: Optional[str] = None,
+        desde: Optional[float] = None,
+        hasta: Optional[float] = None,
+        prioridades: Optional[list] = None,
+        cursor: Optional[str] = None,
+        limite: int = 100
+    ) -> bytes:
+        """
+        Página de diagnósticos (JSON), del más reciente al más antiguo. `siguiente`
+        es el cursor de la página siguiente, o null si no hay más. Lanza
+        ValueError si el cursor es inválido.
+        """
+        posicion = None
+        if cursor is not None:
+            try:
+                marca, fila_id = cursor.rsplit("_", 1)
+                posicion = (float(marca), int(fila_id))
+            except ValueError:
+                raise ValueError(f"Cursor inválido: {cursor}") from None
+        return await asyncio.to_thread(self._consultar, invernadero_id, desde, hasta, prioridades, posicion, limite)
+    
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self._cola.qsize(),
+            "encolados": self.encolados,
+            "descartados": self.descartados,
+            "guardados": self.guardados,
+            "lotes": self.lotes,
+            "lote_maximo": self.lote_maximo,
+            "errores": self.errores,
+            "ultimo_error": self.ultimo_error
+        }
@@ -1,13 +1,176 @@
+import argparse
+import asyncio
 import gradio as gr
 import requests
+import httpx
 import json
+import numpy as np
+import os
+import threading
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, List, Tuple, Optional
 
 # Configuración de la API (ajustar si es necesario)
-API_BASE_URL = "http://localhost:8000"
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+
+# Tiempos máximos de conexión y de lectura (segundos)
+TIMEOUT_CONEXION = float(os.getenv("API_TIMEOUT_CONEXION", "3"))
+TIMEOUT_LECTURA = float(os.getenv("API_TIMEOUT_LECTURA", "10"))
+
+# Validez de los datos de referencia (rangos, cultivos) antes de revalidarlos
+TTL_REFERENCIA_SEGUNDOS = float(os.getenv("API_TTL_REFERENCIA", "300"))
+
+ENCABEZADOS_INTERFAZ = {"X-Prioridad": "interactiva"}
+
+# Modo en vivo: espera tras el último cambio antes de diagnosticar y eventos en vivo simultáneos (todas las sesiones)
+ESPERA_EN_VIVO_SEGUNDOS = float(os.getenv("INTERFAZ_ESPERA_EN_VIVO", "0.4"))
+CONCURRENCIA_EN_VIVO = int(os.getenv("INTERFAZ_CONCURRENCIA_EN_VIVO", "16"))
+
+# Salida de un evento que no debe modificar los resultados mostrados
+OMITIR_RESULTADO = (gr.skip(), gr.skip(), gr.skip())
+
+# Mapa de decisión: parámetros que pueden barrerse, con su etiqueta y el rango de sus controles
+PARAMETROS_BARRIDO = {
+    "ph": ("pH", 4.0, 8.0),
+    "conductividad_electrica": ("CE (mS/cm)", 0.5, 3.0),
+    "temperatura_solucion": ("Temperatura solución (°C)", 10.0, 30.0),
+    "humedad_relativa": ("Humedad relativa (%)", 30.0, 90.0),
+    "temperatura_ambiente": ("Temperatura ambiente (°C)", -10.0, 25.0),
+    "horas_luz_diarias": ("Horas de luz diarias", 8.0, 20.0),
+    "dias_desde_renovacion": ("Días desde renovación", 0.0, 30.0)
+}
+SIN_EJE = ""
+
+# Colores de las regiones del mapa (se repiten si hay más diagnósticos) y de las lecturas inválidas
+COLORES_MAPA = (
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189), (140, 86, 75),
+    (227, 119, 194), (188, 189, 34), (23, 190, 207), (174, 199, 232), (255, 187, 120), (152, 223, 138),
+    (255, 152, 150), (197, 176, 213), (196, 156, 148), (247, 182, 210), (219, 219, 141), (158, 218, 229)
+)
+COLOR_INVALIDO = (235, 235, 235)
+LADO_MAPA_PIXELES = 400
+
+def eje_barrido(parametro: str, desde: float, hasta: float, resolucion: int) -> Dict:
+    """Eje de un barrido con `resolucion` valores entre `desde` y `hasta` (paso entero para los días)"""
+    paso = (hasta - desde) / (resolucion - 1) if resolucion > 1 and hasta > desde else 1.0
+    if parametro == "dias_desde_renovacion":
+        desde, paso = float(round(desde)), float(max(1, round(paso)))
+    return {"parametro": parametro, "desde": desde, "hasta": hasta, "paso": paso}
+
+def dibujar_mapa(mapa: np.ndarray) -> np.ndarray:
+    """
+    Imagen RGB de un mapa de decisión de uno o dos ejes: el primer eje va en
+    horizontal y el segundo en vertical, con los valores crecientes hacia arriba
+    """
+    if mapa.ndim == 1:
+        mapa = mapa[:, np.newaxis]
+    paleta = np.array(COLORES_MAPA + (COLOR_INVALIDO,), dtype=np.uint8)
+    # Las celdas inválidas (-1) toman el último color de la paleta
+    indices = np.where(mapa >= 0, mapa % len(COLORES_MAPA), len(COLORES_MAPA))
+    imagen = paleta[indices.T[::-1]]
+    alto = max(1, LADO_MAPA_PIXELES // imagen.shape[0]) if mapa.shape[1] > 1 else LADO_MAPA_PIXELES // 8
+    ancho = max(1, LADO_MAPA_PIXELES // imagen.shape[1])
+    return np.repeat(np.repeat(imagen, alto, axis=0), ancho, axis=1)
+
+class ClienteAPI:
+    """
+    Cliente HTTP compartido por todos los operadores de la interfaz.
+    Reutiliza conexiones (keep-alive) con un pool acotado, aplica timeouts
+    y reintentos limitados, y guarda localmente los datos de referencia,
+    que se revalidan con ETag una vez vencido su TTL.
+    """
+    
+    def __init__(self, base_url: str, tamano_pool: int = 32):
+        self.base_url = base_url
+        self.timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+        
+        reintentos = Retry(
+            total=2,
+            connect=2,
+            read=1,
+            status=2,
+            backoff_factor=0.2,
+            # Los POST de diagnóstico no son idempotentes: sólo se reintentan si no llegaron a conectarse.
+            # Un 503 del control de admisión tampoco se reintenta, para no bloquear al operador esperando Retry-After
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        self.sesion = requests.Session()
+        # Las consultas de los operadores van por el carril prioritario del control de admisión
+        self.sesion.headers.update(ENCABEZADOS_INTERFAZ)
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=tamano_pool, max_retries=reintentos)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.mount("https://", adaptador)
+        
+        self.tamano_pool = tamano_pool
+        self._cliente_async: Optional[httpx.AsyncClient] = None
+        
+        # ruta -> (etag, datos, momento de la última validación)
+        self._referencia: Dict[str, Tuple[Optional[str], Dict, float]] = {}
+        self._bloqueo_referencia = threading.Lock()
+    
+    @property
+    def cliente_async(self) -> httpx.AsyncClient:
+        """Cliente asíncrono para los manejadores async de Gradio (se crea al primer uso)"""
+        if self._cliente_async is None:
+            self._cliente_async = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=ENCABEZADOS_INTERFAZ,
+                timeout=httpx.Timeout(TIMEOUT_LECTURA, connect=TIMEOUT_CONEXION),
+                limits=httpx.Limits(max_connections=self.tamano_pool, max_keepalive_connections=self.tamano_pool),
+                transport=httpx.AsyncHTTPTransport(retries=2)
+            )
+        return self._cliente_async
+    
+    def get(self, ruta: str, **kwargs) -> requests.Response:
+        return self.sesion.get(f"{self.base_url}{ruta}", timeout=self.timeout, **kwargs)
+    
+    def post(self, ruta: str, **kwargs) -> requests.Response:
+        return self.sesion.post(f"{self.base_url}{ruta}", timeout=self.timeout, **kwargs)
+    
+    async def post_async(self, ruta: str, **kwargs) -> httpx.Response:
+        return await self.cliente_async.post(ruta, **kwargs)
+    
+    def obtener_referencia(self, ruta: str) -> Dict:
+        """
+        Devuelve datos de referencia desde el cache local. Vencido el TTL se
+        revalidan con If-None-Match: un 304 sólo renueva el TTL. Si la API no
+        responde y hay una copia local, se usa esa copia.
+        """
+        with self._bloqueo_referencia:
+            guardado = self._referencia.get(ruta)
+        if guardado is not None and time.monotonic() - guardado[2] < TTL_REFERENCIA_SEGUNDOS:
+            return guardado[1]
+        
+        encabezados = {"If-None-Match": guardado[0]} if guardado and guardado[0] else {}
+        try:
+            response = self.get(ruta, headers=encabezados)
+        except requests.exceptions.RequestException:
+            if guardado is not None:
+                return guardado[1]
+            raise
+        
+        if response.status_code == 304 and guardado is not None:
+            datos = guardado[1]
+        else:
+            response.raise_for_status()
+            datos = response.json()
+        
+        with self._bloqueo_referencia:
+            self._referencia[ruta] = (response.headers.get("ETag") or (guardado[0] if guardado else None), datos, time.monotonic())
+        return datos
+
+# Cliente compartido por todas las sesiones de la interfaz
+cliente_api = ClienteAPI(API_BASE_URL)
 
 class DiagnosticoHidroponicoUI:
-    def __init__(self):
+    def __init__(self, cliente: ClienteAPI = cliente_api):
+        self.cliente = cliente
         self.rangos_optimos = {
             "ph": (5.8, 6.2),
             "ce": (1.4, 1.8),
@@ -16,12 +179,29 @@ class DiagnosticoHidroponicoUI:
             "horas_luz": (12, 16)
         }
     
+    def obtener_catalogo(self) -> Dict:
+        """Obtiene cultivos, etapas y síntomas disponibles (con valores por defecto si la API no responde)"""
+        try:
+            return self.cliente.obtener_referencia("/cultivos")
+        except (requests.exceptions.RequestException, ValueError):
+            return {
+                "cultivos": ["lechuga", "rucula", "microgreens", "aromaticas"],
+                "etapas": ["germinacion", "crecimiento", "pre_cosecha", "cualquier_etapa"],
+                "sintomas": [
+                    "manchas_marrones_bordes_blandos",
+                    "hojas_amarillas_desde_abajo",
+                    "crecimiento_lento_raices_marrones"
+                ]
+            }
+    
     def obtener_rangos_cultivo(self, cultivo: str, etapa: str) -> str:
         """Obtiene y muestra los rangos óptimos para el cultivo seleccionado"""
         try:
-            response = requests.get(f"{API_BASE_URL}/rangos-optimos/{cultivo}/{etapa}")
-            if response.status_code == 200:
-                rangos = response.json()["rangos_optimos"]
+            try:
+                rangos = self.cliente.obtener_referencia(f"/rangos-optimos/{cultivo}/{etapa}")["rangos_optimos"]
+            except requests.exceptions.HTTPError:
+                rangos = None
+            if rangos is not None:
                 texto = f"📊 **Rangos óptimos para {cultivo.title()} - {etapa.replace('_', ' ').title()}:**\n\n"
                 texto += f"• **pH:** {rangos['ph'][0]} - {rangos['ph'][1]}\n"
                 texto += f"• **CE:** {rangos['ce'][0]} - {rangos['ce'][1]} mS/cm\n"
@@ -34,8 +214,8 @@ class DiagnosticoHidroponicoUI:
         except:
             return "⚠️ Error de conexión con la API"
     
-    def realizar_diagnostico(
-        self,
+    @staticmethod
+    def _preparar_payload(
         cultivo: str,
         etapa: str,
         sintomas_visuales: bool,
@@ -48,11 +228,9 @@ class DiagnosticoHidroponicoUI:
         horas_luz: float,
         dias_renovacion: int,
         bomba_funcionando: bool
-    ) -> Tuple[str, str, str]:
-        """Realiza el diagnóstico y retorna resultado formateado"""
-        
-        # Preparar datos para la API
-        payload = {
+    ) -> Dict:
+        """Arma el cuerpo de la solicitud de diagnóstico a partir de los valores de la interfaz"""
+        return {
             "cultivo": cultivo,
             "etapa": etapa,
             "sintomas_visuales": sintomas_visuales,
@@ -68,24 +246,182 @@ class DiagnosticoHidroponicoUI:
                 "bomba_oxigenacion_funcionando": bomba_funcionando
             }
         }
+    
+    def realizar_diagnostico(
+        self,
+        cultivo: str,
+        etapa: str,
+        sintomas_visuales: bool,
+        tipo_sintoma: str,
+        ph: float,
+        ce: float,
+        temp_solucion: float,
+        humedad: float,
+        temp_ambiente: float,
+        horas_luz: float,
+        dias_renovacion: int,
+        bomba_funcionando: bool
+    ) -> Tuple[str, str, str]:
+        """Realiza el diagnóstico y retorna resultado formateado"""
+        
+        # Preparar datos para la API
+        payload = self._preparar_payload(
+            cultivo, etapa, sintomas_visuales, tipo_sintoma, ph, ce, temp_solucion,
+            humedad, temp_ambiente, horas_luz, dias_renovacion, bomba_funcionando
+        )
         
         try:
-            response = requests.post(f"{API_BASE_URL}/diagnostico", json=payload)
+            response = self.cliente.post("/diagnostico", json=payload)
             
             if response.status_code == 200:
                 resultado = response.json()
                 return self.formatear_resultado(resultado)
+            elif response.status_code in (429, 503):
+                return self._error_sobrecarga(response.headers.get("Retry-After")), "", ""
             else:
                 error_msg = f"❌ Error en la API: {response.status_code}"
                 return error_msg, "", ""
-                
+        
         except requests.exceptions.ConnectionError:
-            error_msg = "❌ **Error de conexión**\n\nNo se puede conectar con la API. Asegúrate de que el servidor esté ejecutándose en http://localhost:8000"
-            return error_msg, "", ""
+            return self._error_conexion(), "", ""
+        except requests.exceptions.Timeout:
+            return self._error_timeout(), "", ""
         except Exception as e:
             error_msg = f"❌ **Error inesperado**: {str(e)}"
             return error_msg, "", ""
     
+    async def realizar_diagnostico_async(
+        self,
+        cultivo: str,
+        etapa: str,
+        sintomas_visuales: bool,
+        tipo_sintoma: str,
+        ph: float,
+        ce: float,
+        temp_solucion: float,
+        humedad: float,
+        temp_ambiente: float,
+        horas_luz: float,
+        dias_renovacion: int,
+        bomba_funcionando: bool
+    ) -> Tuple[str, str, str]:
+        """Variante asíncrona de realizar_diagnostico para los manejadores async de Gradio"""
+        payload = self._preparar_payload(
+            cultivo, etapa, sintomas_visuales, tipo_sintoma, ph, ce, temp_solucion,
+            humedad, temp_ambiente, horas_luz, dias_renovacion, bomba_funcionando
+        )
+        
+        try:
+            response = await self.cliente.post_async("/diagnostico", json=payload)
+            
+            if response.status_code == 200:
+                return self.formatear_resultado(response.json())
+            elif response.status_code in (429, 503):
+                return self._error_sobrecarga(response.headers.get("Retry-After")), "", ""
+            else:
+                return f"❌ Error en la API: {response.status_code}", "", ""
+        
+        except httpx.ConnectError:
+            return self._error_conexion(), "", ""
+        except httpx.TimeoutException:
+            return self._error_timeout(), "", ""
+        except Exception as e:
+            return f"❌ **Error inesperado**: {str(e)}", "", ""
+    
+    def _preparar_barrido(
+        self,
+        eje_x: str,
+        desde_x: float,
+        hasta_x: float,
+        eje_y: str,
+        desde_y: float,
+        hasta_y: float,
+        resolucion: int,
+        *valores
+    ) -> Dict:
+        """Arma el cuerpo de la solicitud de barrido; los parámetros no barridos toman los valores de la interfaz"""
+        payload = self._preparar_payload(*valores)
+        ejes = [eje_barrido(eje_x, desde_x, hasta_x, int(resolucion))]
+        if eje_y and eje_y != eje_x:
+            ejes.append(eje_barrido(eje_y, desde_y, hasta_y, int(resolucion)))
+        return {
+            "cultivo": payload["cultivo"],
+            "etapa": payload["etapa"],
+            "tipo_sintoma": payload["tipo_sintoma"],
+            "parametros": payload["parametros"],
+            "ejes": ejes
+        }
+    
+    def _consultar_barrido(self, barrido: Dict) -> Tuple[Optional[Dict], str]:
+        """Mapa de decisión calculado por la API, o None y el mensaje de error"""
+        try:
+            response = self.cliente.post("/diagnostico/barrido", json=barrido)
+        except requests.exceptions.ConnectionError:
+            return None, self._error_conexion()
+        except requests.exceptions.Timeout:
+            return None, self._error_timeout()
+        
+        if response.status_code == 200:
+            return response.json(), ""
+        if response.status_code in (429, 503):
+            return None, self._error_sobrecarga(response.headers.get("Retry-After"))
+        if response.status_code in (413, 422):
+            detalle = response.json().get("detail")
+            if isinstance(detalle, str):
+                return None, f"❌ **Barrido inválido**: {detalle}"
+        return None, f"❌ Error en la API: {response.status_code}"
+    
+    def realizar_barrido(self, *valores) -> Tuple[Optional[np.ndarray], str]:
+        """Calcula el mapa de decisión y retorna la imagen y su leyenda (ver _preparar_barrido)"""
+        if not valores[0]:
+            return None, "⚠️ Selecciona al menos el parámetro del eje horizontal"
+        try:
+            resultado, error = self._consultar_barrido(self._preparar_barrido(*valores))
+            if resultado is None:
+                return None, error
+            return self.formatear_barrido(resultado)
+        except Exception as e:
+            return None, f"❌ **Error inesperado**: {str(e)}"
+    
+    @staticmethod
+    def formatear_barrido(resultado: Dict) -> Tuple[np.ndarray, str]:
+        """Imagen del mapa de decisión y leyenda con los ejes y el color de cada diagnóstico"""
+        mapa = np.array(resultado["mapa"], dtype=np.int32).reshape(resultado["forma"])
+        if mapa.ndim > 2:
+            raise ValueError("La interfaz sólo dibuja barridos de uno o dos parámetros")
+        
+        def muestra(color: tuple) -> str:
+            return f'<span style="display:inline-block;width:1em;height:1em;vertical-align:middle;background:rgb{color}"></span>'
+        
+        texto = "### 🗺️ Mapa de decisión\n\n"
+        for nombre, eje in zip(("horizontal", "vertical (creciente hacia arriba)"), resultado["ejes"]):
+            etiqueta = PARAMETROS_BARRIDO.get(eje["parametro"], (eje["parametro"],))[0]
+            texto += f"• **Eje {nombre}:** {etiqueta} de {eje['valores'][0]:g} a {eje['valores'][-1]:g} ({len(eje['valores'])} valores)\n"
+        texto += "\n"
+        
+        for diagnostico in resultado["diagnosticos"]:
+            color = COLORES_MAPA[diagnostico["indice"] % len(COLORES_MAPA)]
+            acciones = "; ".join(accion["descripcion"].split(" - ")[0] for accion in diagnostico["acciones"])
+            prioridad = f", prioridad {diagnostico['prioridad']}" if diagnostico["prioridad"] else ""
+            texto += f"{muestra(color)} **{diagnostico['diagnostico']}** ({diagnostico['celdas']} celdas{prioridad})"
+            texto += f"<br>{acciones}\n\n" if acciones else "\n\n"
+        if resultado["invalidas"]:
+            texto += f"{muestra(COLOR_INVALIDO)} Valores fuera de los límites válidos ({resultado['invalidas']} celdas)\n\n"
+        if len(resultado["diagnosticos"]) > len(COLORES_MAPA):
+            texto += "*Hay más diagnósticos que colores: los colores se repiten*\n\n"
+        texto += f"*Reglas versión {resultado['version_reglas']}*"
+        return dibujar_mapa(mapa), texto
+    
+    def _error_conexion(self) -> str:
+        return f"❌ **Error de conexión**\n\nNo se puede conectar con la API. Asegúrate de que el servidor esté ejecutándose en {self.cliente.base_url}"
+    
+    def _error_timeout(self) -> str:
+        return "⏱️ **La API no respondió a tiempo**\n\nIntenta nuevamente en unos segundos."
+    
+    def _error_sobrecarga(self, reintentar_en: Optional[str]) -> str:
+        espera = f" en {reintentar_en} segundos" if reintentar_en else " en unos segundos"
+        return f"⏳ **La API está sobrecargada**\n\nIntenta nuevamente{espera}."
+    
     def formatear_resultado(self, resultado: Dict) -> Tuple[str, str, str]:
         """Formatea el resultado del diagnóstico para la interfaz"""
         
@@ -138,7 +474,7 @@ class DiagnosticoHidroponicoUI:
     def verificar_api(self) -> str:
         """Verifica si la API está funcionando"""
         try:
-            response = requests.get(f"{API_BASE_URL}/health")
+            response = self.cliente.get("/health")
             if response.status_code == 200:
                 return "✅ API conectada correctamente"
             else:
@@ -146,11 +482,164 @@ class DiagnosticoHidroponicoUI:
         except:
             return "❌ No se puede conectar con la API"
 
+class DiagnosticoHidroponicoUIEmbebida(DiagnosticoHidroponicoUI):
+    """
+    Variante para el modo embebido: la interfaz corre dentro del proceso de la
+    API y llama a las reglas directamente, sin HTTP ni serialización JSON.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        # Importación diferida: el modo HTTP no necesita cargar el backend
+        import app as api
+        self.api = api
+    
+    def obtener_catalogo(self) -> Dict:
+        return {
+            "cultivos": [cultivo.value for cultivo in self.api.CultivoEnum],
+            "etapas": [etapa.value for etapa in self.api.EtapaEnum],
+            "sintomas": [sintoma.value for sintoma in self.api.SintomaEnum]
+        }
+    
+    def obtener_rangos_cultivo(self, cultivo: str, etapa: str) -> str:
+        rangos = self.api.DiagnosticoHidroponico.obtener_rangos_optimos(cultivo, etapa)
+        texto = f"📊 **Rangos óptimos para {cultivo.title()} - {etapa.replace('_', ' ').title()}:**\n\n"
+        texto += f"• **pH:** {rangos['ph'][0]} - {rangos['ph'][1]}\n"
+        texto += f"• **CE:** {rangos['ce'][0]} - {rangos['ce'][1]} mS/cm\n"
+        texto += f"• **Temp. solución:** {rangos['temp_solucion'][0]} - {rangos['temp_solucion'][1]}°C\n"
+        texto += f"• **Humedad:** {rangos['humedad'][0]} - {rangos['humedad'][1]}%\n"
+        texto += f"• **Horas luz:** {rangos['horas_luz'][0]} - {rangos['horas_luz'][1]}h\n"
+        return texto
+    
+    def realizar_diagnostico(self, *valores) -> Tuple[str, str, str]:
+        try:
+            entrada = self.api.DiagnosticoInput.model_validate(self._preparar_payload(*valores))
+        except self.api.ValidationError as e:
+            return f"❌ **Datos inválidos**: {self.api.describir_error_validacion(e)}", "", ""
+        
+        resultado, cuerpo = self.api.diagnosticar_con_cache(entrada)
+        self.api.registrar_diagnostico(entrada, resultado, cuerpo)
+        return self.formatear_resultado(resultado.model_dump())
+    
+    async def realizar_diagnostico_async(self, *valores) -> Tuple[str, str, str]:
+        # El diagnóstico tarda microsegundos: no vale la pena derivarlo a un hilo
+        return self.realizar_diagnostico(*valores)
+    
+    def _consultar_barrido(self, barrido: Dict) -> Tuple[Optional[Dict], str]:
+        try:
+            return self.api.calcular_barrido(self.api.BarridoInput.model_validate(barrido))[0], ""
+        except self.api.ValidationError as e:
+            return None, f"❌ **Datos inválidos**: {self.api.describir_error_validacion(e)}"
+        except self.api.HTTPException as e:
+            return None, f"❌ **Barrido inválido**: {e.detail}"
+    
+    def verificar_api(self) -> str:
+        return "✅ Modo embebido: el diagnóstico se ejecuta en el mismo proceso que la API"
+
+class SesionEnVivo:
+    """Estado del modo en vivo de una sesión de la interfaz"""
+    
+    __slots__ = ("pendientes", "ultimo_cambio", "esperando", "tarea", "valores", "resultado")
+    
+    def __init__(self):
+        self.pendientes: Optional[tuple] = None
+        self.ultimo_cambio = 0.0
+        self.esperando = False
+        self.tarea: Optional[asyncio.Task] = None
+        self.valores: Optional[tuple] = None
+        self.resultado: Optional[Tuple[str, str, str]] = None
+
+class DiagnosticoEnVivo:
+    """
+    Diagnóstico a medida que el operador mueve los controles. En cada sesión
+    el primer cambio de una ráfaga espera a que los valores se asienten
+    (`espera` segundos sin cambios); los siguientes sólo actualizan los valores
+    pendientes y terminan enseguida, así que una ráfaga ocupa un solo lugar de
+    la cola de Gradio y produce una sola consulta. Si los valores asentados son
+    los del último diagnóstico se reutiliza su resultado, y una consulta nueva
+    cancela la que la sesión tenga todavía en curso.
+    """
+    
+    def __init__(self, diagnostico_ui: DiagnosticoHidroponicoUI, espera: float = ESPERA_EN_VIVO_SEGUNDOS, max_sesiones: int = 1000):
+        self.diagnostico_ui = diagnostico_ui
+        self.espera = espera
+        self.max_sesiones = max_sesiones
+        self._sesiones: OrderedDict[str, SesionEnVivo] = OrderedDict()
+        self.cambios = 0
+        self.agrupados = 0
+        self.reutilizados = 0
+        self.cancelados = 0
+        self.consultas = 0
+    
+    def _sesion(self, sesion_id: str) -> SesionEnVivo:
+        sesion = self._sesiones.get(sesion_id)
+        if sesion is None:
+            sesion = self._sesiones[sesion_id] = SesionEnVivo()
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
+        else:
+            self._sesiones.move_to_end(sesion_id)
+        return sesion
+    
+    async def diagnosticar(self, sesion_id: str, valores: tuple) -> tuple:
+        """Resultado para los valores asentados de la sesión, o gr.skip() si el cambio se agrupó con otro"""
+        sesion = self._sesion(sesion_id)
+        sesion.pendientes = valores
+        sesion.ultimo_cambio = time.monotonic()
+        self.cambios += 1
+        if sesion.esperando:
+            self.agrupados += 1
+            return OMITIR_RESULTADO
+        
+        sesion.esperando = True
+        try:
+            while (restante := sesion.ultimo_cambio + self.espera - time.monotonic()) > 0:
+                await asyncio.sleep(restante)
+        finally:
+            sesion.esperando = False
+        valores = sesion.pendientes
+        
+        if valores == sesion.valores:
+            self.reutilizados += 1
+            return sesion.resultado
+        
+        if sesion.tarea is not None and not sesion.tarea.done():
+            sesion.tarea.cancel()
+            self.cancelados += 1
+        tarea = sesion.tarea = asyncio.ensure_future(self.diagnostico_ui.realizar_diagnostico_async(*valores))
+        self.consultas += 1
+        try:
+            resultado = await tarea
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                tarea.cancel()
+                raise
+            # La reemplazó la consulta de valores más nuevos, que mostrará su propio resultado
+            return OMITIR_RESULTADO
+        
+        # Los errores (API caída, sobrecarga) vuelven sin acciones y no se guardan, para reintentar con los mismos valores
+        if resultado[1]:
+            sesion.valores = valores
+            sesion.resultado = resultado
+        return resultado
+    
+    def estadisticas(self) -> Dict:
+        return {
+            "sesiones": len(self._sesiones),
+            "cambios": self.cambios,
+            "agrupados": self.agrupados,
+            "reutilizados": self.reutilizados,
+            "cancelados": self.cancelados,
+            "consultas": self.consultas
+        }
+
 # Crear instancia del diagnóstico
 diagnostico_ui = DiagnosticoHidroponicoUI()
 
 # Definir la interfaz de Gradio
-def crear_interfaz():
+def crear_interfaz(diagnostico_ui: DiagnosticoHidroponicoUI = diagnostico_ui):
+    diagnostico_en_vivo = DiagnosticoEnVivo(diagnostico_ui)
+    
     with gr.Blocks(
         title="🌱 Diagnóstico Hidropónico - Tierra del Fuego",
         theme=gr.themes.Soft(),
@@ -207,14 +696,16 @@ def crear_interfaz():
             with gr.Column(scale=1):
                 gr.Markdown("### 🌿 Información del Cultivo")
                 
+                catalogo = diagnostico_ui.obtener_catalogo()
+                
                 cultivo = gr.Dropdown(
-                    choices=["lechuga", "rucula", "microgreens", "aromaticas"],
+                    choices=catalogo["cultivos"],
                     label="Tipo de Cultivo",
                     value="lechuga"
                 )
                 
                 etapa = gr.Dropdown(
-                    choices=["germinacion", "crecimiento", "pre_cosecha", "cualquier_etapa"],
+                    choices=catalogo["etapas"],
                     label="Etapa del Cultivo",
                     value="crecimiento"
                 )
@@ -236,11 +727,7 @@ def crear_interfaz():
                 )
                 
                 tipo_sintoma = gr.Dropdown(
-                    choices=[
-                        "manchas_marrones_bordes_blandos",
-                        "hojas_amarillas_desde_abajo", 
-                        "crecimiento_lento_raices_marrones"
-                    ],
+                    choices=catalogo["sintomas"],
                     label="Tipo de síntoma (si aplica)",
                     visible=False
                 )
@@ -298,6 +785,11 @@ def crear_interfaz():
                     elem_classes=["primary-button"],
                     size="lg"
                 )
+                
+                en_vivo = gr.Checkbox(
+                    label="⚡ Diagnóstico en vivo (se actualiza al cambiar los parámetros)",
+                    value=False
+                )
             
             # Columna derecha: Resultados
             with gr.Column(scale=1):
@@ -311,16 +803,74 @@ def crear_interfaz():
                 
                 with gr.Tab("🌪️ Clima Fueguino"):
                     resultado_observaciones = gr.Markdown("")
+                
+                with gr.Tab("🗺️ Mapa de decisión"):
+                    gr.Markdown("Diagnóstico de toda una grilla de valores de uno o dos parámetros; los demás toman los valores ingresados a la izquierda.")
+                    opciones_eje = [(etiqueta, parametro) for parametro, (etiqueta, _, _) in PARAMETROS_BARRIDO.items()]
+                    
+                    with gr.Row():
+                        eje_x = gr.Dropdown(choices=opciones_eje, value="ph", label="Eje horizontal")
+                        desde_x = gr.Number(value=PARAMETROS_BARRIDO["ph"][1], label="Desde")
+                        hasta_x = gr.Number(value=PARAMETROS_BARRIDO["ph"][2], label="Hasta")
+                    
+                    with gr.Row():
+                        eje_y = gr.Dropdown(
+                            choices=[("(ninguno)", SIN_EJE)] + opciones_eje,
+                            value="conductividad_electrica",
+                            label="Eje vertical"
+                        )
+                        desde_y = gr.Number(value=PARAMETROS_BARRIDO["conductividad_electrica"][1], label="Desde")
+                        hasta_y = gr.Number(value=PARAMETROS_BARRIDO["conductividad_electrica"][2], label="Hasta")
+                    
+                    resolucion = gr.Slider(minimum=10, maximum=200, step=10, value=100, label="Valores por eje")
+                    btn_mapa = gr.Button("🗺️ Generar mapa")
+                    imagen_mapa = gr.Image(label="Mapa de decisión", type="numpy", interactive=False)
+                    leyenda_mapa = gr.Markdown("")
+                    
+                    def rango_eje(parametro):
+                        if parametro not in PARAMETROS_BARRIDO:
+                            return gr.skip(), gr.skip()
+                        _, minimo, maximo = PARAMETROS_BARRIDO[parametro]
+                        return minimo, maximo
+                    
+                    eje_x.change(rango_eje, inputs=eje_x, outputs=[desde_x, hasta_x])
+                    eje_y.change(rango_eje, inputs=eje_y, outputs=[desde_y, hasta_y])
+        
+        entradas_diagnostico = [
+            cultivo, etapa, sintomas_visuales, tipo_sintoma,
+            ph, ce, temp_solucion, humedad, temp_ambiente,
+            horas_luz, dias_renovacion, bomba_funcionando
+        ]
+        salidas_diagnostico = [resultado_diagnostico, resultado_acciones, resultado_observaciones]
         
         # Configurar el botón de diagnóstico
         btn_diagnostico.click(
-            diagnostico_ui.realizar_diagnostico,
-            inputs=[
-                cultivo, etapa, sintomas_visuales, tipo_sintoma,
-                ph, ce, temp_solucion, humedad, temp_ambiente,
-                horas_luz, dias_renovacion, bomba_funcionando
-            ],
-            outputs=[resultado_diagnostico, resultado_acciones, resultado_observaciones]
+            diagnostico_ui.realizar_diagnostico_async,
+            inputs=entradas_diagnostico,
+            outputs=salidas_diagnostico
+        )
+        
+        btn_mapa.click(
+            diagnostico_ui.realizar_barrido,
+            inputs=[eje_x, desde_x, hasta_x, eje_y, desde_y, hasta_y, resolucion] + entradas_diagnostico,
+            outputs=[imagen_mapa, leyenda_mapa]
+        )
+        
+        # Modo en vivo: cada cambio dispara un evento, pero sólo se consulta la API con los valores asentados
+        async def diagnosticar_en_vivo(request: gr.Request, activo: bool, *valores):
+            if not activo:
+                return OMITIR_RESULTADO
+            return await diagnostico_en_vivo.diagnosticar(request.session_hash, valores)
+        
+        gr.on(
+            triggers=[en_vivo.change] + [componente.change for componente in entradas_diagnostico],
+            fn=diagnosticar_en_vivo,
+            inputs=[en_vivo] + entradas_diagnostico,
+            outputs=salidas_diagnostico,
+            show_progress="hidden",
+            trigger_mode="multiple",
+            concurrency_limit=CONCURRENCIA_EN_VIVO,
+            concurrency_id="diagnostico_en_vivo"
         )
         
         # Cargar rangos iniciales
@@ -338,6 +888,9 @@ def crear_interfaz():
             2. **Indica si hay síntomas visuales** - Si los hay, especifica el tipo
             3. **Ingresa los parámetros actuales** - Usa los medidores de tu sistema
             4. **Presiona 'Realizar Diagnóstico'** - Obtendrás recomendaciones específicas
+               (o activa el diagnóstico en vivo para verlas al mover los parámetros)
+            5. **Explora el mapa de decisión** - Muestra qué diagnóstico corresponde a cada
+               combinación de uno o dos parámetros, con el resto en los valores ingresados
             
             ### Consideraciones para Tierra del Fuego:
             - Las bajas temperaturas requieren calefacción constante
@@ -351,12 +904,36 @@ def crear_interfaz():
     
     return interfaz
 
+def crear_app_embebida(ruta: str = "/ui"):
+    """
+    Monta la interfaz en la aplicación FastAPI para servir API e interfaz
+    desde un único proceso. La interfaz queda disponible en `ruta`.
+    """
+    import app as api
+    interfaz = crear_interfaz(DiagnosticoHidroponicoUIEmbebida())
+    return gr.mount_gradio_app(api.app, interfaz, path=ruta)
+
 # Función principal para ejecutar la interfaz
 def main():
+    parser = argparse.ArgumentParser(description="Interfaz de diagnóstico hidropónico")
+    parser.add_argument(
+        "--modo",
+        choices=["http", "embebido"],
+        default=os.getenv("INTERFAZ_MODO", "http"),
+        help="http: la interfaz consulta a la API por HTTP; embebido: API e interfaz en un solo proceso"
+    )
+    parser.add_argument("--puerto", type=int, help="Puerto de escucha (7860 en modo http, 8000 en modo embebido)")
+    args = parser.parse_args()
+    
+    if args.modo == "embebido":
+        import uvicorn
+        uvicorn.run(crear_app_embebida(), host="0.0.0.0", port=args.puerto or 8000)
+        return
+    
     interfaz = crear_interfaz()
     interfaz.launch(
         server_name="0.0.0.0",
-        server_port=7860,
+        server_port=args.puerto or 7860,
         share=False,
         debug=True,
         show_error=True
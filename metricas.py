@@ -0,0 +1,181 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Optional
+
+# Límites (en segundos) de los intervalos del histograma de latencias
+LIMITES_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+class Contador:
+    """Contador monótono con etiquetas"""
+    
+    tipo = "counter"
+    
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.valores: dict[tuple, float] = {}
+    
+    def incrementar(self, valores_etiquetas: tuple = (), cantidad: float = 1) -> None:
+        self.valores[valores_etiquetas] = self.valores.get(valores_etiquetas, 0) + cantidad
+    
+    def exponer(self) -> list[str]:
+        return [
+            f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {valor}"
+            for clave, valor in self.valores.items()
+        ]
+
+class Medidor(Contador):
+    """Valor instantáneo que puede subir y bajar"""
+    
+    tipo = "gauge"
+    
+    def establecer(self, valor: float, valores_etiquetas: tuple = ()) -> None:
+        self.valores[valores_etiquetas] = valor
+
+class Histograma:
+    """Histograma acumulativo con límites fijos, al estilo de Prometheus"""
+    
+    tipo = "histogram"
+    
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), limites: tuple = LIMITES_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.limites = limites
+        # Por cada combinación de etiquetas: [conteos por intervalo..., suma, cantidad]
+        self.series: dict[tuple, list] = {}
+    
+    def observar(self, valor: float, valores_etiquetas: tuple = ()) -> None:
+        serie = self.series.get(valores_etiquetas)
+        if serie is None:
+            serie = self.series[valores_etiquetas] = [0] * (len(self.limites) + 1) + [0.0, 0]
+        serie[bisect_left(self.limites, valor)] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+    
+    def exponer(self) -> list[str]:
+        lineas = []
+        for clave, serie in self.series.items():
+            acumulado = 0
+            for limite, conteo in zip((*self.limites, "+Inf"), serie):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas, clave, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {serie[-2]}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {serie[-1]}")
+        return lineas
+
+class RegistroMetricas:
+    """Conjunto de métricas expuestas en formato de texto de Prometheus"""
+    
+    def __init__(self, prefijo: str):
+        self.prefijo = prefijo
+        self.metricas = []
+    
+    def _registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+    
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Contador:
+        return self._registrar(Contador(f"{self.prefijo}_{nombre}", ayuda, etiquetas))
+    
+    def medidor(self, nombre: str, ayuda: str, etiquetas: tuple = ()) -> Medidor:
+        return self._registrar(Medidor(f"{self.prefijo}_{nombre}", ayuda, etiquetas))
+    
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = (), limites: tuple = LIMITES_LATENCIA) -> Histograma:
+        return self._registrar(Histograma(f"{self.prefijo}_{nombre}", ayuda, etiquetas, limites))
+    
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self.metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide la latencia y las solicitudes en curso por ruta.
+    La ruta se toma de la plantilla resuelta por el router (p. ej.
+    /rangos-optimos/{cultivo}/{etapa}) para acotar la cantidad de series.
+    """
+    
+    def __init__(self, app, latencia: Histograma, en_curso: Medidor, respuestas: Contador):
+        self.app = app
+        self.latencia = latencia
+        self.en_curso = en_curso
+        self.respuestas = respuestas
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        estado = [500]
+        
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+        
+        metodo = scope["method"]
+        self.en_curso.incrementar((metodo,))
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.en_curso.incrementar((metodo,), -1)
+            ruta = scope.get("route")
+            plantilla = getattr(ruta, "path", "sin_ruta")
+            self.latencia.observar(duracion, (metodo, plantilla))
+            self.respuestas.incrementar((metodo, plantilla, str(estado[0])))
+
+class MonitorLoop:
+    """Mide el retraso del loop de eventos durmiendo a intervalos fijos"""
+    
+    def __init__(self, intervalo: float = 0.5):
+        self.intervalo = intervalo
+        self.inicio = time.time()
+        self.ultimo_retraso = 0.0
+        self.retraso_maximo = 0.0
+        self.retraso_promedio = 0.0
+        self._tarea: Optional[asyncio.Task] = None
+    
+    async def _medir(self) -> None:
+        while True:
+            esperado = time.perf_counter() + self.intervalo
+            await asyncio.sleep(self.intervalo)
+            retraso = max(0.0, time.perf_counter() - esperado)
+            self.ultimo_retraso = retraso
+            self.retraso_maximo = max(self.retraso_maximo, retraso)
+            # Media móvil exponencial para suavizar picos aislados
+            self.retraso_promedio = 0.9 * self.retraso_promedio + 0.1 * retraso
+    
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._medir())
+    
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+    
+    @property
+    def tiempo_activo(self) -> float:
+        return time.time() - self.inicio
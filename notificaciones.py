@@ -0,0 +1,118 @@
+import asyncio
+import json
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Optional
+
+class Suscripcion:
+    """Cola acotada de eventos de un cliente suscripto a uno o más invernaderos"""
+    
+    __slots__ = ("invernaderos", "cola", "cerrada")
+    
+    def __init__(self, invernaderos: Iterable[str], tamano_cola: int):
+        self.invernaderos = frozenset(invernaderos)
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=tamano_cola)
+        self.cerrada = False
+    
+    def cerrar(self) -> None:
+        """Descarta los eventos pendientes y deja un None para que el consumidor termine"""
+        if self.cerrada:
+            return
+        self.cerrada = True
+        while not self.cola.empty():
+            self.cola.get_nowait()
+        self.cola.put_nowait(None)
+    
+    async def siguiente(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Espera el próximo evento. Devuelve None si la suscripción fue cerrada;
+        lanza asyncio.TimeoutError si no hubo eventos en `timeout` segundos.
+        """
+        return await asyncio.wait_for(self.cola.get(), timeout)
+
+class CanalDiagnosticos:
+    """
+    Distribuye los diagnósticos de cada invernadero a sus suscriptores.
+    Sólo se publica cuando el diagnóstico cambia respecto del último conocido;
+    el evento se serializa una vez y se comparte entre todos los suscriptores.
+    Los clientes cuya cola se llena se desconectan en lugar de frenar al resto.
+    El último diagnóstico se recuerda para `max_invernaderos` invernaderos,
+    descartando los menos activos (LRU): la próxima lectura de un invernadero
+    descartado se vuelve a publicar aunque no haya cambiado.
+    """
+    
+    def __init__(self, tamano_cola: int = 64, max_invernaderos: int = 100000):
+        self.tamano_cola = tamano_cola
+        self.max_invernaderos = max_invernaderos
+        self._suscriptores: dict[str, set[Suscripcion]] = defaultdict(set)
+        # invernadero -> (último diagnóstico serializado, su evento)
+        self._ultimos: OrderedDict[str, tuple[bytes, bytes]] = OrderedDict()
+        self.publicados = 0
+        self.recordatorios = 0
+        self.sin_cambios = 0
+        self.desconectados_lentos = 0
+    
+    def suscribir(self, invernaderos: Iterable[str]) -> Suscripcion:
+        """Registra un suscriptor y le envía el último diagnóstico conocido de cada invernadero"""
+        suscripcion = Suscripcion(invernaderos, self.tamano_cola)
+        for invernadero_id in suscripcion.invernaderos:
+            self._suscriptores[invernadero_id].add(suscripcion)
+            ultimo = self._ultimos.get(invernadero_id)
+            if ultimo is not None and not suscripcion.cola.full():
+                suscripcion.cola.put_nowait(ultimo[1])
+        return suscripcion
+    
+    def desuscribir(self, suscripcion: Suscripcion) -> None:
+        for invernadero_id in suscripcion.invernaderos:
+            suscriptores = self._suscriptores.get(invernadero_id)
+            if suscriptores is not None:
+                suscriptores.discard(suscripcion)
+                if not suscriptores:
+                    del self._suscriptores[invernadero_id]
+    
+    def publicar(self, invernadero_id: str, diagnostico_json: bytes) -> bool:
+        """Publica el diagnóstico si cambió; devuelve True si se generó un evento"""
+        ultimo = self._ultimos.get(invernadero_id)
+        if ultimo is not None:
+            self._ultimos.move_to_end(invernadero_id)
+            if ultimo[0] == diagnostico_json:
+                self.sin_cambios += 1
+                return False
+        
+        evento = b'{"invernadero_id":%s,"diagnostico":%s}' % (
+            json.dumps(invernadero_id).encode(),
+            diagnostico_json
+        )
+        self._ultimos[invernadero_id] = (diagnostico_json, evento)
+        while len(self._ultimos) > self.max_invernaderos:
+            self._ultimos.popitem(last=False)
+        self.publicados += 1
+        self._distribuir(invernadero_id, evento)
+        return True
+    
+    def publicar_recordatorio(self, invernadero_id: str, recordatorio: dict) -> None:
+        """Publica un recordatorio de seguimiento; no se guarda como último evento del invernadero"""
+        evento = json.dumps({"invernadero_id": invernadero_id, "recordatorio": recordatorio}, ensure_ascii=False, separators=(",", ":")).encode()
+        self.recordatorios += 1
+        self._distribuir(invernadero_id, evento)
+    
+    def _distribuir(self, invernadero_id: str, evento: bytes) -> None:
+        for suscripcion in tuple(self._suscriptores.get(invernadero_id, ())):
+            try:
+                suscripcion.cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Consumidor lento: se lo desconecta para no acumular memoria
+                self.desuscribir(suscripcion)
+                suscripcion.cerrar()
+                self.desconectados_lentos += 1
+    
+    def estadisticas(self) -> dict:
+        suscripciones = {id(s) for suscriptores in self._suscriptores.values() for s in suscriptores}
+        return {
+            "suscriptores": len(suscripciones),
+            "invernaderos_con_suscriptores": len(self._suscriptores),
+            "invernaderos_conocidos": len(self._ultimos),
+            "eventos_publicados": self.publicados,
+            "recordatorios_publicados": self.recordatorios,
+            "lecturas_sin_cambios": self.sin_cambios,
+            "desconectados_lentos": self.desconectados_lentos
+        }
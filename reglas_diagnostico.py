@@ -0,0 +1,916 @@
+"""
+Reglas del sistema experto: modelos de entrada y salida, carga de los
+conjuntos de reglas declarativos (reglas.json: rangos por cultivo/etapa,
+reglas por parámetro y por síntoma y plantillas de acciones) y su compilación
+en una tabla de decisión. No depende del servidor web, de modo que puede
+importarse desde herramientas de línea de comandos sin cargar FastAPI.
+"""
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import Optional, Literal, get_args
+from enum import Enum
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+import asyncio
+import hashlib
+import logging
+import math
+import operator
+import os
+import time
+import numpy as np
+
+logger = logging.getLogger("reglas")
+
+# Enums para validación
+class CultivoEnum(str, Enum):
+    lechuga = "lechuga"
+    rucula = "rucula"
+    microgreens = "microgreens"
+    aromaticas = "aromaticas"
+
+class EtapaEnum(str, Enum):
+    germinacion = "germinacion"
+    crecimiento = "crecimiento"
+    pre_cosecha = "pre_cosecha"
+    cualquier_etapa = "cualquier_etapa"
+
+class SintomaEnum(str, Enum):
+    manchas_marrones_bordes_blandos = "manchas_marrones_bordes_blandos"
+    hojas_amarillas_desde_abajo = "hojas_amarillas_desde_abajo"
+    crecimiento_lento_raices_marrones = "crecimiento_lento_raices_marrones"
+
+# Modelos Pydantic
+class ParametrosAmbientales(BaseModel):
+    ph: float = Field(..., ge=0, le=14, description="pH de la solución nutritiva")
+    conductividad_electrica: float = Field(..., ge=0, description="CE en mS/cm")
+    temperatura_solucion: float = Field(..., description="Temperatura de la solución en °C")
+    humedad_relativa: float = Field(..., ge=0, le=100, description="Humedad relativa en %")
+    temperatura_ambiente: float = Field(..., description="Temperatura ambiente en °C")
+    horas_luz_diarias: float = Field(..., ge=0, le=24, description="Horas de luz diarias")
+    dias_desde_renovacion: int = Field(..., ge=0, description="Días desde la última renovación de solución")
+    bomba_oxigenacion_funcionando: bool = Field(True, description="Estado de la bomba de oxigenación")
+
+# Identificadores de invernadero válidos (se usan también como nombre de directorio)
+PATRON_INVERNADERO_ID = r"^[A-Za-z0-9][A-Za-z0-9_.-]*$"
+
+class DiagnosticoInput(BaseModel):
+    cultivo: CultivoEnum
+    etapa: EtapaEnum
+    sintomas_visuales: bool = Field(False, description="¿Hay síntomas visuales alarmantes?")
+    tipo_sintoma: Optional[SintomaEnum] = None
+    parametros: ParametrosAmbientales
+    invernadero_id: Optional[str] = Field(
+        None,
+        max_length=64,
+        pattern=PATRON_INVERNADERO_ID,
+        description="Identificador del invernadero o tanque"
+    )
+    marca_tiempo: Optional[datetime] = Field(None, description="Momento de la lectura (por defecto, el de recepción)")
+
+class Accion(BaseModel):
+    # Las acciones del catálogo se comparten entre diagnósticos, por eso son inmutables
+    model_config = ConfigDict(frozen=True)
+    
+    tipo: str
+    descripcion: str
+    prioridad: Literal["baja", "media", "alta", "critica"]
+    tiempo_revision: str
+
+class DiagnosticoOutput(BaseModel):
+    diagnostico: str
+    acciones: list[Accion]
+    parametros_criticos: list[str]
+    observaciones_clima_fueguino: list[str]
+    
+    version_reglas: Optional[str] = None
+
+# Representación compacta de lecturas para los caminos de mucho volumen
+CULTIVOS = tuple(cultivo.value for cultivo in CultivoEnum)
+ETAPAS = tuple(etapa.value for etapa in EtapaEnum)
+TIPOS_SINTOMA = tuple(sintoma.value for sintoma in SintomaEnum)
+INDICE_CULTIVO = {cultivo: i for i, cultivo in enumerate(CULTIVOS)}
+INDICE_ETAPA = {etapa: i for i, etapa in enumerate(ETAPAS)}
+INDICE_SINTOMA = {sintoma: i for i, sintoma in enumerate(TIPOS_SINTOMA)}
+SIN_SINTOMA = -1
+
+CAMPOS_PARAMETROS = tuple(ParametrosAmbientales.model_fields)
+
+# Una fila de 64 bytes por lectura. Cultivo, etapa y síntoma se guardan como
+# índices en CULTIVOS, ETAPAS y TIPOS_SINTOMA (SIN_SINTOMA si la lectura no
+# tiene síntomas visuales) y la marca de tiempo en segundos (NaN si no tiene).
+# El identificador del invernadero se lleva aparte.
+DTYPE_LECTURA = np.dtype([
+    ("ph", np.float64),
+    ("conductividad_electrica", np.float64),
+    ("temperatura_solucion", np.float64),
+    ("humedad_relativa", np.float64),
+    ("temperatura_ambiente", np.float64),
+    ("horas_luz_diarias", np.float64),
+    ("marca_tiempo", np.float64),
+    ("dias_desde_renovacion", np.int32),
+    ("cultivo", np.uint8),
+    ("etapa", np.uint8),
+    ("tipo_sintoma", np.int8),
+    ("bomba_oxigenacion_funcionando", np.bool_)
+])
+
+class Lectura:
+    """
+    Lectura de diagnóstico compacta: los mismos datos que DiagnosticoInput en
+    un objeto con __slots__ y sin el modelo anidado de parámetros. Cultivo,
+    etapa y síntoma son los valores de los enums; `tipo_sintoma` es None si
+    la lectura no tiene síntomas visuales. No se valida: debe construirse a
+    partir de una entrada ya validada (desde_entrada) o validarse con a_entrada.
+    """
+    
+    __slots__ = ("cultivo", "etapa", "tipo_sintoma", *CAMPOS_PARAMETROS, "invernadero_id", "marca_tiempo")
+    
+    def __init__(
+        self,
+        cultivo: str,
+        etapa: str,
+        ph: float,
+        conductividad_electrica: float,
+        temperatura_solucion: float,
+        humedad_relativa: float,
+        temperatura_ambiente: float,
+        horas_luz_diarias: float,
+        dias_desde_renovacion: int,
+        bomba_oxigenacion_funcionando: bool = True,
+        tipo_sintoma: Optional[str] = None,
+        invernadero_id: Optional[str] = None,
+        marca_tiempo: Optional[float] = None
+    ):
+        self.cultivo = cultivo
+        self.etapa = etapa
+        self.tipo_sintoma = tipo_sintoma
+        self.ph = ph
+        self.conductividad_electrica = conductividad_electrica
+        self.temperatura_solucion = temperatura_solucion
+        self.humedad_relativa = humedad_relativa
+        self.temperatura_ambiente = temperatura_ambiente
+        self.horas_luz_diarias = horas_luz_diarias
+        self.dias_desde_renovacion = dias_desde_renovacion
+        self.bomba_oxigenacion_funcionando = bomba_oxigenacion_funcionando
+        self.invernadero_id = invernadero_id
+        self.marca_tiempo = marca_tiempo
+    
+    @classmethod
+    def desde_entrada(cls, entrada: DiagnosticoInput) -> "Lectura":
+        parametros = entrada.parametros
+        return cls(
+            entrada.cultivo.value,
+            entrada.etapa.value,
+            parametros.ph,
+            parametros.conductividad_electrica,
+            parametros.temperatura_solucion,
+            parametros.humedad_relativa,
+            parametros.temperatura_ambiente,
+            parametros.horas_luz_diarias,
+            parametros.dias_desde_renovacion,
+            parametros.bomba_oxigenacion_funcionando,
+            entrada.tipo_sintoma.value if entrada.sintomas_visuales and entrada.tipo_sintoma else None,
+            entrada.invernadero_id,
+            entrada.marca_tiempo.timestamp() if entrada.marca_tiempo else None
+        )
+    
+    def a_entrada(self) -> DiagnosticoInput:
+        """Modelo pydantic equivalente (validado; lanza ValidationError si la lectura es inválida)"""
+        return DiagnosticoInput.model_validate({
+            "cultivo": self.cultivo,
+            "etapa": self.etapa,
+            "sintomas_visuales": self.tipo_sintoma is not None,
+            "tipo_sintoma": self.tipo_sintoma,
+            "parametros": {campo: getattr(self, campo) for campo in CAMPOS_PARAMETROS},
+            "invernadero_id": self.invernadero_id,
+            "marca_tiempo": (
+                datetime.fromtimestamp(self.marca_tiempo, timezone.utc) if self.marca_tiempo is not None else None
+            )
+        })
+    
+    def __repr__(self) -> str:
+        campos = ", ".join(f"{nombre}={getattr(self, nombre)!r}" for nombre in self.__slots__)
+        return f"Lectura({campos})"
+
+def _fila_lectura(lectura: "DiagnosticoInput | Lectura") -> tuple:
+    """Fila de DTYPE_LECTURA (en el orden de sus campos) de una entrada o una lectura compacta"""
+    if isinstance(lectura, Lectura):
+        parametros = lectura
+        cultivo, etapa, sintoma = lectura.cultivo, lectura.etapa, lectura.tipo_sintoma
+        marca_tiempo = lectura.marca_tiempo
+    else:
+        parametros = lectura.parametros
+        cultivo, etapa = lectura.cultivo.value, lectura.etapa.value
+        sintoma = lectura.tipo_sintoma.value if lectura.sintomas_visuales and lectura.tipo_sintoma else None
+        marca_tiempo = lectura.marca_tiempo.timestamp() if lectura.marca_tiempo else None
+    return (
+        parametros.ph,
+        parametros.conductividad_electrica,
+        parametros.temperatura_solucion,
+        parametros.humedad_relativa,
+        parametros.temperatura_ambiente,
+        parametros.horas_luz_diarias,
+        np.nan if marca_tiempo is None else marca_tiempo,
+        parametros.dias_desde_renovacion,
+        INDICE_CULTIVO[cultivo],
+        INDICE_ETAPA[etapa],
+        SIN_SINTOMA if sintoma is None else INDICE_SINTOMA[sintoma],
+        parametros.bomba_oxigenacion_funcionando
+    )
+
+def registros_desde_lecturas(lecturas: "list[DiagnosticoInput] | list[Lectura]") -> np.ndarray:
+    """Arreglo estructurado (DTYPE_LECTURA) de entradas validadas o lecturas compactas"""
+    return np.fromiter(map(_fila_lectura, lecturas), dtype=DTYPE_LECTURA, count=len(lecturas))
+
+def lecturas_desde_registros(registros: np.ndarray, invernaderos: Optional[list] = None) -> list[Lectura]:
+    """Lecturas compactas de un arreglo estructurado; `invernaderos` trae el identificador de cada fila"""
+    columnas = {campo: registros[campo].tolist() for campo in DTYPE_LECTURA.names}
+    marcas = [None if math.isnan(marca) else marca for marca in columnas["marca_tiempo"]]
+    sintomas = [None if sintoma == SIN_SINTOMA else TIPOS_SINTOMA[sintoma] for sintoma in columnas["tipo_sintoma"]]
+    return [
+        Lectura(CULTIVOS[cultivo], ETAPAS[etapa], *parametros, tipo_sintoma=sintoma, invernadero_id=invernadero, marca_tiempo=marca)
+        for cultivo, etapa, *parametros, sintoma, invernadero, marca in zip(
+            columnas["cultivo"],
+            columnas["etapa"],
+            *(columnas[campo] for campo in CAMPOS_PARAMETROS),
+            sintomas,
+            invernaderos if invernaderos is not None else [None] * len(registros),
+            marcas
+        )
+    ]
+
+def entradas_desde_registros(registros: np.ndarray, invernaderos: Optional[list] = None) -> list[DiagnosticoInput]:
+    """Modelos pydantic (validados) de un arreglo estructurado"""
+    return [lectura.a_entrada() for lectura in lecturas_desde_registros(registros, invernaderos)]
+
+# Definición declarativa de un conjunto de reglas (formato de reglas.json)
+OPERADORES = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+Operador = Literal["<", "<=", ">", ">="]
+
+# Parámetros de la lectura sobre los que pueden definirse reglas
+CampoRegla = Literal[
+    "ph",
+    "conductividad_electrica",
+    "temperatura_solucion",
+    "humedad_relativa",
+    "temperatura_ambiente",
+    "horas_luz_diarias",
+    "dias_desde_renovacion"
+]
+
+Numero = int | float
+
+class DefinicionAccion(BaseModel):
+    tipo: str
+    # Las acciones de reglas por rango admiten {minimo} y {maximo}; las de umbral, {valor}
+    descripcion: str
+    prioridad: Literal["baja", "media", "alta", "critica"]
+    tiempo_revision: str
+
+class Umbral(BaseModel):
+    operador: Operador
+    valor: Numero
+
+class Condicion(Umbral):
+    campo: CampoRegla
+
+class Consecuencia(BaseModel):
+    accion: str
+    observacion: Optional[str] = None
+
+class ReglaParametro(BaseModel):
+    """
+    Regla sobre un parámetro de la lectura: fuera del rango óptimo `rango`
+    (consecuencias `bajo` y `alto`) o más allá de un `umbral` fijo (`si_cumple`)
+    """
+    campo: CampoRegla
+    rango: Optional[str] = None
+    bajo: Optional[Consecuencia] = None
+    alto: Optional[Consecuencia] = None
+    umbral: Optional[Umbral] = None
+    si_cumple: Optional[Consecuencia] = None
+    # Si el campo se informa en parametros_criticos al dispararse la regla
+    critico: bool = True
+    # Nombre con el que se cuenta la condición en el resumen de la flota
+    riesgo: Optional[str] = None
+
+class ResultadoDefinido(BaseModel):
+    diagnostico: str
+    acciones: list[str]
+    parametros_criticos: list[str] = []
+    observaciones: list[str] = []
+
+class ReglaSintoma(BaseModel):
+    condicion: Condicion
+    riesgo: Optional[str] = None
+    si: ResultadoDefinido
+    no: ResultadoDefinido
+
+class DefinicionRangos(BaseModel):
+    por_defecto: dict[str, tuple[Numero, Numero]]
+    por_cultivo: dict[CultivoEnum, dict[str, tuple[Numero, Numero]]] = {}
+    por_cultivo_etapa: dict[CultivoEnum, dict[EtapaEnum, dict[str, tuple[Numero, Numero]]]] = {}
+
+class DefinicionReglas(BaseModel):
+    version: str = Field(..., min_length=1, max_length=64)
+    descripcion: str = ""
+    rangos: DefinicionRangos
+    acciones: dict[str, DefinicionAccion]
+    parametros: list[ReglaParametro]
+    diagnostico_optimo: ResultadoDefinido
+    diagnostico_fuera_de_rango: str = "Se detectaron {cantidad} parámetros fuera de rango"
+    sintomas: dict[SintomaEnum, ReglaSintoma]
+
+CODIGO_INVALIDO = -1
+
+# Tope de condiciones por parámetro: la tabla de decisión tiene 2**bits filas por variante de rangos
+MAX_BITS_CONDICIONES = 16
+
+def huella_definicion(definicion: DefinicionReglas) -> str:
+    return hashlib.blake2b(definicion.model_dump_json().encode(), digest_size=8).hexdigest()
+
+# Conjunto de reglas compilado
+class CatalogoReglas:
+    """
+    Conjunto de reglas compilado en una tabla de decisión plana. Cada lectura se
+    reduce a un código entero: en el diagnóstico por parámetros, la variante de
+    rangos de su cultivo/etapa seguida de un bit por condición; en el de
+    síntomas, el síntoma y el resultado de su condición. `tabla[código]` es el
+    diagnóstico ya armado (y serializado), así que evaluar una lectura es sólo
+    comparar sus parámetros con los límites de su fila. Los diagnósticos son
+    objetos compartidos: no deben modificarse.
+    """
+    
+    def __init__(self, definicion: DefinicionReglas, origen: str = ""):
+        self.definicion = definicion
+        self.version = definicion.version
+        self.huella = huella_definicion(definicion)
+        self.origen = origen
+        self.cargado = time.time()
+        
+        self.combinaciones = [(cultivo, etapa) for cultivo in CULTIVOS for etapa in ETAPAS]
+        self.indice_combinacion = {combinacion: k for k, combinacion in enumerate(self.combinaciones)}
+        self.rangos = {}
+        for cultivo in CultivoEnum:
+            for etapa in EtapaEnum:
+                rangos = dict(definicion.rangos.por_defecto)
+                rangos.update(definicion.rangos.por_cultivo.get(cultivo, {}))
+                rangos.update(definicion.rangos.por_cultivo_etapa.get(cultivo, {}).get(etapa, {}))
+                for nombre, (minimo, maximo) in rangos.items():
+                    if minimo > maximo:
+                        raise ValueError(f"Rango {nombre} de {cultivo.value}/{etapa.value}: el mínimo supera al máximo")
+                self.rangos[(cultivo.value, etapa.value)] = rangos
+        
+        # Una condición (bit) por lado de cada regla: (regla, consecuencia, operador, rango, lado, valor)
+        self._condiciones = []
+        self.rango_por_campo = {}
+        riesgos_parametros = {}
+        for regla in definicion.parametros:
+            if regla.rango is not None:
+                if regla.umbral is not None or not (regla.bajo or regla.alto):
+                    raise ValueError(f"La regla de {regla.campo} con rango debe tener 'bajo' o 'alto' y no 'umbral'")
+                self._rango_definido(regla.rango)
+                self.rango_por_campo.setdefault(regla.campo, regla.rango)
+                if regla.bajo:
+                    self._condiciones.append((regla, regla.bajo, "<", regla.rango, 0, None))
+                if regla.alto:
+                    self._condiciones.append((regla, regla.alto, ">", regla.rango, 1, None))
+            elif regla.umbral is not None and regla.si_cumple is not None:
+                self._condiciones.append((regla, regla.si_cumple, regla.umbral.operador, None, None, regla.umbral.valor))
+                if regla.riesgo:
+                    riesgos_parametros[regla.riesgo] = (regla.campo, regla.umbral.operador, regla.umbral.valor)
+            else:
+                raise ValueError(f"La regla de {regla.campo} necesita 'rango' o 'umbral' con 'si_cumple'")
+        
+        self.bits = len(self._condiciones)
+        if self.bits > MAX_BITS_CONDICIONES:
+            raise ValueError(f"Hay {self.bits} condiciones; el máximo es {MAX_BITS_CONDICIONES}")
+        self.campos = tuple(dict.fromkeys(regla.campo for regla in definicion.parametros))
+        
+        # Límite de cada condición por combinación cultivo/etapa: tabla plana (combinación x condición)
+        self.limites = np.array([
+            [
+                self.rangos[combinacion][rango][lado] if rango is not None else valor
+                for _, _, _, rango, lado, valor in self._condiciones
+            ]
+            for combinacion in self.combinaciones
+        ], dtype=np.float64).reshape(len(self.combinaciones), self.bits)
+        self._condiciones_combinacion = [
+            tuple(
+                (1 << bit, regla.campo, OPERADORES[operador], self.limites[k, bit].item())
+                for bit, (regla, _, operador, _, _, _) in enumerate(self._condiciones)
+            )
+            for k in range(len(self.combinaciones))
+        ]
+        
+        # Las descripciones con {minimo}/{maximo} dependen de los rangos: una variante por juego de rangos distinto
+        rangos_plantilla = list(dict.fromkeys(
+            rango
+            for _, consecuencia, _, rango, _, _ in self._condiciones
+            if rango is not None and "{" in self._definicion_accion(consecuencia.accion).descripcion
+        ))
+        claves = [tuple(self.rangos[c][rango] for rango in rangos_plantilla) for c in self.combinaciones]
+        claves_distintas = list(dict.fromkeys(claves))
+        self.variantes = [claves_distintas.index(clave) for clave in claves]
+        self.indice_variante = np.array(self.variantes, dtype=np.int32)
+        representantes = [self.rangos[self.combinaciones[claves.index(clave)]] for clave in claves_distintas]
+        
+        self.sintomas = TIPOS_SINTOMA
+        faltantes = [s for s in SintomaEnum if s not in definicion.sintomas]
+        if faltantes:
+            raise ValueError(f"Faltan reglas para los síntomas: {', '.join(s.value for s in faltantes)}")
+        self.indice_sintoma = {sintoma: i for i, sintoma in enumerate(self.sintomas)}
+        # Condiciones con nombre de riesgo, para contarlas en el resumen de la flota
+        self.umbrales_riesgo = {}
+        self.condiciones_sintoma = []
+        self._limites_lectura: dict[tuple, dict[str, tuple]] = {}
+        for sintoma in SintomaEnum:
+            condicion = definicion.sintomas[sintoma].condicion
+            self.condiciones_sintoma.append((condicion.campo, OPERADORES[condicion.operador], condicion.valor))
+            if definicion.sintomas[sintoma].riesgo:
+                self.umbrales_riesgo[definicion.sintomas[sintoma].riesgo] = (condicion.campo, condicion.operador, condicion.valor)
+        self.umbrales_riesgo.update(riesgos_parametros)
+        
+        # Tabla de decisión: todas las combinaciones posibles de condiciones por variante, y dos filas por síntoma
+        self._acciones: dict[tuple, Accion] = {}
+        self.nombres_acciones = {}
+        self.base_sintomas = len(claves_distintas) << self.bits
+        self.tabla: list[Optional[DiagnosticoOutput]] = [None] * (self.base_sintomas + 2 * len(self.sintomas))
+        estados = []
+        for regla in definicion.parametros:
+            mascaras = [1 << bit for bit, condicion in enumerate(self._condiciones) if condicion[0] is regla]
+            # Los lados de una misma regla son excluyentes
+            estados.append([0, *mascaras])
+        for variante, rangos in enumerate(representantes):
+            for combinacion in product(*estados):
+                mascara = sum(combinacion)
+                self.tabla[(variante << self.bits) | mascara] = self._armar_parametros(rangos, mascara)
+        for i, sintoma in enumerate(SintomaEnum):
+            regla = definicion.sintomas[sintoma]
+            self.tabla[self.base_sintomas + 2 * i] = self._armar_definido(regla.no)
+            self.tabla[self.base_sintomas + 2 * i + 1] = self._armar_definido(regla.si)
+        
+        # JSON de cada diagnóstico ya serializado: id(diagnóstico) -> (diagnóstico, bytes)
+        self.json_diagnosticos = {}
+        for diagnostico in self.tabla:
+            if diagnostico is not None and id(diagnostico) not in self.json_diagnosticos:
+                self.json_diagnosticos[id(diagnostico)] = (diagnostico, diagnostico.model_dump_json().encode())
+        self.cantidad_diagnosticos = len(self.json_diagnosticos)
+    
+    def __reduce__(self):
+        # Los procesos del pool reciben la definición y la compilan una sola vez (ver catalogo_para)
+        return catalogo_para, (self.huella, self.definicion)
+    
+    def _rango_definido(self, rango: str) -> None:
+        for combinacion, rangos in self.rangos.items():
+            if rango not in rangos:
+                raise ValueError(f"No hay rango '{rango}' para {combinacion[0]}/{combinacion[1]}")
+    
+    def _definicion_accion(self, nombre: str) -> DefinicionAccion:
+        definicion = self.definicion.acciones.get(nombre)
+        if definicion is None:
+            raise ValueError(f"La acción '{nombre}' no está definida")
+        return definicion
+    
+    def _accion(self, nombre: str, **contexto) -> Accion:
+        """Acción del catálogo con su descripción completada; una sola instancia por descripción"""
+        clave = (nombre, tuple(contexto.items()))
+        accion = self._acciones.get(clave)
+        if accion is None:
+            definicion = self._definicion_accion(nombre)
+            try:
+                descripcion = definicion.descripcion.format(**contexto) if contexto else definicion.descripcion
+            except (KeyError, IndexError, ValueError) as e:
+                raise ValueError(f"Descripción inválida en la acción '{nombre}': {e}") from e
+            accion = Accion(
+                tipo=definicion.tipo,
+                descripcion=descripcion,
+                prioridad=definicion.prioridad,
+                tiempo_revision=definicion.tiempo_revision
+            )
+            self._acciones[clave] = accion
+            self.nombres_acciones[id(accion)] = nombre
+        return accion
+    
+    def _armar_parametros(self, rangos: dict, mascara: int) -> DiagnosticoOutput:
+        """Diagnóstico por parámetros de las condiciones de `mascara`, en el orden de las reglas"""
+        acciones = []
+        parametros_criticos = []
+        observaciones = []
+        for bit, (regla, consecuencia, _, rango, _, valor) in enumerate(self._condiciones):
+            if not mascara >> bit & 1:
+                continue
+            if regla.critico and regla.campo not in parametros_criticos:
+                parametros_criticos.append(regla.campo)
+            if rango is not None:
+                minimo, maximo = rangos[rango]
+                acciones.append(self._accion(consecuencia.accion, minimo=minimo, maximo=maximo))
+            else:
+                acciones.append(self._accion(consecuencia.accion, valor=valor))
+            if consecuencia.observacion:
+                observaciones.append(consecuencia.observacion)
+        
+        if not acciones:
+            return self._armar_definido(self.definicion.diagnostico_optimo)
+        
+        # Las acciones ya están validadas: se construye sin volver a validar
+        return DiagnosticoOutput.model_construct(
+            diagnostico=self.definicion.diagnostico_fuera_de_rango.format(cantidad=len(parametros_criticos)),
+            acciones=acciones,
+            parametros_criticos=parametros_criticos,
+            observaciones_clima_fueguino=observaciones,
+            version_reglas=self.version
+        )
+    
+    def _armar_definido(self, resultado: ResultadoDefinido) -> DiagnosticoOutput:
+        return DiagnosticoOutput.model_construct(
+            diagnostico=resultado.diagnostico,
+            acciones=[self._accion(nombre) for nombre in resultado.acciones],
+            parametros_criticos=list(resultado.parametros_criticos),
+            observaciones_clima_fueguino=list(resultado.observaciones),
+            version_reglas=self.version
+        )
+    
+    def evaluar_campo(self, k: int, campo: str, valor: float) -> int:
+        """Bits de las condiciones de `campo` que se cumplen para la combinación `k`"""
+        mascara = 0
+        for bit, campo_condicion, comparar, limite in self._condiciones_combinacion[k]:
+            if campo_condicion == campo and comparar(valor, limite):
+                mascara |= bit
+        return mascara
+    
+    def codigo_parametros(self, k: int, mascara: int) -> int:
+        return (self.variantes[k] << self.bits) | mascara
+    
+    def codigo_sintoma(self, tipo_sintoma: str, parametros: "ParametrosAmbientales | Lectura") -> int:
+        i = self.indice_sintoma[tipo_sintoma]
+        campo, comparar, valor = self.condiciones_sintoma[i]
+        return self.base_sintomas + 2 * i + bool(comparar(getattr(parametros, campo), valor))
+    
+    def codificar(self, entrada: "DiagnosticoInput | Lectura") -> int:
+        """Código de la fila de la tabla de decisión de una entrada validada o una lectura compacta"""
+        if isinstance(entrada, Lectura):
+            parametros = entrada
+            sintoma = entrada.tipo_sintoma
+            combinacion = (entrada.cultivo, entrada.etapa)
+        else:
+            parametros = entrada.parametros
+            sintoma = entrada.tipo_sintoma.value if entrada.sintomas_visuales and entrada.tipo_sintoma else None
+            combinacion = (entrada.cultivo.value, entrada.etapa.value)
+        if sintoma is not None:
+            return self.codigo_sintoma(sintoma, parametros)
+        
+        k = self.indice_combinacion[combinacion]
+        mascara = 0
+        for bit, campo, comparar, limite in self._condiciones_combinacion[k]:
+            if comparar(getattr(parametros, campo), limite):
+                mascara |= bit
+        return (self.variantes[k] << self.bits) | mascara
+    
+    def diagnosticar(self, entrada: "DiagnosticoInput | Lectura") -> DiagnosticoOutput:
+        return self.tabla[self.codificar(entrada)]
+    
+    def limites_lectura(self, combinacion: tuple, sintoma: Optional[str]) -> dict[str, tuple]:
+        """
+        Límites (ordenados) de cada campo en las condiciones que deciden el código
+        de una lectura de `combinacion` o, si tiene síntoma, de `sintoma`: dos
+        valores de un campo sin ningún límite entre ellos dan la misma fila
+        """
+        modo = (combinacion, sintoma)
+        limites = self._limites_lectura.get(modo)
+        if limites is None:
+            por_campo: dict[str, set] = {}
+            if sintoma is not None:
+                campo, _, valor = self.condiciones_sintoma[self.indice_sintoma[sintoma]]
+                por_campo[campo] = {float(valor)}
+            else:
+                for _, campo, _, limite in self._condiciones_combinacion[self.indice_combinacion[combinacion]]:
+                    por_campo.setdefault(campo, set()).add(limite)
+            limites = self._limites_lectura[modo] = {campo: tuple(sorted(valores)) for campo, valores in por_campo.items()}
+        return limites
+    
+    def _codificar_indices(self, indice_combinacion: np.ndarray, indice_sintoma: np.ndarray, columnas: dict) -> np.ndarray:
+        """
+        Códigos de un lote a partir de la combinación cultivo/etapa de cada lectura
+        (-1 si no existe), de su síntoma (índice en self.sintomas, SIN_SINTOMA o
+        cualquier otro valor si es inválido) y de sus parámetros por columna
+        """
+        columnas = {campo: np.asarray(columna, dtype=np.float64) for campo, columna in columnas.items()}
+        ph = columnas["ph"]
+        humedad = columnas["humedad_relativa"]
+        horas_luz = columnas["horas_luz_diarias"]
+        dias_renovacion = columnas["dias_desde_renovacion"]
+        indice_sintoma = indice_sintoma.astype(np.int32)
+        validas = (
+            (indice_combinacion >= 0)
+            & ((indice_sintoma == SIN_SINTOMA) | ((indice_sintoma >= 0) & (indice_sintoma < len(self.sintomas))))
+            & (ph >= 0) & (ph <= 14)
+            & (columnas["conductividad_electrica"] >= 0)
+            & np.isfinite(columnas["temperatura_solucion"])
+            & (humedad >= 0) & (humedad <= 100)
+            & np.isfinite(columnas["temperatura_ambiente"])
+            & (horas_luz >= 0) & (horas_luz <= 24)
+            & (dias_renovacion >= 0) & (dias_renovacion == np.floor(dias_renovacion))
+        )
+        indice_combinacion = np.where(validas, indice_combinacion, 0)
+        
+        # Una comparación por condición sobre todo el lote
+        limites = self.limites[indice_combinacion]
+        codigos = self.indice_variante[indice_combinacion] << self.bits
+        for bit, (regla, _, operador, _, _, _) in enumerate(self._condiciones):
+            codigos |= OPERADORES[operador](columnas[regla.campo], limites[:, bit]).astype(np.int32) << bit
+        
+        # Condición de cada tipo de síntoma
+        es_sintoma = [indice_sintoma == i for i in range(len(self.sintomas))]
+        condicion_sintoma = np.select(
+            es_sintoma,
+            [comparar(columnas[campo], valor) for campo, comparar, valor in self.condiciones_sintoma],
+            default=False
+        )
+        codigos_sintoma = self.base_sintomas + 2 * indice_sintoma + condicion_sintoma.astype(np.int32)
+        codigos = np.where(indice_sintoma >= 0, codigos_sintoma, codigos)
+        
+        return np.where(validas, codigos, CODIGO_INVALIDO).astype(np.int32)
+    
+    def codificar_columnas(
+        self,
+        cultivo: np.ndarray,
+        etapa: np.ndarray,
+        tipo_sintoma: np.ndarray,
+        ph: np.ndarray,
+        conductividad_electrica: np.ndarray,
+        temperatura_solucion: np.ndarray,
+        humedad_relativa: np.ndarray,
+        temperatura_ambiente: np.ndarray,
+        horas_luz_diarias: np.ndarray,
+        dias_desde_renovacion: np.ndarray
+    ) -> np.ndarray:
+        """
+        Evalúa la tabla de decisión sobre columnas de lecturas (NumPy), con una
+        comparación por condición para todo el arreglo. Devuelve un código por lectura
+        (ver decodificar) o CODIGO_INVALIDO si la lectura no pasaría la validación
+        de DiagnosticoInput. `tipo_sintoma` vale "" en las lecturas sin síntomas visuales.
+        """
+        n = len(ph)
+        indice_combinacion = np.full(n, -1, dtype=np.intp)
+        for k, (cultivo_k, etapa_k) in enumerate(self.combinaciones):
+            indice_combinacion[(cultivo == cultivo_k) & (etapa == etapa_k)] = k
+        # Los síntomas desconocidos quedan fuera de rango y la lectura se marca inválida
+        indice_sintoma = np.where(tipo_sintoma == "", SIN_SINTOMA, len(self.sintomas))
+        for i, tipo in enumerate(self.sintomas):
+            indice_sintoma[tipo_sintoma == tipo] = i
+        
+        return self._codificar_indices(indice_combinacion, indice_sintoma, {
+            "ph": ph,
+            "conductividad_electrica": conductividad_electrica,
+            "temperatura_solucion": temperatura_solucion,
+            "humedad_relativa": humedad_relativa,
+            "temperatura_ambiente": temperatura_ambiente,
+            "horas_luz_diarias": horas_luz_diarias,
+            "dias_desde_renovacion": dias_desde_renovacion
+        })
+    
+    def codificar_registros(self, registros: np.ndarray) -> np.ndarray:
+        """Igual que codificar_columnas, sobre un arreglo estructurado de lecturas (DTYPE_LECTURA)"""
+        cultivo = registros["cultivo"].astype(np.intp)
+        etapa = registros["etapa"].astype(np.intp)
+        # Las combinaciones siguen el orden de CULTIVOS x ETAPAS
+        indice_combinacion = np.where(
+            (cultivo < len(CULTIVOS)) & (etapa < len(ETAPAS)),
+            cultivo * len(ETAPAS) + etapa,
+            -1
+        )
+        return self._codificar_indices(
+            indice_combinacion,
+            registros["tipo_sintoma"],
+            {campo: registros[campo] for campo in get_args(CampoRegla)}
+        )
+    
+    def decodificar(self, codigo: int) -> DiagnosticoOutput:
+        """Diagnóstico que corresponde a un código de codificar o codificar_columnas"""
+        return self.tabla[codigo]
+    
+    def resumen(self) -> dict:
+        return {
+            "version": self.version,
+            "descripcion": self.definicion.descripcion,
+            "huella": self.huella,
+            "origen": self.origen,
+            "cargado": datetime.fromtimestamp(self.cargado).isoformat(timespec="seconds"),
+            "condiciones": self.bits,
+            "variantes_rangos": self.base_sintomas >> self.bits,
+            "diagnosticos": self.cantidad_diagnosticos
+        }
+
+def describir_error_validacion(error: ValidationError) -> str:
+    """Resume los errores de validación de pydantic en una sola línea"""
+    return "; ".join(
+        f"{'.'.join(str(parte) for parte in detalle['loc'])}: {detalle['msg']}"
+        for detalle in error.errors()
+    )
+
+# Archivo de reglas cargado al iniciar y vigilado para recargarlo en caliente
+RUTA_REGLAS = Path(os.getenv("REGLAS_ARCHIVO") or Path(__file__).with_name("reglas.json"))
+
+def cargar_reglas(ruta: Path = RUTA_REGLAS) -> CatalogoReglas:
+    """Lee, valida y compila un conjunto de reglas; lanza ValueError si la definición es inválida"""
+    try:
+        definicion = DefinicionReglas.model_validate_json(Path(ruta).read_bytes())
+    except ValidationError as e:
+        raise ValueError(f"Reglas inválidas en {ruta}: {describir_error_validacion(e)}") from e
+    return CatalogoReglas(definicion, origen=str(ruta))
+
+# Conjunto de reglas activo: se reemplaza de una sola vez, y cada diagnóstico
+# toma una referencia al comenzar, así que las solicitudes en curso terminan con
+# las reglas con las que empezaron
+_catalogo_activo = cargar_reglas()
+
+# Catálogos compilados en este proceso para definiciones distintas de la activa
+_catalogos_compilados: dict[str, CatalogoReglas] = {}
+
+def reglas_activas() -> CatalogoReglas:
+    return _catalogo_activo
+
+def activar_reglas(catalogo: CatalogoReglas) -> CatalogoReglas:
+    """Activa un conjunto de reglas ya compilado y devuelve el anterior"""
+    global _catalogo_activo
+    anterior = _catalogo_activo
+    _catalogo_activo = catalogo
+    return anterior
+
+def catalogo_para(huella: str, definicion: DefinicionReglas) -> CatalogoReglas:
+    """Catálogo compilado de una definición, compilándola sólo la primera vez en cada proceso"""
+    if _catalogo_activo.huella == huella:
+        return _catalogo_activo
+    catalogo = _catalogos_compilados.get(huella)
+    if catalogo is None:
+        if len(_catalogos_compilados) >= 4:
+            _catalogos_compilados.clear()
+        catalogo = _catalogos_compilados[huella] = CatalogoReglas(definicion)
+    return catalogo
+
+class VigilanteReglas:
+    """
+    Recarga el archivo de reglas cuando cambia (se revisa su fecha de
+    modificación cada `intervalo` segundos). Cada proceso trabajador tiene su
+    propio vigilante, así que un cambio en el archivo llega a todos sin
+    reiniciarlos. Si el archivo nuevo es inválido se conservan las reglas activas.
+    """
+    
+    def __init__(self, ruta: Path = RUTA_REGLAS, intervalo: float = 5.0):
+        self.ruta = Path(ruta)
+        self.intervalo = intervalo
+        self._firma = self._leer_firma()
+        self._tarea: Optional[asyncio.Task] = None
+        self._bloqueo = asyncio.Lock()
+        self.recargas = 0
+        self.errores = 0
+        self.ultimo_error: Optional[str] = None
+    
+    def _leer_firma(self) -> Optional[tuple]:
+        try:
+            estado = self.ruta.stat()
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+    
+    async def recargar(self) -> CatalogoReglas:
+        """Compila el archivo fuera del loop de eventos y lo activa; lanza ValueError u OSError si falla"""
+        async with self._bloqueo:
+            firma = self._leer_firma()
+            try:
+                catalogo = await asyncio.to_thread(cargar_reglas, self.ruta)
+            except (OSError, ValueError) as e:
+                self._firma = firma
+                self.errores += 1
+                self.ultimo_error = str(e)
+                logger.error("No se pudieron recargar las reglas: %s", e)
+                raise
+            self._firma = firma
+            anterior = activar_reglas(catalogo)
+            self.recargas += 1
+            self.ultimo_error = None
+            logger.info("Reglas %s activadas (antes %s)", catalogo.version, anterior.version)
+            return catalogo
+    
+    async def _vigilar(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            if self._leer_firma() != self._firma:
+                try:
+                    await self.recargar()
+                except (OSError, ValueError):
+                    pass
+    
+    def iniciar(self) -> None:
+        if self.intervalo > 0 and self._tarea is None:
+            self._tarea = asyncio.create_task(self._vigilar())
+    
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+    
+    def estadisticas(self) -> dict:
+        return {
+            "version": _catalogo_activo.version,
+            "recargas": self.recargas,
+            "errores": self.errores,
+            "ultimo_error": self.ultimo_error
+        }
+
+# Diagnóstico con el conjunto de reglas activo
+class DiagnosticoHidroponico:
+    
+    @staticmethod
+    def obtener_rangos_optimos(cultivo: str, etapa: str) -> dict:
+        """Obtiene los rangos óptimos según cultivo y etapa (compartidos, no modificar)"""
+        return _catalogo_activo.rangos[(cultivo, etapa)]
+    
+    @staticmethod
+    def diagnosticar(entrada: "DiagnosticoInput | Lectura") -> DiagnosticoOutput:
+        """Diagnostica una entrada o una lectura compacta priorizando los síntomas visuales si los hay"""
+        return _catalogo_activo.diagnosticar(entrada)
+    
+    @staticmethod
+    def diagnosticar_sintomas(tipo_sintoma: str, parametros: "ParametrosAmbientales | Lectura") -> DiagnosticoOutput:
+        """Diagnóstica basado en síntomas visuales"""
+        catalogo = _catalogo_activo
+        return catalogo.tabla[catalogo.codigo_sintoma(tipo_sintoma, parametros)]
+    
+    @staticmethod
+    def diagnosticar_parametros(cultivo: str, etapa: str, parametros: "ParametrosAmbientales | Lectura") -> DiagnosticoOutput:
+        """Diagnóstica basado en parámetros sin síntomas visuales"""
+        catalogo = _catalogo_activo
+        k = catalogo.indice_combinacion[(cultivo, etapa)]
+        mascara = 0
+        for campo in catalogo.campos:
+            mascara |= catalogo.evaluar_campo(k, campo, getattr(parametros, campo))
+        return catalogo.tabla[catalogo.codigo_parametros(k, mascara)]
+    
+    @staticmethod
+    def codificar_columnas(*columnas, catalogo: Optional[CatalogoReglas] = None, **columnas_por_nombre) -> np.ndarray:
+        """Códigos de diagnóstico de columnas de lecturas (ver CatalogoReglas.codificar_columnas)"""
+        return (catalogo or _catalogo_activo).codificar_columnas(*columnas, **columnas_por_nombre)
+    
+    @staticmethod
+    def decodificar(codigo: int, catalogo: Optional[CatalogoReglas] = None) -> DiagnosticoOutput:
+        """Diagnóstico de un código; debe usarse el mismo catálogo que lo codificó"""
+        return (catalogo or _catalogo_activo).tabla[codigo]
+    
+    @staticmethod
+    def codificar_lote(
+        entradas: "list[DiagnosticoInput] | list[Lectura] | np.ndarray",
+        catalogo: Optional[CatalogoReglas] = None
+    ) -> np.ndarray:
+        """
+        Códigos de diagnóstico (ver codificar_columnas) de un lote de entradas ya
+        validadas, de lecturas compactas o de un arreglo estructurado (DTYPE_LECTURA)
+        """
+        registros = entradas if isinstance(entradas, np.ndarray) else registros_desde_lecturas(entradas)
+        return (catalogo or _catalogo_activo).codificar_registros(registros)
+    
+    @staticmethod
+    def diagnosticar_lote(
+        entradas: "list[DiagnosticoInput] | list[Lectura] | np.ndarray",
+        catalogo: Optional[CatalogoReglas] = None
+    ) -> list[DiagnosticoOutput]:
+        """
+        Diagnostica un lote evaluando cada condición una sola vez sobre todo el
+        arreglo de lecturas (NumPy) en lugar de lectura por lectura. Las lecturas
+        de un arreglo estructurado que no pasarían la validación quedan en None.
+        """
+        if len(entradas) == 0:
+            return []
+        
+        catalogo = catalogo or _catalogo_activo
+        codigos = DiagnosticoHidroponico.codificar_lote(entradas, catalogo)
+        tabla = catalogo.tabla
+        return [tabla[codigo] if codigo != CODIGO_INVALIDO else None for codigo in codigos.tolist()]
+
+def serializar_diagnostico(resultado: DiagnosticoOutput) -> bytes:
+    """
+    JSON de un diagnóstico. Los diagnósticos son objetos compartidos que no se
+    modifican: los de la tabla de decisión se serializan al compilarla y los
+    demás (de reglas anteriores, por ejemplo) una sola vez al pedirlos.
+    """
+    json_diagnosticos = _catalogo_activo.json_diagnosticos
+    guardado = json_diagnosticos.get(id(resultado))
+    if guardado is not None and guardado[0] is resultado:
+        return guardado[1]
+    cuerpo = resultado.model_dump_json().encode()
+    json_diagnosticos[id(resultado)] = (resultado, cuerpo)
+    return cuerpo
+
+def precalentar_reglas() -> int:
+    """
+    Las reglas se compilan al cargarlas: todos los diagnósticos posibles quedan
+    armados y serializados antes de la primera solicitud. Devuelve cuántos son.
+    """
+    return _catalogo_activo.cantidad_diagnosticos
@@ -0,0 +1,453 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Optional
+
+import httpx
+
+logger = logging.getLogger("seguimientos")
+
+# Segundos por unidad de tiempo_revision ("2 horas", "24 horas", "30 minutos", "3 días", ...)
+SEGUNDOS_POR_UNIDAD = {
+    "minuto": 60, "minutos": 60, "min": 60,
+    "hora": 3600, "horas": 3600, "h": 3600,
+    "dia": 86400, "dias": 86400, "día": 86400, "días": 86400, "d": 86400,
+    "semana": 604800, "semanas": 604800
+}
+
+PATRON_PLAZO = re.compile(r"^(\d+(?:[.,]\d+)?)\s*([a-zá-ú]+)$")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS revisiones (
+    id INTEGER PRIMARY KEY,
+    invernadero_id TEXT NOT NULL,
+    vencimiento REAL NOT NULL,
+    programada REAL NOT NULL,
+    tipo TEXT NOT NULL,
+    descripcion TEXT NOT NULL,
+    prioridad TEXT NOT NULL,
+    tiempo_revision TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revisiones_invernadero ON revisiones (invernadero_id);
+"""
+
+def plazo_revision(tiempo_revision: str, plazo_inmediato: float) -> Optional[float]:
+    """Segundos hasta la revisión indicada por una acción, o None si el texto no es un plazo reconocible"""
+    texto = tiempo_revision.strip().lower()
+    if texto == "inmediato":
+        return plazo_inmediato
+    coincidencia = PATRON_PLAZO.match(texto)
+    if coincidencia is None or coincidencia.group(2) not in SEGUNDOS_POR_UNIDAD:
+        return None
+    return float(coincidencia.group(1).replace(",", ".")) * SEGUNDOS_POR_UNIDAD[coincidencia.group(2)]
+
+def _iso(marca_tiempo: float) -> str:
+    return datetime.fromtimestamp(marca_tiempo, timezone.utc).isoformat(timespec="seconds")
+
+COLUMNAS = "invernadero_id, vencimiento, programada, tipo, descripcion, prioridad, tiempo_revision"
+
+class Revision:
+    """Revisión pendiente de una acción recomendada a un invernadero"""
+    
+    __slots__ = (
+        "invernadero_id", "vencimiento", "programada", "tipo", "descripcion", "prioridad", "tiempo_revision", "activa", "intentos"
+    )
+    
+    def __init__(
+        self,
+        invernadero_id: str,
+        vencimiento: float,
+        programada: float,
+        tipo: str,
+        descripcion: str,
+        prioridad: str,
+        tiempo_revision: str
+    ):
+        self.invernadero_id = invernadero_id
+        self.vencimiento = vencimiento
+        self.programada = programada
+        self.tipo = tipo
+        self.descripcion = descripcion
+        self.prioridad = prioridad
+        self.tiempo_revision = tiempo_revision
+        self.activa = True
+        # Avisos fallidos de esta revisión
+        self.intentos = 0
+    
+    def fila(self) -> tuple:
+        return (
+            self.invernadero_id, self.vencimiento, self.programada,
+            self.tipo, self.descripcion, self.prioridad, self.tiempo_revision
+        )
+    
+    def a_dict(self) -> dict:
+        return {
+            "invernadero_id": self.invernadero_id,
+            "tipo": self.tipo,
+            "descripcion": self.descripcion,
+            "prioridad": self.prioridad,
+            "tiempo_revision": self.tiempo_revision,
+            "programada": _iso(self.programada),
+            "vencimiento": _iso(self.vencimiento)
+        }
+
+class ProgramadorSeguimientos:
+    """
+    Recordatorios de seguimiento de las acciones recomendadas. Cada lectura de
+    un invernadero reconoce (cancela) sus revisiones pendientes y programa una
+    por acción de su diagnóstico, con vencimiento según `tiempo_revision`. Si una
+    revisión vence sin que llegue una lectura nueva, se envía un recordatorio.
+    Cada ronda de avisos corre en su propia tarea, así que un webhook lento no
+    atrasa las rondas siguientes; si el aviso falla, las revisiones vuelven a
+    quedar pendientes y se reintentan con espera exponencial (desde
+    `reintento_aviso` segundos) hasta `max_reintentos_aviso` veces.
+    
+    Las revisiones están en un heap por vencimiento: programar cuesta O(log n)
+    y cancelar O(1), porque sólo se marcan inactivas y se descartan al llegar a
+    la cima (el heap se reconstruye si más de la mitad son inactivas). Una
+    tarea de fondo duerme hasta el próximo vencimiento. Con `ruta`, las
+    revisiones pendientes se guardan en SQLite: cada `intervalo_guardado`
+    segundos se reescriben en una transacción las de los invernaderos que
+    cambiaron, y se recargan al iniciar (las vencidas durante la detención se
+    avisan enseguida). La base se abre recién en `iniciar`, y la carga toma
+    las filas y las borra en una misma transacción: si arrancan varios
+    procesos con la misma base, sólo el primero recupera (y avisa) las
+    revisiones guardadas, que vuelve a escribir en su primer guardado.
+    """
+    
+    def __init__(
+        self,
+        avisar: Callable[[list[Revision]], Awaitable[None]],
+        ruta: Optional[str] = None,
+        plazo_inmediato: float = 900.0,
+        intervalo_guardado: float = 1.0,
+        max_avisos_por_ronda: int = 1000,
+        max_reintentos_aviso: int = 5,
+        reintento_aviso: float = 5.0,
+        max_espera_reintento: float = 300.0
+    ):
+        self.avisar = avisar
+        self.ruta = Path(ruta) if ruta else None
+        self.plazo_inmediato = plazo_inmediato
+        self.intervalo_guardado = intervalo_guardado
+        self.max_avisos_por_ronda = max_avisos_por_ronda
+        self.max_reintentos_aviso = max_reintentos_aviso
+        self.reintento_aviso = reintento_aviso
+        self.max_espera_reintento = max_espera_reintento
+        
+        # (vencimiento, orden, revisión); las inactivas se descartan al llegar a la cima
+        self._heap: list = []
+        self._orden = itertools.count()
+        self._por_invernadero: dict[str, list[Revision]] = defaultdict(list)
+        self._inactivas = 0
+        self._plazos: dict[str, Optional[float]] = {}
+        self._despertar = asyncio.Event()
+        self._tareas: list[asyncio.Task] = []
+        # Rondas de avisos en curso
+        self._avisos: set[asyncio.Task] = set()
+        # Invernaderos con revisiones por guardar
+        self._modificados: set[str] = set()
+        self._escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="seguimientos")
+        self._conexion: Optional[sqlite3.Connection] = None
+        
+        self.programadas = 0
+        self.reconocidas = 0
+        self.avisadas = 0
+        self.sin_plazo = 0
+        self.errores_aviso = 0
+        self.reintentos_aviso = 0
+        self.descartadas_aviso = 0
+        self.errores_guardado = 0
+        self.recuperadas = 0
+    
+    def _conectar(self) -> sqlite3.Connection:
+        conexion = sqlite3.connect(self.ruta, timeout=5.0, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        return conexion
+    
+    def _cargar(self) -> None:
+        """Toma las revisiones guardadas (y las borra de la base) para programarlas en este proceso"""
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        conexion = self._conectar()
+        try:
+            conexion.executescript(ESQUEMA)
+            conexion.execute("BEGIN IMMEDIATE")
+            filas = conexion.execute(f"SELECT {COLUMNAS} FROM revisiones").fetchall()
+            conexion.execute("DELETE FROM revisiones")
+            conexion.execute("COMMIT")
+        finally:
+            conexion.close()
+        
+        for fila in filas:
+            revision = Revision(*fila)
+            self._heap.append((revision.vencimiento, next(self._orden), revision))
+            self._por_invernadero[revision.invernadero_id].append(revision)
+            self._modificados.add(revision.invernadero_id)
+        heapq.heapify(self._heap)
+        self.recuperadas += len(filas)
+    
+    @property
+    def pendientes(self) -> int:
+        return len(self._heap) - self._inactivas
+    
+    def _plazo(self, tiempo_revision: str) -> Optional[float]:
+        if tiempo_revision not in self._plazos:
+            self._plazos[tiempo_revision] = plazo_revision(tiempo_revision, self.plazo_inmediato)
+        return self._plazos[tiempo_revision]
+    
+    def reconocer(self, invernadero_id: str) -> int:
+        """Cancela las revisiones pendientes del invernadero (llegó una lectura nueva); devuelve cuántas había"""
+        revisiones = self._por_invernadero.pop(invernadero_id, None)
+        if not revisiones:
+            return 0
+        for revision in revisiones:
+            revision.activa = False
+        self._inactivas += len(revisiones)
+        self.reconocidas += len(revisiones)
+        self._modificados.add(invernadero_id)
+        if self._inactivas > 1000 and self._inactivas * 2 > len(self._heap):
+            self._heap = [elemento for elemento in self._heap if elemento[2].activa]
+            heapq.heapify(self._heap)
+            self._inactivas = 0
+        return len(revisiones)
+    
+    def revisar(self, invernadero_id: str, acciones: Iterable, ahora: Optional[float] = None) -> int:
+        """
+        Reconoce las revisiones pendientes del invernadero y programa una por
+        acción con plazo reconocible. Devuelve cuántas se programaron.
+        """
+        self.reconocer(invernadero_id)
+        ahora = time.time() if ahora is None else ahora
+        proximo = self._proximo()
+        revisiones = []
+        for accion in acciones:
+            plazo = self._plazo(accion.tiempo_revision)
+            if plazo is None:
+                self.sin_plazo += 1
+                continue
+            revision = Revision(
+                invernadero_id, ahora + plazo, ahora,
+                accion.tipo, accion.descripcion, accion.prioridad, accion.tiempo_revision
+            )
+            heapq.heappush(self._heap, (revision.vencimiento, next(self._orden), revision))
+            revisiones.append(revision)
+        
+        if revisiones:
+            self._por_invernadero[invernadero_id] = revisiones
+            self._modificados.add(invernadero_id)
+            self.programadas += len(revisiones)
+            # Sólo hace falta despertar a la tarea si cambió el próximo vencimiento
+            if proximo is None or self._heap[0][0] < proximo:
+                self._despertar.set()
+        return len(revisiones)
+    
+    def pendientes_de(self, invernadero_id: str) -> list[Revision]:
+        return sorted(self._por_invernadero.get(invernadero_id, ()), key=lambda revision: revision.vencimiento)
+    
+    def _proximo(self) -> Optional[float]:
+        """Próximo vencimiento, descartando las revisiones inactivas de la cima"""
+        while self._heap and not self._heap[0][2].activa:
+            heapq.heappop(self._heap)
+            self._inactivas -= 1
+        return self._heap[0][0] if self._heap else None
+    
+    def _vencidas(self, ahora: float) -> list[Revision]:
+        vencidas = []
+        while self._heap and self._heap[0][0] <= ahora and len(vencidas) < self.max_avisos_por_ronda:
+            _, _, revision = heapq.heappop(self._heap)
+            if not revision.activa:
+                self._inactivas -= 1
+                continue
+            revision.activa = False
+            revisiones = self._por_invernadero[revision.invernadero_id]
+            revisiones.remove(revision)
+            if not revisiones:
+                del self._por_invernadero[revision.invernadero_id]
+            self._modificados.add(revision.invernadero_id)
+            vencidas.append(revision)
+        return vencidas
+    
+    def _reencolar(self, revision: Revision, momento: float) -> None:
+        """Vuelve a dejar pendiente una revisión cuyo aviso no se completó, para avisarla en `momento`"""
+        revision.activa = True
+        heapq.heappush(self._heap, (momento, next(self._orden), revision))
+        self._por_invernadero[revision.invernadero_id].append(revision)
+        self._modificados.add(revision.invernadero_id)
+        self._despertar.set()
+    
+    async def _avisar(self, revisiones: list[Revision]) -> None:
+        try:
+            await self.avisar(revisiones)
+        except asyncio.CancelledError:
+            # Se detuvo el servicio durante el envío: quedan pendientes para guardarlas
+            ahora = time.time()
+            for revision in revisiones:
+                self._reencolar(revision, ahora)
+            raise
+        except Exception as e:
+            self.errores_aviso += 1
+            ahora = time.time()
+            descartadas = 0
+            for revision in revisiones:
+                if revision.intentos >= self.max_reintentos_aviso:
+                    descartadas += 1
+                    continue
+                revision.intentos += 1
+                espera = min(self.reintento_aviso * 2 ** (revision.intentos - 1), self.max_espera_reintento)
+                self._reencolar(revision, ahora + espera)
+            self.reintentos_aviso += len(revisiones) - descartadas
+            self.descartadas_aviso += descartadas
+            logger.error(
+                "No se pudieron enviar %d recordatorios (%d se descartan tras %d intentos): %s",
+                len(revisiones), descartadas, self.max_reintentos_aviso + 1, e
+            )
+            return
+        self.avisadas += len(revisiones)
+    
+    async def _vigilar(self) -> None:
+        while True:
+            self._despertar.clear()
+            vencidas = self._vencidas(time.time())
+            if vencidas:
+                tarea = asyncio.create_task(self._avisar(vencidas))
+                self._avisos.add(tarea)
+                tarea.add_done_callback(self._avisos.discard)
+                # Cede el loop entre rondas si quedaron más vencidas
+                await asyncio.sleep(0)
+                continue
+            
+            proximo = self._proximo()
+            espera = proximo - time.time() if proximo is not None else None
+            try:
+                await asyncio.wait_for(self._despertar.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _guardar(self, cambios: dict) -> None:
+        """Reescribe las revisiones de los invernaderos modificados en una transacción (en el hilo escritor)"""
+        if self._conexion is None:
+            self._conexion = self._conectar()
+        # Los id los asigna SQLite, así que los procesos que comparten la base no chocan
+        self._conexion.execute("BEGIN")
+        try:
+            self._conexion.executemany("DELETE FROM revisiones WHERE invernadero_id = ?", ((i,) for i in cambios))
+            self._conexion.executemany(
+                f"INSERT INTO revisiones ({COLUMNAS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fila for filas in cambios.values() for fila in filas)
+            )
+        except BaseException:
+            self._conexion.execute("ROLLBACK")
+            raise
+        self._conexion.execute("COMMIT")
+    
+    async def guardar(self) -> None:
+        """Guarda las revisiones de los invernaderos que cambiaron desde el último guardado"""
+        if self.ruta is None or not self._modificados:
+            return
+        modificados, self._modificados = self._modificados, set()
+        cambios = {
+            invernadero_id: [revision.fila() for revision in self._por_invernadero.get(invernadero_id, ())]
+            for invernadero_id in modificados
+        }
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._escritor, self._guardar, cambios)
+        except sqlite3.Error as e:
+            # Se reintentan en el próximo guardado
+            self._modificados |= modificados
+            self.errores_guardado += 1
+            logger.error("No se pudieron guardar las revisiones pendientes: %s", e)
+    
+    async def _guardar_periodicamente(self) -> None:
+        while True:
+            # El primer guardado, enseguida, vuelve a escribir las revisiones recuperadas al iniciar
+            await self.guardar()
+            await asyncio.sleep(self.intervalo_guardado)
+    
+    def iniciar(self) -> None:
+        if not self._tareas:
+            if self.ruta is not None:
+                self._cargar()
+            # El evento se crea en el loop que lo va a esperar
+            self._despertar = asyncio.Event()
+            self._tareas = [asyncio.create_task(self._vigilar())]
+            if self.ruta is not None:
+                self._tareas.append(asyncio.create_task(self._guardar_periodicamente()))
+    
+    async def detener(self) -> None:
+        """
+        Detiene las tareas de fondo y guarda las revisiones pendientes en la base,
+        si la hay, incluidas las de los avisos que se estaban enviando
+        """
+        tareas = [*self._tareas, *self._avisos]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self._tareas = []
+        await self.guardar()
+        if self._conexion is not None:
+            await asyncio.get_running_loop().run_in_executor(self._escritor, self._conexion.close)
+            self._conexion = None
+        if self.ruta is not None and not self._modificados:
+            # Ya quedaron en la base: se liberan para que un nuevo `iniciar` las vuelva a cargar sin duplicarlas
+            self._heap = []
+            self._por_invernadero.clear()
+            self._inactivas = 0
+    
+    def estadisticas(self) -> dict:
+        proximo = self._proximo()
+        return {
+            "pendientes": self.pendientes,
+            "invernaderos": len(self._por_invernadero),
+            "proximo_vencimiento": _iso(proximo) if proximo is not None else None,
+            "programadas": self.programadas,
+            "reconocidas": self.reconocidas,
+            "avisadas": self.avisadas,
+            "avisos_en_curso": len(self._avisos),
+            "recuperadas": self.recuperadas,
+            "sin_plazo": self.sin_plazo,
+            "errores_aviso": self.errores_aviso,
+            "reintentos_aviso": self.reintentos_aviso,
+            "descartadas_aviso": self.descartadas_aviso,
+            "errores_guardado": self.errores_guardado
+        }
+
+class WebhookRecordatorios:
+    """
+    Envía los recordatorios vencidos a un webhook HTTP, en un POST por ronda.
+    Los errores se propagan para que el programador reintente la ronda.
+    """
+    
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self._cliente: Optional[httpx.AsyncClient] = None
+        self.enviados = 0
+        self.fallidos = 0
+    
+    async def enviar(self, recordatorios: list[dict]) -> None:
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(timeout=self.timeout)
+        try:
+            respuesta = await self._cliente.post(self.url, json={"recordatorios": recordatorios})
+            respuesta.raise_for_status()
+        except httpx.HTTPError:
+            self.fallidos += len(recordatorios)
+            raise
+        self.enviados += len(recordatorios)
+    
+    async def cerrar(self) -> None:
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+    
+    def estadisticas(self) -> dict:
+        return {"enviados": self.enviados, "fallidos": self.fallidos}
@@ -0,0 +1,336 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+import asyncio
+import logging
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Columnas guardadas por invernadero (además de la marca de tiempo)
+COLUMNAS_SERIE = (
+    "ph",
+    "conductividad_electrica",
+    "temperatura_solucion",
+    "humedad_relativa",
+    "temperatura_ambiente",
+    "horas_luz_diarias",
+    "dias_desde_renovacion",
+    "bomba_oxigenacion_funcionando"
+)
+
+COLUMNA_TIEMPO = "marca_tiempo"
+
+class SerieInvernadero:
+    """
+    Series de un invernadero en archivos de ancho fijo (float64), uno por columna,
+    accedidos por memoria mapeada. Los registros sólo se agregan al final y con
+    marca de tiempo no decreciente, lo que permite buscar rangos por bisección.
+    Una marca de tiempo en 0 indica una posición libre: los archivos crecen
+    duplicando su capacidad y la zona nueva queda en ceros sin escribirla.
+    """
+    
+    def __init__(self, directorio: Path, capacidad_inicial: int):
+        self.directorio = directorio
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        
+        ruta_tiempo = self._ruta(COLUMNA_TIEMPO)
+        if ruta_tiempo.exists():
+            capacidad = ruta_tiempo.stat().st_size // 8
+        else:
+            capacidad = capacidad_inicial
+        
+        self._abrir(max(capacidad, 1))
+        self.cantidad = self._contar_registros()
+    
+    def _ruta(self, columna: str) -> Path:
+        return self.directorio / f"{columna}.f64"
+    
+    def _abrir(self, capacidad: int) -> None:
+        self.capacidad = capacidad
+        self.columnas = {}
+        for columna in (COLUMNA_TIEMPO, *COLUMNAS_SERIE):
+            ruta = self._ruta(columna)
+            with open(ruta, "ab") as archivo:
+                if archivo.tell() < capacidad * 8:
+                    archivo.truncate(capacidad * 8)
+            self.columnas[columna] = np.memmap(ruta, dtype=np.float64, mode="r+", shape=(capacidad,))
+    
+    def _contar_registros(self) -> int:
+        """Busca por bisección la primera posición libre (marca de tiempo en 0)"""
+        tiempos = self.columnas[COLUMNA_TIEMPO]
+        inicio, fin = 0, self.capacidad
+        while inicio < fin:
+            medio = (inicio + fin) // 2
+            if tiempos[medio] > 0:
+                inicio = medio + 1
+            else:
+                fin = medio
+        return inicio
+    
+    def _crecer(self) -> None:
+        # Sin sincronizar: el mapeo nuevo comparte las páginas ya escritas del archivo
+        self.columnas = {}
+        self._abrir(self.capacidad * 2)
+    
+    @property
+    def ultima_marca(self) -> float:
+        return float(self.columnas[COLUMNA_TIEMPO][self.cantidad - 1]) if self.cantidad else 0.0
+    
+    def agregar(self, marca_tiempo: float, valores: dict) -> bool:
+        """Agrega un registro; devuelve False si llega fuera de orden y se descarta"""
+        if marca_tiempo <= 0 or marca_tiempo < self.ultima_marca:
+            return False
+        
+        if self.cantidad == self.capacidad:
+            self._crecer()
+        
+        posicion = self.cantidad
+        for columna in COLUMNAS_SERIE:
+            self.columnas[columna][posicion] = valores[columna]
+        # La marca de tiempo se escribe al final: es la que marca el registro como ocupado
+        self.columnas[COLUMNA_TIEMPO][posicion] = marca_tiempo
+        self.cantidad += 1
+        return True
+    
+    def rango(self, desde: Optional[float], hasta: Optional[float]) -> tuple[int, int]:
+        """Índices [inicio, fin) de los registros dentro del intervalo de tiempo"""
+        tiempos = self.columnas[COLUMNA_TIEMPO][:self.cantidad]
+        inicio = int(np.searchsorted(tiempos, desde, side="left")) if desde is not None else 0
+        fin = int(np.searchsorted(tiempos, hasta, side="right")) if hasta is not None else self.cantidad
+        return inicio, max(inicio, fin)
+    
+    def sincronizar(self) -> None:
+        for columna in self.columnas.values():
+            columna.flush()
+    
+    def cerrar(self) -> None:
+        """
+        Libera los mapeos sin sincronizarlos: las páginas escritas ya son del
+        archivo y el sistema operativo las guarda aunque el mapeo se cierre
+        """
+        self.columnas = {}
+
+def limite_series_abiertas(reserva_descriptores: int = 256) -> int:
+    """
+    Cantidad de series que pueden estar abiertas a la vez. Cada serie mapea un
+    archivo por columna, que usa un descriptor y un mapeo de memoria: se sube el
+    límite blando de descriptores hasta el duro y se deja la mitad de los mapeos
+    permitidos al proceso para el resto del servicio.
+    """
+    por_serie = 1 + len(COLUMNAS_SERIE)
+    limite = 1 << 20
+    if resource is not None:
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if blando != resource.RLIM_INFINITY and (duro == resource.RLIM_INFINITY or blando < duro):
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+                blando = duro
+            except (ValueError, OSError):
+                pass
+        if blando != resource.RLIM_INFINITY:
+            limite = (blando - reserva_descriptores) // por_serie
+    try:
+        limite = min(limite, int(Path("/proc/sys/vm/max_map_count").read_text()) // 2 // por_serie)
+    except (OSError, ValueError):
+        pass
+    return max(limite, 1)
+
+class AlmacenSeries:
+    """
+    Almacén embebido de series temporales por invernadero. Agregar sólo encola
+    la lectura: una tarea de fondo escribe en un hilo propio, dueño de las
+    series abiertas, todo lo que se acumuló mientras escribía el lote anterior.
+    Así el loop de eventos no espera a que un archivo crezca ni a abrir o cerrar
+    series. Mantiene abiertas como máximo `max_series_abiertas` series (por
+    omisión, las que permiten los descriptores y mapeos del proceso, ver
+    limite_series_abiertas) y cierra las menos usadas sin sincronizarlas.
+    Las consultas corren en el mismo hilo y ven las lecturas ya escritas.
+    """
+    
+    def __init__(
+        self,
+        directorio: str,
+        capacidad_inicial: int = 4096,
+        max_series_abiertas: Optional[int] = None,
+        tamano_lote: int = 1000,
+        max_pendientes: int = 100000
+    ):
+        self.directorio = Path(directorio)
+        self.capacidad_inicial = capacidad_inicial
+        self.max_series_abiertas = max_series_abiertas or limite_series_abiertas()
+        self.tamano_lote = tamano_lote
+        self._series: OrderedDict[str, SerieInvernadero] = OrderedDict()
+        self._cola: asyncio.Queue = asyncio.Queue(maxsize=max_pendientes)
+        self._tarea: Optional[asyncio.Task] = None
+        self._escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="series")
+        self.registros_agregados = 0
+        self.registros_descartados = 0
+        self.pendientes_descartados = 0
+        self.series_cerradas = 0
+        self.lotes = 0
+        self.errores = 0
+        self.ultimo_error: Optional[str] = None
+    
+    def serie(self, invernadero_id: str, crear: bool = False) -> Optional[SerieInvernadero]:
+        """Serie abierta de un invernadero (sólo desde el hilo escritor)"""
+        serie = self._series.get(invernadero_id)
+        if serie is not None:
+            self._series.move_to_end(invernadero_id)
+            return serie
+        
+        directorio = self.directorio / invernadero_id
+        if not crear and not directorio.exists():
+            return None
+        
+        serie = SerieInvernadero(directorio, self.capacidad_inicial)
+        self._series[invernadero_id] = serie
+        while len(self._series) > self.max_series_abiertas:
+            _, cerrada = self._series.popitem(last=False)
+            cerrada.cerrar()
+            self.series_cerradas += 1
+        return serie
+    
+    def agregar(self, invernadero_id: str, marca_tiempo: float, valores: dict) -> bool:
+        """Encola una lectura para guardarla; devuelve False si la cola está llena y se descartó"""
+        try:
+            self._cola.put_nowait((invernadero_id, marca_tiempo, valores))
+        except asyncio.QueueFull:
+            self.pendientes_descartados += 1
+            return False
+        return True
+    
+    def _guardar(self, lote: list) -> None:
+        """Escribe un lote de lecturas (en el hilo escritor)"""
+        for invernadero_id, marca_tiempo, valores in lote:
+            if self.serie(invernadero_id, crear=True).agregar(marca_tiempo, valores):
+                self.registros_agregados += 1
+            else:
+                self.registros_descartados += 1
+    
+    async def _escribir(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            registro = await self._cola.get()
+            if registro is None:
+                return
+            lote = [registro]
+            while len(lote) < self.tamano_lote and not self._cola.empty():
+                registro = self._cola.get_nowait()
+                if registro is None:
+                    # Se vuelve a dejar la marca de cierre para terminar después de escribir este lote
+                    self._cola.put_nowait(None)
+                    break
+                lote.append(registro)
+            
+            try:
+                await loop.run_in_executor(self._escritor, self._guardar, lote)
+            except Exception as e:
+                # Un error (por ejemplo, disco lleno) descarta el resto del lote pero no detiene la escritura
+                self.errores += 1
+                self.ultimo_error = repr(e)
+                logger.exception("No se pudo guardar un lote de %d lecturas", len(lote))
+                continue
+            self.lotes += 1
+    
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._escribir())
+    
+    async def detener(self) -> None:
+        """Escribe lo que quedaba en la cola y sincroniza las series abiertas"""
+        if self._tarea is not None:
+            await self._cola.put(None)
+            await self._tarea
+            self._tarea = None
+        await asyncio.get_running_loop().run_in_executor(self._escritor, self.sincronizar)
+    
+    async def consultar(
+        self,
+        invernadero_id: str,
+        columnas: list[str],
+        desde: Optional[float] = None,
+        hasta: Optional[float] = None,
+        puntos: int = 1000
+    ) -> Optional[dict]:
+        """Lecturas del intervalo (ver _consultar), calculadas en el hilo escritor"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._escritor, self._consultar, invernadero_id, columnas, desde, hasta, puntos
+        )
+    
+    def _consultar(
+        self,
+        invernadero_id: str,
+        columnas: list[str],
+        desde: Optional[float] = None,
+        hasta: Optional[float] = None,
+        puntos: int = 1000
+    ) -> Optional[dict]:
+        """
+        Devuelve las lecturas del intervalo. Si superan `puntos`, se agrupan en
+        `puntos` intervalos de igual duración con mínimo, máximo y media.
+        Los cálculos se hacen sobre vistas de los archivos mapeados, sin copiarlos.
+        """
+        serie = self.serie(invernadero_id)
+        if serie is None:
+            return None
+        
+        inicio, fin = serie.rango(desde, hasta)
+        tiempos = serie.columnas[COLUMNA_TIEMPO][inicio:fin]
+        resultado = {"invernadero_id": invernadero_id, "lecturas": fin - inicio}
+        
+        if fin - inicio <= puntos:
+            resultado["agregado"] = False
+            resultado["tiempos"] = tiempos.tolist()
+            resultado["series"] = {
+                columna: serie.columnas[columna][inicio:fin].tolist()
+                for columna in columnas
+            }
+            return resultado
+        
+        # Bordes de los intervalos y posición del primer registro de cada uno
+        bordes = np.linspace(tiempos[0], tiempos[-1], puntos + 1)
+        comienzos = np.searchsorted(tiempos, bordes[:-1], side="left")
+        conteos = np.diff(np.append(comienzos, len(tiempos)))
+        con_datos = conteos > 0
+        comienzos = comienzos[con_datos]
+        conteos = conteos[con_datos]
+        
+        resultado["agregado"] = True
+        resultado["tiempos"] = bordes[:-1][con_datos].tolist()
+        resultado["cantidades"] = conteos.tolist()
+        resultado["series"] = {}
+        for columna in columnas:
+            valores = serie.columnas[columna][inicio:fin]
+            resultado["series"][columna] = {
+                "minimo": np.minimum.reduceat(valores, comienzos).tolist(),
+                "maximo": np.maximum.reduceat(valores, comienzos).tolist(),
+                "media": (np.add.reduceat(valores, comienzos) / conteos).tolist()
+            }
+        return resultado
+    
+    def sincronizar(self) -> None:
+        for serie in self._series.values():
+            serie.sincronizar()
+    
+    def estadisticas(self) -> dict:
+        return {
+            "directorio": str(self.directorio),
+            "series_abiertas": len(self._series),
+            "max_series_abiertas": self.max_series_abiertas,
+            "series_cerradas": self.series_cerradas,
+            "pendientes": self._cola.qsize(),
+            "pendientes_descartados": self.pendientes_descartados,
+            "registros_agregados": self.registros_agregados,
+            "registros_descartados": self.registros_descartados,
+            "lotes": self.lotes,
+            "errores": self.errores,
+            "ultimo_error": self.ultimo_error
+        }
@@ -0,0 +1,138 @@
+"""
+Lanzador de producción de la API de diagnóstico hidropónico.
+
+Levanta uvicorn con varios procesos trabajadores (por defecto, uno por CPU
+disponible), uvloop y httptools cuando están instalados, y apagado ordenado:
+ante SIGTERM se dejan de aceptar conexiones y se espera a que terminen las
+solicitudes en curso hasta `--timeout-apagado` segundos.
+
+Uso:
+    python servidor.py
+    python servidor.py --workers 4 --puerto 8000 --keep-alive 15 --backlog 4096
+    python servidor.py --embebido   # API e interfaz Gradio en los mismos procesos
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("servidor")
+
+def cpus_disponibles() -> int:
+    """CPUs que el proceso puede usar (respeta la afinidad fijada por el contenedor o taskset)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def precargar() -> None:
+    """
+    Importa la aplicación y precalienta las reglas en el proceso principal antes
+    de lanzar los trabajadores: un error de configuración se detecta aquí y no
+    en cada trabajador. Cada trabajador vuelve a precalentar en su arranque
+    (ciclo de vida de la aplicación) antes de aceptar conexiones.
+    """
+    inicio = time.perf_counter()
+    import app as api
+    diagnosticos = api.precalentar_reglas()
+    logger.info(
+        "Aplicación cargada y %d diagnósticos precalentados en %.1f ms",
+        diagnosticos,
+        (time.perf_counter() - inicio) * 1000
+    )
+
+def advertir_estado_por_proceso(workers: int) -> None:
+    """El estado en memoria y el almacén de series no se comparten entre trabajadores"""
+    if workers <= 1:
+        return
+    if os.getenv("SERIES_HABILITADAS", "1") == "1":
+        logger.warning(
+            "Con %d trabajadores cada uno escribe las series de %s por su cuenta, pero el "
+            "almacén admite un único escritor por directorio: use un solo trabajador, "
+            "SERIES_DIRECTORIO distintos o SERIES_HABILITADAS=0",
+            workers,
+            os.getenv("SERIES_DIRECTORIO", "datos/series")
+        )
+    if os.getenv("SEGUIMIENTOS_HABILITADOS", "0") == "1":
+        logger.warning(
+            "Con %d trabajadores cada uno programa los seguimientos de los invernaderos cuyas "
+            "lecturas recibe y reescribe sus revisiones en %s: las lecturas de un invernadero deben "
+            "llegar siempre al mismo trabajador, o use un solo trabajador",
+            workers,
+            os.getenv("SEGUIMIENTOS_ARCHIVO", "datos/seguimientos.sqlite3")
+        )
+    procesos_trabajos = int(os.getenv("TRABAJOS_PROCESOS", "0"))
+    if procesos_trabajos and procesos_trabajos * workers > cpus_disponibles():
+        logger.warning(
+            "TRABAJOS_PROCESOS=%d crea un pool por trabajador: %d procesos para %d CPU disponibles",
+            procesos_trabajos,
+            procesos_trabajos * workers,
+            cpus_disponibles()
+        )
+    logger.warning(
+        "El cache, el diagnóstico incremental y las suscripciones en vivo son por trabajador: "
+        "los clientes con estado (incremental, SSE, WebSocket) deben llegar siempre al mismo proceso"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción de la API de diagnóstico hidropónico")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--puerto", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", "0")) or cpus_disponibles(),
+        help="Procesos trabajadores (por defecto, uno por CPU disponible)"
+    )
+    parser.add_argument("--keep-alive", type=int, default=5, help="Segundos que se mantiene abierta una conexión inactiva")
+    parser.add_argument("--backlog", type=int, default=2048, help="Conexiones pendientes de aceptar en el socket")
+    parser.add_argument(
+        "--timeout-apagado",
+        type=int,
+        default=30,
+        help="Segundos de espera a las solicitudes en curso al recibir SIGTERM"
+    )
+    parser.add_argument("--limite-concurrencia", type=int, help="Conexiones simultáneas por trabajador antes de responder 503")
+    parser.add_argument("--embebido", action="store_true", help="Sirve también la interfaz Gradio en /ui")
+    parser.add_argument("--log-level", default="info", choices=["critical", "error", "warning", "info", "debug"])
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(message)s")
+    
+    if args.workers < 1:
+        parser.error("--workers debe ser al menos 1")
+    # Los trabajadores lo heredan para repartir entre ellos los procesos de la cola de trabajos
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    
+    try:
+        precargar()
+    except Exception:
+        logger.exception("No se pudo cargar la aplicación")
+        sys.exit(1)
+    advertir_estado_por_proceso(args.workers)
+    
+    # Con varios trabajadores uvicorn necesita la aplicación como texto importable
+    aplicacion = "interface:crear_app_embebida" if args.embebido else "app:app"
+    
+    uvicorn.run(
+        aplicacion,
+        factory=args.embebido,
+        host=args.host,
+        port=args.puerto,
+        workers=args.workers,
+        # "auto" usa uvloop y httptools si están instalados (uvicorn[standard])
+        loop="auto",
+        http="auto",
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.timeout_apagado,
+        limit_concurrency=args.limite_concurrencia,
+        log_level=args.log_level,
+        proxy_headers=True
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import math
+from collections import OrderedDict, deque
+from typing import Optional
+
+from reglas_diagnostico import Accion
+
+# Nombres legibles de los parámetros seguidos, para las acciones predictivas
+NOMBRES_PARAMETROS = {
+    "ph": "El pH",
+    "conductividad_electrica": "La CE",
+    "temperatura_solucion": "La temperatura de la solución",
+    "humedad_relativa": "La humedad relativa"
+}
+
+SEGUNDOS_POR_HORA = 3600.0
+
+class TendenciaInvernadero:
+    """
+    Lecturas de un invernadero promediadas por intervalo de tiempo. El
+    intervalo en curso acumula sumas; al cerrarse se agrega como un punto
+    (tiempo medio y media de cada parámetro) a la ventana, que descarta los
+    puntos más viejos que `ventana_horas`, y se recalcula el resumen.
+    """
+    
+    __slots__ = (
+        "inicio_intervalo", "lecturas_intervalo", "suma_tiempo", "sumas",
+        "puntos", "resumen", "ewma", "ultima_marca", "lecturas_en_ventana"
+    )
+    
+    def __init__(self, parametros: tuple, marca_tiempo: float):
+        self.inicio_intervalo = marca_tiempo
+        self.lecturas_intervalo = 0
+        self.suma_tiempo = 0.0
+        self.sumas = dict.fromkeys(parametros, 0.0)
+        # (marca de tiempo media, {parámetro: media}, lecturas) de cada intervalo cerrado
+        self.puntos: deque = deque()
+        self.resumen: dict[str, dict] = {}
+        self.ewma: dict[str, Optional[float]] = dict.fromkeys(parametros)
+        self.ultima_marca = marca_tiempo
+        self.lecturas_en_ventana = 0
+
+def ajustar(tiempos: list, valores: list) -> dict:
+    """
+    Media, desvío, pendiente por hora y R² de la recta de mínimos cuadrados.
+    Los tiempos se centran en su media antes de sumar (el origen se rebasa en
+    cada ajuste), así que las marcas de tiempo absolutas no pierden precisión.
+    """
+    n = len(tiempos)
+    t_medio = sum(tiempos) / n
+    media = sum(valores) / n
+    sxx = sxy = syy = 0.0
+    for t, y in zip(tiempos, valores):
+        dt = (t - t_medio) / SEGUNDOS_POR_HORA
+        dy = y - media
+        sxx += dt * dt
+        sxy += dt * dy
+        syy += dy * dy
+    pendiente = sxy / sxx if sxx > 1e-12 else 0.0
+    r2 = sxy * sxy / (sxx * syy) if sxx > 1e-12 and syy > 1e-12 else 0.0
+    return {
+        "media": media,
+        "desvio": math.sqrt(syy / (n - 1)) if n > 1 else 0.0,
+        "pendiente_por_hora": pendiente,
+        "r2": min(r2, 1.0)
+    }
+
+class AnalizadorTendencias:
+    """
+    Tendencias en línea por invernadero: media móvil exponencial (EWMA) de las
+    lecturas y, sobre una ventana de `ventana_horas`, media, desvío y pendiente
+    por hora estimada por mínimos cuadrados. La ventana se mide en tiempo y no
+    en lecturas: las lecturas se promedian por intervalos de
+    `intervalo_minutos`, de modo que un tanque que informa cada minuto y uno
+    que informa cada hora ven la misma ventana, y el promedio atenúa el ruido
+    del sensor frente a una deriva lenta. Cada lectura cuesta O(1); al cerrar
+    un intervalo se reajusta la ventana (a lo sumo ventana_horas /
+    intervalo_minutos puntos). Los invernaderos menos activos se descartan al
+    superar `max_invernaderos`.
+    """
+    
+    def __init__(
+        self,
+        parametros: tuple,
+        ventana_horas: float = 24.0,
+        intervalo_minutos: float = 15.0,
+        alfa: float = 0.2,
+        min_puntos: int = 6,
+        min_r2: float = 0.6,
+        horizonte_horas: float = 24.0,
+        max_invernaderos: int = 10000
+    ):
+        self.parametros = parametros
+        self.ventana_horas = ventana_horas
+        self.intervalo_segundos = intervalo_minutos * 60.0
+        self.alfa = alfa
+        self.min_puntos = min_puntos
+        self.min_r2 = min_r2
+        self.horizonte_horas = horizonte_horas
+        self.max_invernaderos = max_invernaderos
+        self._invernaderos: OrderedDict[str, TendenciaInvernadero] = OrderedDict()
+        self.lecturas = 0
+        self.lecturas_descartadas = 0
+        self.intervalos = 0
+        self.predicciones = 0
+    
+    def actualizar(self, invernadero_id: str, marca_tiempo: float, valores: dict) -> bool:
+        """Incorpora una lectura; descarta las que llegan con marca de tiempo anterior a la última"""
+        estado = self._invernaderos.get(invernadero_id)
+        if estado is None:
+            estado = TendenciaInvernadero(self.parametros, marca_tiempo)
+            self._invernaderos[invernadero_id] = estado
+            while len(self._invernaderos) > self.max_invernaderos:
+                self._invernaderos.popitem(last=False)
+        else:
+            if marca_tiempo < estado.ultima_marca:
+                self.lecturas_descartadas += 1
+                return False
+            self._invernaderos.move_to_end(invernadero_id)
+        
+        if estado.lecturas_intervalo and marca_tiempo - estado.inicio_intervalo >= self.intervalo_segundos:
+            self._cerrar_intervalo(estado)
+            estado.inicio_intervalo = marca_tiempo
+        
+        for parametro in self.parametros:
+            y = float(valores[parametro])
+            ewma = estado.ewma[parametro]
+            estado.ewma[parametro] = y if ewma is None else self.alfa * y + (1 - self.alfa) * ewma
+            estado.sumas[parametro] += y
+        estado.suma_tiempo += marca_tiempo
+        estado.lecturas_intervalo += 1
+        estado.ultima_marca = marca_tiempo
+        self.lecturas += 1
+        return True
+    
+    def _cerrar_intervalo(self, estado: TendenciaInvernadero) -> None:
+        n = estado.lecturas_intervalo
+        t = estado.suma_tiempo / n
+        estado.puntos.append((t, {parametro: suma / n for parametro, suma in estado.sumas.items()}, n))
+        estado.lecturas_en_ventana += n
+        while estado.puntos and estado.puntos[0][0] < t - self.ventana_horas * SEGUNDOS_POR_HORA:
+            estado.lecturas_en_ventana -= estado.puntos.popleft()[2]
+        
+        estado.lecturas_intervalo = 0
+        estado.suma_tiempo = 0.0
+        estado.sumas = dict.fromkeys(self.parametros, 0.0)
+        self.intervalos += 1
+        
+        tiempos = [punto[0] for punto in estado.puntos]
+        estado.resumen = {
+            parametro: ajustar(tiempos, [punto[1][parametro] for punto in estado.puntos])
+            for parametro in self.parametros
+        }
+    
+    def estado(self, invernadero_id: str) -> Optional[dict]:
+        """Estadísticos actuales de cada parámetro seguido del invernadero (sobre los intervalos cerrados)"""
+        estado = self._invernaderos.get(invernadero_id)
+        if estado is None:
+            return None
+        puntos = estado.puntos
+        return {
+            "lecturas_en_ventana": estado.lecturas_en_ventana,
+            "intervalos_en_ventana": len(puntos),
+            "lecturas_en_intervalo_actual": estado.lecturas_intervalo,
+            "ventana_horas": round((puntos[-1][0] - puntos[0][0]) / SEGUNDOS_POR_HORA, 3) if puntos else 0.0,
+            "parametros": {
+                parametro: {
+                    nombre: round(valor, 4)
+                    for nombre, valor in {"ewma": estado.ewma[parametro], **estado.resumen.get(parametro, {})}.items()
+                }
+                for parametro in self.parametros
+            }
+        }
+    
+    def predecir(self, invernadero_id: str, rangos: dict) -> list[tuple]:
+        """
+        Parámetros que, dentro del rango todavía, saldrían de él antes del horizonte
+        si sigue la tendencia actual: (parámetro, "subir" o "bajar", horas, pendiente por hora, rango).
+        Sólo se consideran tendencias con suficientes intervalos y buen ajuste lineal (R²)
+        de los parámetros que tienen rango en `rangos`.
+        """
+        estado = self._invernaderos.get(invernadero_id)
+        if estado is None or len(estado.puntos) < self.min_puntos:
+            return []
+        
+        predicciones = []
+        for parametro in self.parametros:
+            if parametro not in rangos:
+                continue
+            minimo, maximo = rangos[parametro]
+            resumen = estado.resumen[parametro]
+            nivel = estado.ewma[parametro]
+            pendiente = resumen["pendiente_por_hora"]
+            if resumen["r2"] < self.min_r2 or not (minimo <= nivel <= maximo) or pendiente == 0:
+                continue
+            
+            horas = (maximo - nivel) / pendiente if pendiente > 0 else (nivel - minimo) / -pendiente
+            if horas <= self.horizonte_horas:
+                predicciones.append((parametro, "subir" if pendiente > 0 else "bajar", horas, pendiente, (minimo, maximo)))
+        
+        self.predicciones += len(predicciones)
+        return predicciones
+    
+    def olvidar(self, invernadero_id: str) -> bool:
+        return self._invernaderos.pop(invernadero_id, None) is not None
+    
+    def estadisticas(self) -> dict:
+        return {
+            "invernaderos": len(self._invernaderos),
+            "max_invernaderos": self.max_invernaderos,
+            "ventana_horas": self.ventana_horas,
+            "intervalo_minutos": self.intervalo_segundos / 60.0,
+            "lecturas": self.lecturas,
+            "intervalos": self.intervalos,
+            "lecturas_descartadas": self.lecturas_descartadas,
+            "predicciones": self.predicciones
+        }
+
+def accion_predictiva(parametro: str, direccion: str, horas: float, pendiente: float, rango: tuple) -> Accion:
+    """Acción preventiva para un parámetro que saldrá de rango si sigue su tendencia"""
+    horas_redondeadas = max(1, round(horas))
+    limite = "superará el máximo" if direccion == "subir" else "bajará del mínimo"
+    icono = "📈" if direccion == "subir" else "📉"
+    return Accion.model_construct(
+        tipo=f"prevencion_{parametro}",
+        descripcion=(
+            f"{icono} {NOMBRES_PARAMETROS.get(parametro, parametro)} {limite} del rango "
+            f"{rango[0]}-{rango[1]} en ~{horas_redondeadas} horas "
+            f"(tendencia {pendiente * 24:+.2f} por día)"
+        ),
+        prioridad="alta" if horas <= 6 else "media",
+        tiempo_revision=f"{horas_redondeadas} horas"
+    )
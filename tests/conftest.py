@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# Los módulos de la aplicación están en la raíz del repositorio
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Importar app no debe escribir series en disco durante las pruebas
+os.environ.setdefault("SERIES_HABILITADAS", "0")
@@ -0,0 +1,147 @@
+import asyncio
+import json
+
+import pytest
+
+from admision import (
+    PATRON_SINTOMAS,
+    PRIORITARIO,
+    MASIVO,
+    ControlAdmision,
+    CuotasClientes,
+    MiddlewareAdmision,
+    Rechazo
+)
+
+RUTAS = {
+    "/diagnostico": None,
+    "/diagnostico/lote": MASIVO,
+    "/diagnostico/barrido": MASIVO
+}
+
+class ControlRegistrado(ControlAdmision):
+    """Control de admisión que anota el carril de cada solicitud admitida"""
+    
+    def __init__(self):
+        super().__init__()
+        self.carriles = []
+    
+    async def entrar(self, carril: int) -> float:
+        self.carriles.append(carril)
+        return await super().entrar(carril)
+
+def solicitar(ruta: str, cuerpo: bytes, encabezados: dict) -> tuple[int, bytes]:
+    """Pasa una solicitud POST por el middleware; devuelve el carril asignado y el cuerpo que recibió la aplicación"""
+    control = ControlRegistrado()
+    recibido = []
+    
+    async def aplicacion(scope, receive, send):
+        mas = True
+        while mas:
+            mensaje = await receive()
+            recibido.append(mensaje.get("body", b""))
+            mas = mensaje.get("more_body", False)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    
+    middleware = MiddlewareAdmision(aplicacion, control, CuotasClientes(0, 1), RUTAS)
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": ruta,
+        "headers": [(nombre.encode(), valor.encode()) for nombre, valor in encabezados.items()],
+        "client": ("127.0.0.1", 1234)
+    }
+    
+    async def receive():
+        return {"type": "http.request", "body": cuerpo, "more_body": False}
+    
+    async def send(mensaje):
+        pass
+    
+    asyncio.run(middleware(scope, receive, send))
+    assert len(control.carriles) == 1
+    return control.carriles[0], b"".join(recibido)
+
+@pytest.mark.parametrize("ruta", ["/diagnostico/lote", "/diagnostico/barrido"])
+@pytest.mark.parametrize("prioridad", ["interactiva", "alta", "masiva"])
+def test_el_encabezado_no_cambia_el_carril_de_las_rutas_fijas(ruta, prioridad):
+    carril, _ = solicitar(ruta, b'[{"sintomas_visuales": true}]', {"x-prioridad": prioridad})
+    assert carril == MASIVO
+
+def test_el_encabezado_elige_el_carril_de_las_rutas_sin_carril_fijo():
+    assert solicitar("/diagnostico", b"{}", {"x-prioridad": "interactiva"})[0] == PRIORITARIO
+    assert solicitar("/diagnostico", b'{"sintomas_visuales": true}', {"x-prioridad": "masiva"})[0] == MASIVO
+
+def test_sin_encabezado_las_lecturas_con_sintomas_van_al_carril_prioritario():
+    cuerpo = json.dumps({"cultivo": "lechuga", "sintomas_visuales": True}).encode()
+    carril, recibido = solicitar("/diagnostico", cuerpo, {})
+    assert carril == PRIORITARIO
+    # La aplicación recibe el cuerpo completo aunque el middleware lo haya leído para clasificar
+    assert recibido == cuerpo
+    assert solicitar("/diagnostico", b'{"sintomas_visuales": false}', {})[0] == MASIVO
+
+@pytest.mark.parametrize("valor", ["true", "1", "1.0", '"true"', '"True"', '"1"', '"yes"', '"on"', '"t"', '"Y"'])
+def test_patron_sintomas_reconoce_los_verdaderos_de_pydantic(valor):
+    assert PATRON_SINTOMAS.search(b'{"sintomas_visuales": %s}' % valor.encode())
+
+@pytest.mark.parametrize("valor", ["false", "0", "10", "1.5", '"false"', '"off"', '"no"', "null"])
+def test_patron_sintomas_descarta_los_falsos(valor):
+    assert not PATRON_SINTOMAS.search(b'{"sintomas_visuales": %s}' % valor.encode())
+
+def estados_con_cuota(clientes: list[tuple[str, str]], proxies_confiables: frozenset = frozenset()) -> list[int]:
+    """Códigos de respuesta de una solicitud por (dirección, X-Cliente), con una cuota de una solicitud por cliente"""
+    cuotas = CuotasClientes(tasa=0.001, rafaga=1)
+    
+    async def aplicacion(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    
+    middleware = MiddlewareAdmision(aplicacion, ControlAdmision(), cuotas, RUTAS, proxies_confiables=proxies_confiables)
+    estados = []
+    
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+    
+    async def send(mensaje):
+        if mensaje["type"] == "http.response.start":
+            estados.append(mensaje["status"])
+    
+    async def escenario():
+        for direccion, cliente in clientes:
+            scope = {
+                "type": "http",
+                "method": "POST",
+                "path": "/diagnostico/lote",
+                "headers": [(b"x-cliente", cliente.encode())],
+                "client": (direccion, 1234)
+            }
+            await middleware(scope, receive, send)
+    
+    asyncio.run(escenario())
+    return estados
+
+def test_x_cliente_no_reparte_la_cuota_de_una_misma_direccion():
+    assert estados_con_cuota([("10.0.0.5", "a"), ("10.0.0.5", "b"), ("10.0.0.6", "a")]) == [200, 429, 200]
+
+def test_x_cliente_identifica_al_cliente_detras_de_un_proxy_confiable():
+    proxies = frozenset({"10.0.0.1"})
+    assert estados_con_cuota([("10.0.0.1", "a"), ("10.0.0.1", "b"), ("10.0.0.1", "a")], proxies) == [200, 200, 429]
+
+def test_el_lugar_cedido_al_vencer_la_espera_se_libera(monkeypatch):
+    async def escenario():
+        control = ControlAdmision(max_concurrencia=1, presupuesto_cola_segundos=0.25)
+        await control.entrar(MASIVO)
+        
+        async def vencer_con_lugar_cedido(futuro, tiempo):
+            # La solicitud en curso termina y le cede el lugar justo cuando vence la espera
+            control.salir()
+            raise asyncio.TimeoutError
+        
+        monkeypatch.setattr(asyncio, "wait_for", vencer_con_lugar_cedido)
+        with pytest.raises(Rechazo):
+            await control.entrar(PRIORITARIO)
+        assert control.en_curso == 0
+        assert control.estadisticas()["prioritario_esperando"] == 0
+    
+    asyncio.run(escenario())
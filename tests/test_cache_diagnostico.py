@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import app
+from cache_diagnostico import CacheLRU
+from reglas_diagnostico import DiagnosticoInput
+
+PARAMETROS = {
+    "ph": 6.0,
+    "conductividad_electrica": 1.6,
+    "temperatura_solucion": 20,
+    "humedad_relativa": 65,
+    "temperatura_ambiente": 15,
+    "horas_luz_diarias": 14,
+    "dias_desde_renovacion": 7
+}
+
+def lectura(**parametros) -> DiagnosticoInput:
+    return DiagnosticoInput(cultivo="lechuga", etapa="crecimiento", parametros={**PARAMETROS, **parametros})
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = CacheLRU(tamano_maximo=4096, ttl_segundos=300, habilitado=True)
+    monkeypatch.setattr(app, "CACHE_DIAGNOSTICO", cache)
+    return cache
+
+@pytest.mark.parametrize("fuera, dentro", [
+    ({"humedad_relativa": 75.2}, {"humedad_relativa": 75.0}),
+    ({"ph": 5.78}, {"ph": 5.8})
+])
+def test_lecturas_a_ambos_lados_de_un_limite_no_comparten_diagnostico(cache, fuera, dentro):
+    catalogo = app.reglas_activas()
+    for parametros in (dentro, fuera, dentro, fuera):
+        entrada = lectura(**parametros)
+        resultado, _ = app.diagnosticar_con_cache(entrada)
+        assert resultado == catalogo.diagnosticar(entrada)
+    assert app.diagnosticar_con_cache(lectura(**fuera))[0] != app.diagnosticar_con_cache(lectura(**dentro))[0]
+
+class ContadorEvaluaciones:
+    """Envuelve CatalogoReglas.diagnosticar para contar cuántas veces se evalúan las reglas"""
+    
+    def __init__(self, monkeypatch, catalogo):
+        self.llamadas = 0
+        original = catalogo.diagnosticar
+        
+        def diagnosticar(entrada):
+            self.llamadas += 1
+            return original(entrada)
+        
+        monkeypatch.setattr(catalogo, "diagnosticar", diagnosticar)
+
+def test_un_acierto_no_evalua_las_reglas(cache, monkeypatch):
+    contador = ContadorEvaluaciones(monkeypatch, app.reglas_activas())
+    primero = app.diagnosticar_con_cache(lectura(ph=6.0, humedad_relativa=65.0))
+    # Misma celda de resolución, lectura distinta
+    segundo = app.diagnosticar_con_cache(lectura(ph=6.01, humedad_relativa=65.1))
+    assert contador.llamadas == 1
+    assert segundo == primero
+    assert cache.aciertos == 1
+
+def test_las_lecturas_junto_a_un_limite_se_evaluan_siempre(cache, monkeypatch):
+    contador = ContadorEvaluaciones(monkeypatch, app.reglas_activas())
+    for _ in range(3):
+        app.diagnosticar_con_cache(lectura(humedad_relativa=75.0))
+    assert contador.llamadas == 3
+    assert cache.omitidos == 3
+    assert cache.estadisticas()["entradas"] == 0
+
+def test_cache_devuelve_el_mismo_diagnostico_que_la_evaluacion_sin_cache(cache):
+    catalogo = app.reglas_activas()
+    for ph in np.round(np.arange(5.0, 7.01, 0.01), 2):
+        for humedad in (69.9, 70.0, 70.1, 74.9, 75.0, 75.1, 85.0, 85.1):
+            entrada = lectura(ph=float(ph), humedad_relativa=humedad)
+            resultado, cuerpo = app.diagnosticar_con_cache(entrada)
+            assert resultado == catalogo.diagnosticar(entrada)
+            assert cuerpo == app.serializar_diagnostico(resultado)
+    assert cache.aciertos > 0
@@ -0,0 +1,175 @@
+import asyncio
+import sqlite3
+import time
+
+import httpx
+import pytest
+
+from reglas_diagnostico import Accion
+from seguimientos import ProgramadorSeguimientos, WebhookRecordatorios, plazo_revision
+
+ACCIONES = [
+    Accion(tipo="ajuste_ph", descripcion="Bajar pH", prioridad="alta", tiempo_revision="2 horas"),
+    Accion(tipo="renovacion", descripcion="Renovar solución", prioridad="media", tiempo_revision="24 horas")
+]
+
+def programador(ruta, avisados=None, **opciones) -> ProgramadorSeguimientos:
+    async def avisar(revisiones):
+        if avisados is not None:
+            avisados.extend(revisiones)
+    return ProgramadorSeguimientos(avisar, str(ruta), **opciones)
+
+def filas(ruta) -> int:
+    conexion = sqlite3.connect(ruta)
+    try:
+        return conexion.execute("SELECT count(*) FROM revisiones").fetchone()[0]
+    finally:
+        conexion.close()
+
+@pytest.mark.parametrize("texto, segundos", [
+    ("inmediato", 900),
+    ("2 horas", 7200),
+    ("24 horas", 86400),
+    ("30 minutos", 1800),
+    ("3 días", 259200),
+    ("1,5 horas", 5400),
+    ("pronto", None)
+])
+def test_plazo_revision(texto, segundos):
+    assert plazo_revision(texto, 900) == segundos
+
+def test_procesos_que_comparten_la_base_no_chocan_al_guardar(tmp_path):
+    ruta = tmp_path / "seguimientos.sqlite3"
+    
+    async def escenario():
+        primero = programador(ruta)
+        segundo = programador(ruta)
+        primero.iniciar()
+        segundo.iniciar()
+        for i in range(50):
+            primero.revisar(f"a-{i}", ACCIONES)
+            segundo.revisar(f"b-{i}", ACCIONES)
+        await primero.detener()
+        await segundo.detener()
+        return primero, segundo
+    
+    primero, segundo = asyncio.run(escenario())
+    assert primero.estadisticas()["errores_guardado"] == 0
+    assert segundo.estadisticas()["errores_guardado"] == 0
+    assert filas(ruta) == 200
+
+def test_las_revisiones_se_recuperan_una_sola_vez_al_reiniciar(tmp_path):
+    ruta = tmp_path / "seguimientos.sqlite3"
+    
+    async def escenario():
+        anterior = programador(ruta)
+        anterior.iniciar()
+        anterior.revisar("inv-1", ACCIONES, ahora=1000.0)
+        anterior.revisar("inv-2", ACCIONES[:1])
+        await anterior.detener()
+        
+        # Con la base compartida, sólo el primer proceso en iniciar recupera las revisiones
+        primero = programador(ruta)
+        segundo = programador(ruta)
+        primero.iniciar()
+        segundo.iniciar()
+        recuperadas = (primero.pendientes, segundo.pendientes)
+        pendientes = [(r.tipo, r.vencimiento) for r in primero.pendientes_de("inv-1")]
+        await primero.detener()
+        await segundo.detener()
+        
+        # Un reinicio dentro del mismo proceso tampoco las duplica
+        primero.iniciar()
+        reiniciadas = primero.pendientes
+        await primero.detener()
+        return recuperadas, pendientes, reiniciadas
+    
+    recuperadas, pendientes, reiniciadas = asyncio.run(escenario())
+    assert recuperadas == (3, 0)
+    assert pendientes == [("ajuste_ph", 1000.0 + 7200), ("renovacion", 1000.0 + 86400)]
+    assert reiniciadas == 3
+    assert filas(ruta) == 3
+
+def test_una_lectura_nueva_reconoce_las_revisiones_y_las_vencidas_se_avisan_una_vez(tmp_path):
+    avisados = []
+    
+    async def escenario():
+        seguimientos = programador(tmp_path / "seguimientos.sqlite3", avisados)
+        seguimientos.iniciar()
+        vencida = time.time() - 7200 + 0.05
+        seguimientos.revisar("sin-lecturas", ACCIONES[:1], ahora=vencida)
+        seguimientos.revisar("con-lecturas", ACCIONES[:1], ahora=vencida)
+        seguimientos.revisar("con-lecturas", [])
+        await asyncio.sleep(0.3)
+        estadisticas = seguimientos.estadisticas()
+        await seguimientos.detener()
+        return estadisticas
+    
+    estadisticas = asyncio.run(escenario())
+    assert [revision.invernadero_id for revision in avisados] == ["sin-lecturas"]
+    assert estadisticas["avisadas"] == 1
+    assert estadisticas["reconocidas"] == 1
+    assert estadisticas["pendientes"] == 0
+
+def test_un_aviso_fallido_se_reintenta_con_espera(tmp_path):
+    intentos = []
+    
+    async def avisar(revisiones):
+        intentos.append(time.monotonic())
+        if len(intentos) == 1:
+            raise RuntimeError("webhook caído")
+    
+    async def escenario():
+        seguimientos = ProgramadorSeguimientos(avisar, str(tmp_path / "seguimientos.sqlite3"), reintento_aviso=0.1)
+        seguimientos.iniciar()
+        seguimientos.revisar("inv", ACCIONES[:1], ahora=time.time() - 7200)
+        await asyncio.sleep(0.5)
+        estadisticas = seguimientos.estadisticas()
+        await seguimientos.detener()
+        return estadisticas
+    
+    estadisticas = asyncio.run(escenario())
+    assert len(intentos) == 2
+    assert intentos[1] - intentos[0] >= 0.1
+    assert estadisticas["errores_aviso"] == 1
+    assert estadisticas["reintentos_aviso"] == 1
+    assert estadisticas["avisadas"] == 1
+    assert estadisticas["pendientes"] == 0
+
+def test_un_aviso_lento_no_demora_los_siguientes(tmp_path):
+    avisados = []
+    
+    async def avisar(revisiones):
+        if revisiones[0].invernadero_id == "lento":
+            await asyncio.sleep(5)
+        avisados.extend(revision.invernadero_id for revision in revisiones)
+    
+    async def escenario():
+        seguimientos = ProgramadorSeguimientos(avisar, str(tmp_path / "seguimientos.sqlite3"))
+        seguimientos.iniciar()
+        seguimientos.revisar("lento", ACCIONES[:1], ahora=time.time() - 7200)
+        seguimientos.revisar("rapido", ACCIONES[:1], ahora=time.time() - 7200 + 0.1)
+        await asyncio.sleep(0.3)
+        en_curso = seguimientos.estadisticas()["avisos_en_curso"]
+        await seguimientos.detener()
+        return en_curso, seguimientos
+    
+    en_curso, seguimientos = asyncio.run(escenario())
+    assert avisados == ["rapido"]
+    assert en_curso == 1
+    # El aviso interrumpido al detener quedó guardado para el próximo inicio
+    assert filas(tmp_path / "seguimientos.sqlite3") == 1
+
+def test_el_webhook_propaga_los_errores_http():
+    webhook = WebhookRecordatorios("http://webhook.invalido/recordatorios")
+    webhook._cliente = httpx.AsyncClient(transport=httpx.MockTransport(lambda solicitud: httpx.Response(502)))
+    
+    async def escenario():
+        try:
+            with pytest.raises(httpx.HTTPStatusError):
+                await webhook.enviar([{"invernadero_id": "inv"}])
+        finally:
+            await webhook.cerrar()
+    
+    asyncio.run(escenario())
+    assert webhook.estadisticas() == {"enviados": 0, "fallidos": 1}
@@ -0,0 +1,44 @@
+import asyncio
+
+from series_temporales import AlmacenSeries, COLUMNAS_SERIE
+
+def valores(ph: float) -> dict:
+    return {**{columna: 1.0 for columna in COLUMNAS_SERIE}, "ph": ph}
+
+def test_las_series_cerradas_conservan_lo_escrito(tmp_path):
+    async def escenario():
+        almacen = AlmacenSeries(str(tmp_path), capacidad_inicial=4, max_series_abiertas=3)
+        almacen.iniciar()
+        # Más invernaderos que series abiertas y más lecturas que la capacidad inicial
+        for i in range(50):
+            for invernadero in range(10):
+                assert almacen.agregar(f"inv{invernadero}", 1000.0 + i, valores(5.0 + i / 100))
+        await almacen.detener()
+        
+        estadisticas = almacen.estadisticas()
+        assert estadisticas["registros_agregados"] == 500
+        assert estadisticas["series_abiertas"] <= 3
+        assert estadisticas["series_cerradas"] > 0
+        for invernadero in range(10):
+            resultado = await almacen.consultar(f"inv{invernadero}", ["ph"])
+            assert resultado["lecturas"] == 50
+            assert resultado["series"]["ph"][-1] == 5.49
+        
+        # Reabierto desde los archivos, como al reiniciar el servicio
+        reabierto = AlmacenSeries(str(tmp_path), max_series_abiertas=3)
+        resultado = await reabierto.consultar("inv0", ["ph"], desde=1010.0, hasta=1019.0)
+        assert resultado["lecturas"] == 10
+    
+    asyncio.run(escenario())
+
+def test_las_lecturas_fuera_de_orden_se_descartan(tmp_path):
+    async def escenario():
+        almacen = AlmacenSeries(str(tmp_path), max_series_abiertas=2)
+        almacen.iniciar()
+        for marca in (10.0, 20.0, 15.0, 30.0):
+            almacen.agregar("inv", marca, valores(6.0))
+        await almacen.detener()
+        assert almacen.estadisticas()["registros_descartados"] == 1
+        assert (await almacen.consultar("inv", ["ph"]))["tiempos"] == [10.0, 20.0, 30.0]
+    
+    asyncio.run(escenario())
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from tendencias import AnalizadorTendencias
+
+PARAMETROS = ("ph",)
+RANGO_PH = {"ph": (5.8, 6.2)}
+INICIO = 1_760_000_000.0
+
+def simular(
+    analizador,
+    pendiente_por_dia: float,
+    ruido: float,
+    horas: float,
+    cada_segundos: float = 60.0,
+    semilla: int = 7,
+    ph_inicial: float = 6.0
+):
+    """Lecturas de pH con deriva lineal y ruido gaussiano; devuelve la hora de la primera predicción"""
+    azar = random.Random(semilla)
+    primera = None
+    for i in range(int(horas * 3600 / cada_segundos)):
+        marca = INICIO + i * cada_segundos
+        ph = ph_inicial + pendiente_por_dia * (marca - INICIO) / 86400 + azar.gauss(0, ruido)
+        analizador.actualizar("tanque", marca, {"ph": ph})
+        if primera is None and analizador.predecir("tanque", RANGO_PH):
+            primera = (marca - INICIO) / 3600
+    return primera
+
+@pytest.mark.parametrize("cada_segundos", [60, 900, 3600])
+def test_deriva_lenta_con_ruido_se_anticipa_antes_de_salir_del_rango(cada_segundos):
+    # 0.1 de pH por día desde 5.9 sale de 5.8-6.2 a las 72 horas; ruido de 0.01 por lectura
+    primera = simular(AnalizadorTendencias(PARAMETROS), 0.1, 0.01, 80, cada_segundos=cada_segundos, ph_inicial=5.9)
+    assert primera is not None and primera < 72
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_el_ruido_solo_no_genera_predicciones(semilla):
+    assert simular(AnalizadorTendencias(PARAMETROS), 0.0, 0.01, 72, semilla=semilla) is None
+
+def test_la_pendiente_es_precisa_con_marcas_de_tiempo_absolutas():
+    analizador = AnalizadorTendencias(PARAMETROS, ventana_horas=6)
+    for i in range(30 * 24 * 4):
+        marca = INICIO + i * 900
+        analizador.actualizar("tanque", marca, {"ph": 6.0 + 0.001 * (marca - INICIO) / 3600})
+    resumen = analizador.estado("tanque")["parametros"]["ph"]
+    assert resumen["pendiente_por_hora"] == pytest.approx(0.001, rel=1e-3)
+    assert resumen["r2"] == pytest.approx(1.0)
+
+def test_descarta_lecturas_atrasadas():
+    analizador = AnalizadorTendencias(PARAMETROS)
+    assert analizador.actualizar("tanque", INICIO, {"ph": 6.0})
+    assert not analizador.actualizar("tanque", INICIO - 1, {"ph": 6.0})
+    assert analizador.estadisticas()["lecturas_descartadas"] == 1
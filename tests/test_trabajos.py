@@ -0,0 +1,22 @@
+import asyncio
+
+from trabajos import GestorTrabajos
+
+def test_cancelar_un_trabajo_termina_su_tarea_como_cancelada():
+    async def escenario():
+        gestor = GestorTrabajos(procesos=1, max_activos=1)
+        # Ocupa el único lugar para que el trabajo quede esperando dentro de _ejecutar
+        async with gestor._activos:
+            trabajo = gestor.enviar(b'{"cultivo": "lechuga"}\n', "ndjson")
+            tarea = trabajo.tarea
+            await asyncio.sleep(0)
+            gestor.eliminar(trabajo.id)
+            await asyncio.gather(tarea, return_exceptions=True)
+        await gestor.cerrar()
+        return trabajo, tarea, gestor
+    
+    trabajo, tarea, gestor = asyncio.run(escenario())
+    assert tarea.cancelled()
+    assert trabajo.estado == "cancelado"
+    assert trabajo.finalizado is not None
+    assert gestor.estadisticas()["cancelados"] == 1
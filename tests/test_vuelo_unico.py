@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from cache_diagnostico import VueloUnico
+
+def test_vuelo_unico_propaga_el_error_del_lider_a_los_que_se_unieron():
+    async def escenario():
+        vuelos = VueloUnico()
+        futuro = vuelos.iniciar("clave")
+        unido = vuelos.unirse("clave")
+        assert unido is futuro
+        
+        espera = asyncio.ensure_future(asyncio.shield(unido))
+        await asyncio.sleep(0)
+        futuro.set_exception(RuntimeError("falló el diagnóstico"))
+        vuelos.terminar("clave", futuro)
+        
+        with pytest.raises(RuntimeError, match="falló el diagnóstico"):
+            await espera
+        # El error no queda guardado: la próxima solicitud idéntica vuelve a diagnosticar
+        assert vuelos.unirse("clave") is None
+        assert vuelos.estadisticas()["en_vuelo"] == 0
+    
+    asyncio.run(escenario())
+
+def test_vuelo_unico_cancela_a_los_unidos_si_el_lider_termina_sin_resultado():
+    async def escenario():
+        vuelos = VueloUnico()
+        futuro = vuelos.iniciar("clave")
+        unido = vuelos.unirse("clave")
+        vuelos.terminar("clave", futuro)
+        assert unido.cancelled()
+        assert vuelos.unirse("clave") is None
+    
+    asyncio.run(escenario())
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import multiprocessing
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from pydantic import ValidationError
+
+from reglas_diagnostico import (
+    CODIGO_INVALIDO,
+    CatalogoReglas,
+    DiagnosticoInput,
+    DiagnosticoHidroponico,
+    describir_error_validacion,
+    reglas_activas,
+    serializar_diagnostico
+)
+
+ESTADOS_FINALES = ("completado", "cancelado", "fallido")
+
+# Líneas en blanco de un NDJSON: cuentan para el índice (que es el número de línea, como en /diagnostico/flujo) pero no tienen resultado
+CODIGO_VACIA = -2
+
+# Bytes aproximados por línea NDJSON, para cortar el cuerpo en bloques sin recorrerlo
+BYTES_POR_LECTURA_NDJSON = 320
+
+def partir_json(cuerpo: bytes, lecturas_por_bloque: int) -> list[bytes]:
+    """Se ejecuta en el pool: separa una lista JSON en bloques de lecturas, también en JSON"""
+    lecturas = json.loads(cuerpo)
+    if not isinstance(lecturas, list):
+        raise ValueError("El cuerpo debe ser una lista JSON de lecturas")
+    return [
+        json.dumps(lecturas[i:i + lecturas_por_bloque]).encode()
+        for i in range(0, len(lecturas), lecturas_por_bloque)
+    ]
+
+def partir_ndjson(cuerpo: bytes, bytes_por_bloque: int) -> list[bytes]:
+    """Corta el cuerpo NDJSON en bloques de líneas completas buscando sólo un salto de línea por bloque"""
+    bloques = []
+    inicio = 0
+    while inicio < len(cuerpo):
+        corte = cuerpo.find(b"\n", inicio + bytes_por_bloque)
+        fin = len(cuerpo) if corte == -1 else corte + 1
+        bloques.append(cuerpo[inicio:fin])
+        inicio = fin
+    return bloques
+
+def diagnosticar_bloque(bloque: bytes, formato: str, catalogo: CatalogoReglas) -> tuple[np.ndarray, dict[int, str]]:
+    """
+    Se ejecuta en el pool: valida las lecturas del bloque y devuelve el código de
+    diagnóstico de cada una (CODIGO_INVALIDO si no es válida) y los errores de
+    validación por posición. Los códigos se decodifican en el proceso principal
+    con el mismo catálogo, donde los diagnósticos son objetos compartidos ya serializados.
+    """
+    if formato == "ndjson":
+        # Los bloques terminan en un salto de línea salvo el último del cuerpo
+        lecturas = bloque.split(b"\n")
+        if bloque.endswith(b"\n"):
+            lecturas.pop()
+        validar = DiagnosticoInput.model_validate_json
+    else:
+        lecturas = json.loads(bloque)
+        validar = DiagnosticoInput.model_validate
+    
+    codigos = np.full(len(lecturas), CODIGO_INVALIDO, dtype=np.int32)
+    errores = {}
+    entradas = []
+    posiciones = []
+    for posicion, lectura in enumerate(lecturas):
+        if formato == "ndjson" and not lectura.strip():
+            codigos[posicion] = CODIGO_VACIA
+            continue
+        try:
+            entradas.append(validar(lectura))
+            posiciones.append(posicion)
+        except ValidationError as e:
+            errores[posicion] = describir_error_validacion(e)
+    
+    if entradas:
+        codigos[posiciones] = DiagnosticoHidroponico.codificar_lote(entradas, catalogo)
+    return codigos, errores
+
+def marca_iso(marca: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(marca).isoformat(timespec="seconds") if marca is not None else None
+
+class Trabajo:
+    """
+    Estado de un trabajo de diagnóstico. Los resultados se guardan por bloque
+    como arreglos de códigos (4 bytes por lectura) más los errores de validación,
+    y se convierten a JSON recién al consultarlos. Todo el trabajo usa las reglas
+    activas al enviarlo, aunque cambien mientras se ejecuta.
+    """
+    
+    __slots__ = (
+        "id", "formato", "estado", "error", "creado", "iniciado", "finalizado",
+        "bloques_totales", "bloques_completados", "lecturas", "vacias", "errores",
+        "codigos", "inicios", "novedad", "tarea", "catalogo"
+    )
+    
+    def __init__(self, formato: str):
+        self.id = uuid.uuid4().hex
+        self.formato = formato
+        self.estado = "pendiente"
+        self.error: Optional[str] = None
+        self.creado = time.time()
+        self.iniciado: Optional[float] = None
+        self.finalizado: Optional[float] = None
+        self.bloques_totales: Optional[int] = None
+        self.bloques_completados = 0
+        # Posiciones (lecturas más líneas en blanco) y líneas en blanco de los bloques completados
+        self.lecturas = 0
+        self.vacias = 0
+        # Índice global de la lectura -> error de validación
+        self.errores: dict[int, str] = {}
+        self.codigos: list[np.ndarray] = []
+        self.inicios: list[int] = []
+        # Se activa (y se reemplaza) con cada bloque completado y al terminar
+        self.novedad = asyncio.Event()
+        self.tarea: Optional[asyncio.Task] = None
+        self.catalogo = reglas_activas()
+    
+    @property
+    def terminado(self) -> bool:
+        return self.estado in ESTADOS_FINALES
+    
+    def agregar_bloque(self, codigos: np.ndarray, errores: dict[int, str]) -> None:
+        self.inicios.append(self.lecturas)
+        self.codigos.append(codigos)
+        for posicion, error in errores.items():
+            self.errores[self.lecturas + posicion] = error
+        self.lecturas += len(codigos)
+        self.vacias += int(np.count_nonzero(codigos == CODIGO_VACIA))
+        self.bloques_completados += 1
+        self.avisar()
+    
+    def avisar(self) -> None:
+        self.novedad.set()
+        self.novedad = asyncio.Event()
+    
+    def resultados(self, desde: int, hasta: int) -> tuple[list[bytes], int]:
+        """
+        Líneas JSON (formato de ResultadoLote) de las lecturas [desde, hasta) ya
+        procesadas, sin las líneas en blanco, y la posición siguiente a la última leída
+        """
+        hasta = min(hasta, self.lecturas)
+        lineas = []
+        serializados = {}
+        bloque = bisect_right(self.inicios, desde) - 1
+        indice = desde
+        while indice < hasta:
+            inicio = self.inicios[bloque]
+            codigos = self.codigos[bloque][indice - inicio:hasta - inicio].tolist()
+            for codigo in codigos:
+                if codigo == CODIGO_INVALIDO:
+                    error = json.dumps(self.errores.get(indice, "Lectura inválida"), ensure_ascii=False).encode()
+                    lineas.append(b'{"indice":%d,"resultado":null,"error":%s}' % (indice, error))
+                elif codigo != CODIGO_VACIA:
+                    cuerpo = serializados.get(codigo)
+                    if cuerpo is None:
+                        cuerpo = serializados[codigo] = serializar_diagnostico(self.catalogo.decodificar(codigo))
+                    lineas.append(b'{"indice":%d,"resultado":%s,"error":null}' % (indice, cuerpo))
+                indice += 1
+            bloque += 1
+        return lineas, max(hasta, desde)
+    
+    def resumen(self, ttl_segundos: float) -> dict:
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "formato": self.formato,
+            "version_reglas": self.catalogo.version,
+            "progreso": round(self.bloques_completados / self.bloques_totales, 4) if self.bloques_totales else (1.0 if self.estado == "completado" else 0.0),
+            "lecturas_procesadas": self.lecturas - self.vacias,
+            "errores": len(self.errores),
+            "bloques": {"completados": self.bloques_completados, "totales": self.bloques_totales},
+            "creado": marca_iso(self.creado),
+            "iniciado": marca_iso(self.iniciado),
+            "finalizado": marca_iso(self.finalizado),
+            "expira": marca_iso(self.finalizado + ttl_segundos if self.finalizado is not None else None),
+            "error": self.error
+        }
+
+class GestorTrabajos:
+    """
+    Cola de trabajos de diagnóstico de lotes muy grandes. La validación y el
+    árbol de decisión se ejecutan en un pool de procesos acotado, fuera del loop
+    de eventos: el loop sólo reparte bloques y guarda códigos, así que las
+    solicitudes de /diagnostico no esperan a los trabajos. Como mucho
+    `max_activos` trabajos se ejecutan a la vez (el resto espera como
+    "pendiente") y cada uno tiene a lo sumo `procesos` bloques en vuelo.
+    Los trabajos terminados se descartan `ttl_segundos` después de finalizar.
+    """
+    
+    def __init__(
+        self,
+        procesos: int,
+        max_activos: int = 2,
+        max_trabajos: int = 100,
+        lecturas_por_bloque: int = 5000,
+        ttl_segundos: float = 3600.0
+    ):
+        self.procesos = procesos
+        self.max_activos = max_activos
+        self.max_trabajos = max_trabajos
+        self.lecturas_por_bloque = lecturas_por_bloque
+        self.ttl_segundos = ttl_segundos
+        self._trabajos: OrderedDict[str, Trabajo] = OrderedDict()
+        self._activos = asyncio.Semaphore(max_activos)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.enviados = 0
+        self.completados = 0
+        self.cancelados = 0
+        self.fallidos = 0
+        self.expirados = 0
+        self.lecturas_procesadas = 0
+    
+    def _obtener_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # "spawn" evita heredar el loop de eventos y los hilos del servidor en los procesos hijos
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+    
+    def _purgar(self) -> None:
+        limite = time.time() - self.ttl_segundos
+        for trabajo in [t for t in self._trabajos.values() if t.finalizado is not None and t.finalizado < limite]:
+            del self._trabajos[trabajo.id]
+            trabajo.avisar()
+            self.expirados += 1
+    
+    def enviar(self, cuerpo: bytes, formato: str) -> Optional[Trabajo]:
+        """
+        Encola un trabajo y devuelve enseguida su estado inicial. Si se alcanzó
+        `max_trabajos` se descarta el trabajo terminado más viejo; devuelve None
+        si todos los guardados siguen pendientes o en curso.
+        """
+        self._purgar()
+        if len(self._trabajos) >= self.max_trabajos:
+            terminado = next((t for t in self._trabajos.values() if t.terminado), None)
+            if terminado is None:
+                return None
+            self.eliminar(terminado.id)
+        
+        trabajo = Trabajo(formato)
+        self._trabajos[trabajo.id] = trabajo
+        trabajo.tarea = asyncio.create_task(self._ejecutar(trabajo, cuerpo))
+        self.enviados += 1
+        return trabajo
+    
+    async def _ejecutar(self, trabajo: Trabajo, cuerpo: bytes) -> None:
+        loop = asyncio.get_running_loop()
+        pendientes = deque()
+        try:
+            async with self._activos:
+                trabajo.estado = "en_curso"
+                trabajo.iniciado = time.time()
+                pool = self._obtener_pool()
+                
+                if trabajo.formato == "json":
+                    bloques = await loop.run_in_executor(pool, partir_json, cuerpo, self.lecturas_por_bloque)
+                else:
+                    bloques = partir_ndjson(cuerpo, self.lecturas_por_bloque * BYTES_POR_LECTURA_NDJSON)
+                cuerpo = None
+                trabajo.bloques_totales = len(bloques)
+                
+                # Los bloques se envían con un tope de bloques en vuelo y se guardan en el orden de entrada
+                siguiente = 0
+                while siguiente < len(bloques) or pendientes:
+                    while siguiente < len(bloques) and len(pendientes) < self.procesos:
+                        pendientes.append(loop.run_in_executor(
+                            pool, diagnosticar_bloque, bloques[siguiente], trabajo.formato, trabajo.catalogo
+                        ))
+                        bloques[siguiente] = None
+                        siguiente += 1
+                    codigos, errores = await pendientes.popleft()
+                    trabajo.agregar_bloque(codigos, errores)
+                    self.lecturas_procesadas += len(codigos)
+                
+                trabajo.estado = "completado"
+                self.completados += 1
+        except asyncio.CancelledError:
+            # Los bloques que todavía no empezaron se quitan de la cola del pool
+            for futuro in pendientes:
+                futuro.cancel()
+            trabajo.estado = "cancelado"
+            raise
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._pool = None
+            trabajo.estado = "fallido"
+            trabajo.error = str(e) or type(e).__name__
+            self.fallidos += 1
+        finally:
+            trabajo.finalizado = time.time()
+            trabajo.tarea = None
+            trabajo.avisar()
+    
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        self._purgar()
+        return self._trabajos.get(trabajo_id)
+    
+    def listar(self) -> list[dict]:
+        self._purgar()
+        return [trabajo.resumen(self.ttl_segundos) for trabajo in self._trabajos.values()]
+    
+    def eliminar(self, trabajo_id: str) -> Optional[Trabajo]:
+        """Cancela el trabajo si sigue pendiente o en curso y descarta sus resultados"""
+        trabajo = self._trabajos.pop(trabajo_id, None)
+        if trabajo is None:
+            return None
+        if trabajo.tarea is not None:
+            trabajo.tarea.cancel()
+            trabajo.estado = "cancelado"
+            self.cancelados += 1
+        trabajo.avisar()
+        return trabajo
+    
+    async def cerrar(self) -> None:
+        """Cancela los trabajos en curso y detiene el pool sin esperar los bloques pendientes"""
+        tareas = [t.tarea for t in self._trabajos.values() if t.tarea is not None]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+    
+    def estadisticas(self) -> dict:
+        estados = [trabajo.estado for trabajo in self._trabajos.values()]
+        return {
+            "trabajos": len(estados),
+            "pendientes": estados.count("pendiente"),
+            "en_curso": estados.count("en_curso"),
+            "procesos": self.procesos,
+            "enviados": self.enviados,
+            "completados": self.completados,
+            "cancelados": self.cancelados,
+            "fallidos": self.fallidos,
+            "expirados": self.expirados,
+            "lecturas_procesadas": self.lecturas_procesadas
+        }